@@ -1,6 +1,8 @@
 from Item import Item
 
 class CosmeticItem(Item):
+    __slots__ = ('survivability',)
+
     def __init__(self, id, name, price, type, description, max_quantity, probability, survivability):
         super().__init__(id, name, price, type, description, max_quantity, probability)
         self.survivability = survivability
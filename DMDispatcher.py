@@ -0,0 +1,214 @@
+import asyncio
+import time
+
+import discord
+
+
+class RateLimiter:
+    """Token bucket shared by every direct message the bot sends. discord.py already waits
+       out the per route buckets it is told about, this keeps the bot well below the global
+       limit so those waits stay rare"""
+
+    def __init__(self, rate=5, burst=5):
+        """
+        Args:
+            rate (float, optional): Requests per second, None for no limit. Defaults to 5.
+            burst (int, optional): Requests allowed back to back. Defaults to 5.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def pause(self, seconds):
+        """Stops handing out tokens for a while, after Discord answered 429"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+
+            if self.rate is None:
+                return
+
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class DMJob:
+    """Progress of the welcome messages of one guild. Members are messaged in user id order
+       and cursor is the highest id up to which every member was handled, so a job that got
+       interrupted can start again right after it"""
+
+    def __init__(self, guild_id, members, cursor=-1):
+        self.guild_id = guild_id
+        self.members = members  # members still to message, sorted by id
+        self.total = len(members)
+        self.cursor = cursor
+        self.sent = 0
+        self.skipped = 0  # members that do not accept direct messages
+        self.failed = 0
+        self.handled = [False] * len(members)
+        self.watermark = 0  # index of the first member not handled yet
+        self.started = time.monotonic()
+        self.finished = None
+        self.task = None
+
+    @property
+    def done(self):
+        return self.sent + self.skipped + self.failed
+
+    def mark(self, index, outcome):
+        """Records the outcome of one member and moves the cursor past every handled member"""
+        setattr(self, outcome, getattr(self, outcome) + 1)
+        self.handled[index] = True
+
+        while self.watermark < self.total and self.handled[self.watermark]:
+            self.cursor = self.members[self.watermark].id
+            self.watermark += 1
+
+    def progress(self):
+        seconds = (self.finished or time.monotonic()) - self.started
+
+        return {'guild_id': self.guild_id, 'total': self.total, 'sent': self.sent, 'skipped': self.skipped,
+                'failed': self.failed, 'cursor': self.cursor, 'seconds': round(seconds, 1),
+                'per_second': round(self.done / seconds, 2) if seconds else 0,
+                'finished': self.finished is not None}
+
+
+class DMDispatcher:
+    """Sends the same direct message to every member of a guild in the background, with a
+       few messages in flight at a time and all of them sharing one rate limit. Bots are
+       skipped and progress is saved as it goes, so a restart picks up where it stopped"""
+
+    def __init__(self, save_progress=None, concurrency=4, limiter=None, retries=3, save_every=50):
+        """
+        Args:
+            save_progress (Callable, optional): Coroutine function taking guild id, cursor and
+                whether the job finished, called every save_every members and at the end
+            concurrency (int, optional): Messages in flight at a time. Defaults to 4.
+            limiter (RateLimiter, optional): Rate limit shared by all jobs. Defaults to 5 per second.
+            retries (int, optional): Retries after rate limits and server errors. Defaults to 3.
+            save_every (int, optional): Members handled between progress saves. Defaults to 50.
+        """
+        self.save_progress = save_progress
+        self.concurrency = concurrency
+        self.limiter = limiter or RateLimiter()
+        self.retries = retries
+        self.save_every = save_every
+        self.jobs = {}  # guild id -> DMJob
+
+    def start(self, guild, cursor=-1, **message):
+        """Starts messaging the members of a guild and returns right away. A guild that is
+           already being messaged is not messaged twice
+
+        Args:
+            guild (discord.Guild): Guild whose members get the message
+            cursor (int, optional): Members with an id up to this one already got it. Defaults to -1.
+            **message: Arguments of discord.Member.send, like embed
+
+        Returns:
+            DMJob: Job messaging the guild
+        """
+        job = self.jobs.get(guild.id)
+
+        if job is not None and job.finished is None:
+            return job
+
+        members = sorted((member for member in guild.members if not member.bot and member.id > cursor),
+                         key=lambda member: member.id)
+        job = DMJob(guild.id, members, cursor)
+        job.task = asyncio.ensure_future(self.run(job, message))
+        self.jobs[guild.id] = job
+
+        return job
+
+    async def wait(self, guild_id):
+        """Waits for the job of a guild to finish, if there is one"""
+        job = self.jobs.get(guild_id)
+
+        if job is not None and job.task is not None:
+            await asyncio.shield(job.task)
+
+    async def run(self, job, message):
+        indexes = asyncio.Queue()
+
+        for index in range(job.total):
+            indexes.put_nowait(index)
+
+        async def worker():
+            while not indexes.empty():
+                index = indexes.get_nowait()
+                job.mark(index, await self.deliver(job.members[index], message))
+
+                if job.done % self.save_every == 0:
+                    await self.save(job, False)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, job.total))))
+        except Exception as error:
+            print(f"Welcome messages for guild {job.guild_id} stopped: {error}")
+            await self.save(job, False)
+            raise
+        finally:
+            job.finished = time.monotonic()
+
+        await self.save(job, True)
+
+    async def deliver(self, member, message):
+        """Sends the message to one member
+
+        Returns:
+            string: 'sent', 'skipped' when the member does not accept direct messages or
+                'failed' when Discord kept failing
+        """
+        for attempt in range(self.retries + 1):
+            await self.limiter.acquire()
+
+            try:
+                # send opens the direct message channel itself when there is none yet
+                await member.send(**message)
+                return 'sent'
+            except discord.Forbidden:
+                return 'skipped'
+            except discord.HTTPException as error:
+                if error.status == 429:
+                    self.limiter.pause(getattr(error, 'retry_after', None) or 2 ** attempt)
+                elif error.status >= 500:
+                    await asyncio.sleep(2 ** attempt)
+                else:
+                    return 'failed'
+
+        return 'failed'
+
+    async def save(self, job, finished):
+        if finished:
+            print(f"Welcome messages for guild {job.guild_id}: {job.sent} sent, {job.skipped} skipped, "
+                  f"{job.failed} failed in {job.finished - job.started:.0f} s")
+
+        if self.save_progress is None:
+            return
+
+        try:
+            await self.save_progress(job.guild_id, job.cursor, finished)
+        except Exception as error:  # the messages matter more than the bookmark
+            print(f"Failed to save welcome message progress of guild {job.guild_id}: {error}")
+
+    def progress(self, guild_id=None):
+        """Progress of every job, or of the job of one guild
+
+        Returns:
+            list: One dictionary per job, see DMJob.progress
+        """
+        return [job.progress() for job in self.jobs.values() if guild_id is None or job.guild_id == guild_id]
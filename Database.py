@@ -0,0 +1,155 @@
+import threading
+import time
+
+from pymongo import MongoClient
+
+# keyword arguments of Database.configure -> MongoClient option, all durations in seconds
+TIMEOUT_OPTIONS = {
+    'connect_timeout': 'connectTimeoutMS',
+    'server_selection_timeout': 'serverSelectionTimeoutMS',
+    'socket_timeout': 'socketTimeoutMS',
+    'wait_queue_timeout': 'waitQueueTimeoutMS',
+    'max_idle_time': 'maxIdleTimeMS',
+}
+POOL_OPTIONS = {
+    'max_pool_size': 'maxPoolSize',
+    'min_pool_size': 'minPoolSize',
+}
+
+
+class Database:
+    """The one MongoDB client the bot uses. The client is only created on the first
+       operation (or by warm_up), so importing the bot does not wait on the DNS lookup
+       and handshake of connecting to Atlas. main.main() configures it, warms it up while
+       the bot logs in to Discord and closes it on the way out"""
+
+    def __init__(self, name, event_listeners=()):
+        """
+        Args:
+            name (string): Name of the database holding the collections
+            event_listeners (Iterable, optional): pymongo listeners, like Metrics.listener
+        """
+        self.name = name
+        self.event_listeners = list(event_listeners)
+        self.url = None
+        self.options = {}
+        self.lock = threading.Lock()
+        self.mongo_client = None
+        self.connect_seconds = None  # how long creating the client took
+        self.warm_up_seconds = None  # how long the first round trip of warm_up took
+
+    def configure(self, url, **settings):
+        """Sets where and how to connect. Only allowed before the client exists
+
+        Args:
+            url (string): MongoDB connection string
+            **settings: max_pool_size, min_pool_size and the timeouts connect_timeout,
+                server_selection_timeout, socket_timeout, wait_queue_timeout and
+                max_idle_time in seconds. Left out settings keep pymongo's defaults
+
+        Raises:
+            RuntimeError: If the client was already created
+            TypeError: If a setting is unknown
+        """
+        with self.lock:
+            if self.mongo_client is not None:
+                raise RuntimeError('The database client already exists, configure it before using it')
+
+            options = {}
+
+            for setting, value in settings.items():
+                if value is None:
+                    continue
+                if setting in TIMEOUT_OPTIONS:
+                    options[TIMEOUT_OPTIONS[setting]] = int(value * 1000)
+                elif setting in POOL_OPTIONS:
+                    options[POOL_OPTIONS[setting]] = value
+                else:
+                    raise TypeError(f'Unknown database setting {setting}')
+
+            self.url = url
+            self.options = options
+
+    @property
+    def client(self):
+        """The client, created on first use"""
+        client = self.mongo_client
+
+        if client is None:
+            with self.lock:
+                if self.mongo_client is None:
+                    started = time.perf_counter()
+                    # with a mongodb+srv:// url this already resolves DNS
+                    self.mongo_client = MongoClient(self.url, event_listeners=self.event_listeners, **self.options)
+                    self.connect_seconds = time.perf_counter() - started
+
+                client = self.mongo_client
+
+        return client
+
+    def use(self, client):
+        """Replaces the client, for benchmarks and replays against MemoryMongo
+
+        Args:
+            client (MongoClient): Client to use from now on
+        """
+        with self.lock:
+            self.mongo_client = client
+
+    def collection(self, name):
+        """Gets a collection that connects on first use
+
+        Args:
+            name (string): Name of the collection
+
+        Returns:
+            LazyCollection: Stand-in forwarding to the collection of the current client
+        """
+        return LazyCollection(self, name)
+
+    def warm_up(self):
+        """Creates the client and makes one round trip, so the first command does not pay
+           for connecting. minPoolSize connections are opened in the background afterwards
+
+        Returns:
+            float: Seconds until the database answered
+        """
+        started = time.perf_counter()
+        self.client[self.name].command('ping')
+        self.warm_up_seconds = time.perf_counter() - started
+
+        return self.warm_up_seconds
+
+    def close(self):
+        with self.lock:
+            if self.mongo_client is not None:
+                self.mongo_client.close()
+
+            self.mongo_client = None
+
+    def stats(self):
+        return {'connected': self.mongo_client is not None, 'options': dict(self.options),
+                'connect_seconds': self.connect_seconds, 'warm_up_seconds': self.warm_up_seconds}
+
+
+class LazyCollection:
+    """Forwards everything to a collection of the current client of a Database, so modules
+       can hold on to their collections from import on without connecting"""
+
+    def __init__(self, database, name):
+        self.manager = database  # not .database, which pymongo collections already have
+        self.name = name
+        self.resolved = (None, None)  # (client, collection) the last lookup was made for
+
+    def __getattr__(self, attribute):
+        client = self.manager.client
+        resolved_client, collection = self.resolved
+
+        if resolved_client is not client:
+            collection = client[self.manager.name][self.name]
+            self.resolved = (client, collection)
+
+        return getattr(collection, attribute)
+
+    def __repr__(self):
+        return f'LazyCollection({self.manager.name}.{self.name})'
@@ -2,6 +2,8 @@ from EdibleItem import EdibleItem
 
 
 class DrinkItem(EdibleItem):
+    __slots__ = ('is_alcohol',)
+
     def __init__(self, id, name, price, type, description, max_quantity, probability, energy, is_alcohol):
         super().__init__(id, name, price, type, description, max_quantity, probability, energy)
         self.is_alcohol = is_alcohol
@@ -0,0 +1,165 @@
+import functools
+import gzip
+import json
+import random
+import time
+
+import bot_utils
+
+FORMAT_VERSION = 1
+
+# handler name -> short code used in the file
+EVENT_CODES = {
+    'on_message': 'm',
+    'on_message_edit': 'e',
+    'on_message_delete': 'd',
+    'on_typing': 't',
+    'on_reaction_add': 'ra',
+    'on_reaction_remove': 'rr',
+    'on_voice_state_update': 'v',
+    'on_member_join': 'j',
+    'on_member_remove': 'l',
+}
+
+
+def open_log(path, mode):
+    """Opens an event log, gzip compressed if the path ends with .gz"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+
+    return open(path, mode, encoding='utf-8')
+
+
+def event_seed(seed, sequence):
+    """Seed of the random.Random an event runs with, the same when recording and replaying"""
+    return f'{seed}:{sequence}'
+
+
+def guild_id(guild):
+    return guild.id if guild is not None else None
+
+
+def encode_user(user):
+    return [user.id, int(user.bot)]
+
+
+def encode_message(message, prefix):
+    """Keeps what the handlers look at. Plain messages only keep their length, commands
+       keep their text so they can be run again"""
+    content = message.content if message.content.startswith(prefix) else len(message.content)
+
+    return [guild_id(message.guild), message.channel.id, message.id, encode_user(message.author), content,
+            len(message.attachments), len(message.role_mentions), int(message.mention_everyone),
+            [user.id for user in message.mentions]]
+
+
+def encode_voice_state(state):
+    channel = state.channel.id if state.channel is not None else None
+    return [channel, int(state.self_mute), int(state.self_deaf), int(state.mute), int(state.deaf), int(state.afk)]
+
+
+class EventRecorder:
+    """Appends the gateway events the bot handles to a compact log that replay.py can run
+       again. Every line is a JSON array [milliseconds since start, event code, *arguments].
+       Commands are messages, so they are recorded with the message that invoked them.
+       Every event also gets its own seeded random.Random, so gambling and exploring roll
+       the same when the log is replayed"""
+
+    def __init__(self, path, seed=None, prefix='$', flush_every=100):
+        """
+        Args:
+            path (string): File to append to, compressed if it ends with .gz
+            seed (int, optional): Seed of the per event randomness. Defaults to a random seed.
+            prefix (string, optional): Command prefix. Defaults to '$'.
+            flush_every (int, optional): Events buffered before they are written. Defaults to 100.
+        """
+        self.path = path
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.prefix = prefix
+        self.flush_every = flush_every
+        self.file = open_log(path, 'a')
+        self.started = time.monotonic()
+        self.sequence = 0
+        self.pending = 0
+        self.write({'version': FORMAT_VERSION, 'seed': self.seed, 'started': time.time(), 'prefix': self.prefix})
+
+    def install(self, bot):
+        """Records every event the bot has a handler for in EVENT_CODES
+
+        Args:
+            bot (discord.ext.commands.Bot): Bot with its handlers already registered
+        """
+        for name in EVENT_CODES:
+            handler = vars(bot).get(name)
+
+            if handler is not None:
+                setattr(bot, name, self.recorded(name, handler))
+
+    def recorded(self, name, handler):
+        @functools.wraps(handler)
+        async def wrapper(*args):
+            try:
+                sequence = self.record(name, *args)
+            except Exception as error:  # never let recording break the bot
+                print(f"Failed to record {name}: {error}")
+                return await handler(*args)
+
+            token = bot_utils.event_rng.set(random.Random(event_seed(self.seed, sequence)))
+
+            try:
+                return await handler(*args)
+            finally:
+                bot_utils.event_rng.reset(token)
+
+        return wrapper
+
+    def encode(self, name, *args):
+        """Arguments of a handler call as they are stored in the log"""
+        if name == 'on_message':
+            message, = args
+            return [encode_message(message, self.prefix)]
+        if name == 'on_message_edit':
+            before, after = args
+            return [encode_message(before, self.prefix), encode_message(after, self.prefix)]
+        if name == 'on_message_delete':
+            message, = args
+            return [encode_message(message, self.prefix)]
+        if name == 'on_typing':
+            channel, user, _ = args
+            return [guild_id(getattr(channel, 'guild', None)), channel.id, encode_user(user)]
+        if name in ('on_reaction_add', 'on_reaction_remove'):
+            reaction, user = args
+            return [guild_id(reaction.message.guild), reaction.message.id, encode_user(user)]
+        if name == 'on_voice_state_update':
+            member, before, after = args
+            return [guild_id(member.guild), encode_user(member), encode_voice_state(before), encode_voice_state(after)]
+
+        member, = args  # on_member_join and on_member_remove
+        return [guild_id(member.guild), encode_user(member)]
+
+    def record(self, name, *args):
+        """Appends one event to the log
+
+        Returns:
+            int: Sequence number of the event, counting from 1
+        """
+        milliseconds = int((time.monotonic() - self.started) * 1000)
+        entry = [milliseconds, EVENT_CODES[name], *self.encode(name, *args)]
+        self.sequence += 1
+        self.write(entry)
+
+        return self.sequence
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self.pending += 1
+
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.pending = 0
+
+    def close(self):
+        self.file.close()
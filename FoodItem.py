@@ -1,5 +1,7 @@
 from EdibleItem import EdibleItem
 
 class FoodItem(EdibleItem):
+    __slots__ = ()
+
     def __init__(self, id, name, price, type, description, max_quantity, probability, energy):
         super().__init__(id, name, price, type, description, max_quantity, probability, energy)
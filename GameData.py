@@ -0,0 +1,130 @@
+import json
+import os
+import time
+
+from ItemCatalog import ItemCatalog
+from LootTable import load_locations
+
+ITEMS_PATH = 'items.json'
+LOCATIONS_PATH = 'locations.json'
+
+
+class GameData:
+    """One consistent version of the item catalog and the loot tables built from it.
+       A GameData never changes once built; reloading builds a new one and swaps the
+       reference, so a command that grabbed a version keeps using it until it is done"""
+
+    def __init__(self, catalog, locations, version, sources):
+        self.catalog = catalog  # ItemCatalog
+        self.locations = locations  # location name -> Location
+        self.version = version
+        self.sources = sources  # path -> modification time the data was built from
+        self.loaded_at = time.time()
+
+    @classmethod
+    def load(cls, version=1, items_path=ITEMS_PATH, locations_path=LOCATIONS_PATH, required_items=(),
+             required_ids=()):
+        """Builds and validates the game data from the json files
+
+        Args:
+            version (int, optional): Version number of the new data. Defaults to 1.
+            items_path (string, optional): Path of the item data. Defaults to 'items.json'.
+            locations_path (string, optional): Path of the location data. Defaults to 'locations.json'.
+            required_items (Iterable[string], optional): Names of items that have to exist, like
+                the ones sold in the shop. Defaults to ().
+            required_ids (Iterable[string], optional): Ids of items that have to exist, like the
+                ones of the data in use that players may hold. Defaults to ().
+
+        Raises:
+            ValueError: If the files describe invalid items or locations
+
+        Returns:
+            GameData: The new game data
+        """
+        # read the times first so a change made while loading gets picked up by the next check
+        sources = {path: os.path.getmtime(path) for path in (items_path, locations_path)}
+
+        with open(items_path) as items_file:
+            items_data = json.load(items_file)
+
+        with open(locations_path) as locations_file:
+            locations_data = json.load(locations_file)
+
+        validate(items_data, locations_data, required_ids)
+
+        try:
+            catalog = ItemCatalog(items_data, locations_data)
+            # the data validated above, the file could have changed since
+            locations = load_locations(catalog, locations_data)
+        except (KeyError, TypeError) as error:
+            raise ValueError(f'invalid game data: {error!r}') from error
+
+        missing = [name for name in required_items if catalog.find(name) is None]
+
+        if missing:
+            raise ValueError(f"missing required items {', '.join(missing)}")
+
+        return cls(catalog, locations, version, sources)
+
+    def current_sources(self):
+        """Modification times the source files have right now, None if one can't be read"""
+        try:
+            return {path: os.path.getmtime(path) for path in self.sources}
+        except OSError:
+            # a file in the middle of being replaced, check again later
+            return None
+
+
+def validate(items_data, locations_data, required_ids=()):
+    """Checks the item and location data before it replaces the data in use
+
+    Args:
+        items_data (dict): Contents of items.json
+        locations_data (dict): Contents of locations.json
+        required_ids (Iterable[string], optional): Ids of items that have to exist. Defaults to ().
+
+    Raises:
+        ValueError: Describing every problem found
+    """
+    problems = []
+    required = ('type', 'name', 'price', 'description', 'max_quantity', 'probability')
+
+    for item_id, item in items_data.items():
+        missing = [field for field in required if field not in item]
+
+        if missing:
+            problems.append(f"item {item_id} is missing {', '.join(missing)}")
+            continue
+
+        if not 0 <= item['probability'] <= 1:
+            problems.append(f"item {item_id} has a probability outside of 0-1")
+        if item['max_quantity'] < 1:
+            problems.append(f"item {item_id} has a max_quantity below 1")
+
+    # inventories keep item ids, an item that disappears would break every inventory holding it
+    removed = sorted(str(item_id) for item_id in required_ids if str(item_id) not in items_data)
+
+    if removed:
+        problems.append(f"items {', '.join(removed)} were removed but may still be held by players")
+
+    for name, location in locations_data.items():
+        for field in ('energy_cost', 'items'):
+            if field not in location:
+                problems.append(f"location {name} is missing {field}")
+
+        if 'energy_cost' in location and not is_count(location['energy_cost'], 0):
+            problems.append(f"location {name} has an energy_cost that is not a whole number of at least 0")
+        if 'rolls' in location and not is_count(location['rolls'], 1):
+            problems.append(f"location {name} has rolls that are not a whole number of at least 1")
+
+        for item_id in location.get('items', []):
+            if item_id not in items_data:
+                problems.append(f"location {name} has unknown item {item_id}")
+
+    if problems:
+        raise ValueError('; '.join(problems))
+
+
+def is_count(value, minimum):
+    """Whether a value from the json files is an integer of at least minimum, booleans do not count"""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= minimum
@@ -1,4 +1,6 @@
 class Item:
+    __slots__ = ('id', 'name', 'price', 'type', 'description', 'max_quantity', 'probability')
+
     def __init__(self, id, name, price, type, description, max_quantity, probability):
         self.id = id
         self.name = name
@@ -7,3 +9,13 @@ class Item:
         self.description = description
         self.max_quantity = max_quantity
         self.probability = probability
+
+    def __setattr__(self, name, value):
+        # items are shared by every command through the catalog, so they are read only once set
+        if hasattr(self, name):
+            raise AttributeError(f"can't change {name} of {type(self).__name__} {self.name!r}")
+
+        super().__setattr__(name, value)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.id!r}, {self.name!r})'
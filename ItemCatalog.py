@@ -0,0 +1,125 @@
+from types import MappingProxyType
+
+from BottleItem import BottleItem
+from CosmeticItem import CosmeticItem
+from DrinkItem import DrinkItem
+from EdibleItem import EdibleItem
+from FoodItem import FoodItem
+from Item import Item
+from ItemType import ItemType
+
+# item class for every "type" used in items.json, anything else is a plain Item
+ITEM_CLASSES = {
+    'Item': Item,
+    'FoodItem': FoodItem,
+    'DrinkItem': DrinkItem,
+    'CosmeticItem': CosmeticItem,
+    'BottleItem': BottleItem,
+}
+
+# fields of items.json passed to each class after the ones every item has
+EXTRA_FIELDS = {
+    Item: (),
+    FoodItem: ('energy',),
+    DrinkItem: ('energy', 'is_alcohol'),
+    CosmeticItem: ('survivability',),
+    BottleItem: ('message', 'object'),
+}
+
+DEFAULT_ITEM_TYPES = {
+    Item: ItemType.JUNK,
+    FoodItem: ItemType.CONSUMABLE,
+    DrinkItem: ItemType.CONSUMABLE,
+    CosmeticItem: ItemType.ARMOR,
+    BottleItem: ItemType.JUNK,
+}
+
+
+def build_item(item_id, data):
+    """Creates the item object for an entry of items.json
+
+    Args:
+        item_id (string): Key of the entry
+        data (dict): Entry from items.json
+
+    Returns:
+        Item: Item of the matching class
+    """
+    item_class = ITEM_CLASSES.get(data['type'], Item)
+
+    if 'item_type' in data:
+        item_type = ItemType[data['item_type']]
+    elif data.get('is_alcohol'):
+        item_type = ItemType.ALCOHOL
+    else:
+        item_type = DEFAULT_ITEM_TYPES[item_class]
+
+    extra = [data.get(field) for field in EXTRA_FIELDS[item_class]]
+
+    return item_class(item_id, data['name'], data['price'], item_type, data['description'],
+                      data['max_quantity'], data['probability'], *extra)
+
+
+def group(items, key):
+    """Groups items into a read only mapping of tuples"""
+    groups = {}
+
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+
+    return MappingProxyType({name: tuple(members) for name, members in groups.items()})
+
+
+class ItemCatalog:
+    """Every item of the game, built once from items.json. Nothing in it changes after it
+       is built and every question about items is answered with a single lookup"""
+
+    def __init__(self, items_data, locations_data=None):
+        """
+        Args:
+            items_data (dict): Contents of items.json
+            locations_data (dict, optional): Contents of locations.json, used for by_location
+        """
+        items = [build_item(item_id, data) for item_id, data in items_data.items()]
+
+        self.by_id = MappingProxyType({item.id: item for item in items})
+        # names are not unique in items.json, the last item with a name wins
+        self.by_name = MappingProxyType({item.name: item for item in items})
+        self.by_class = group(items, lambda item: type(item).__name__)
+        self.by_type = group(items, lambda item: item.type)
+        self.alcohol = frozenset(item.id for item in items if getattr(item, 'is_alcohol', False))
+        self.edible = frozenset(item.id for item in items if isinstance(item, EdibleItem))
+        self.by_location = MappingProxyType({
+            name: tuple(self.by_id[item_id] for item_id in location['items'])
+            for name, location in (locations_data or {}).items()
+        })
+
+    def get(self, item_id):
+        """Gets an item by id, None if there is no such item"""
+        return self.by_id.get(str(item_id))
+
+    def find(self, name):
+        """Gets an item by name, None if there is no such item"""
+        return self.by_name.get(name)
+
+    def kind(self, name):
+        """Gets the ids of every item of a kind, named either after its class ("food",
+           "cosmetic") or its item type ("junk", "alcohol"). None if nothing has that name
+
+        Args:
+            name (string): Name of the kind
+
+        Returns:
+            frozenset: Ids of the items of that kind
+        """
+        name = name.lower()
+
+        if name == 'alcohol':
+            return self.alcohol
+
+        items = self.by_class.get(f'{name.title()}Item')
+
+        if items is None and name.upper() in ItemType.__members__:
+            items = self.by_type.get(ItemType[name.upper()], ())
+
+        return None if items is None else frozenset(item.id for item in items)
@@ -0,0 +1,194 @@
+import threading
+import time
+from bisect import bisect_left, insort
+
+
+class Leaderboard:
+    """XP ranking of a single guild kept sorted as xp changes, bots are never added"""
+
+    def __init__(self, members):
+        """
+        Args:
+            members (Iterable[dict]): Member documents (user_id, xp, level, bot) of the guild
+        """
+        self.members = {}  # user id -> (xp, level)
+        self.ranking = []  # (-xp, user id) sorted from most to least xp
+        self.excluded = set()  # ids of bots
+        self.loaded_at = time.monotonic()
+        self.stale = False  # set when a change can not be applied, forces a reload
+
+        for member in members:
+            if member.get('bot'):
+                self.excluded.add(member['user_id'])
+                continue
+
+            self.members[member['user_id']] = (member['xp'], member['level'])
+            self.ranking.append((-member['xp'], member['user_id']))
+
+        self.ranking.sort()
+
+    def set(self, user_id, xp, level):
+        """Sets the xp and level of a member, adding them if needed"""
+        self.remove(user_id)
+        self.members[user_id] = (xp, level)
+        insort(self.ranking, (-xp, user_id))
+
+    def remove(self, user_id):
+        """Removes a member from the ranking if they are in it"""
+        if user_id in self.members:
+            xp, _ = self.members.pop(user_id)
+            del self.ranking[bisect_left(self.ranking, (-xp, user_id))]
+
+    def page(self, page, page_size=10):
+        """Gets one page of the ranking
+
+        Args:
+            page (int): Page number starting at 1
+            page_size (int, optional): Entries per page. Defaults to 10.
+
+        Returns:
+            List[Tuple[int, int, int, int]]: (position, user id, xp, level) of every entry on the page
+        """
+        start = (page - 1) * page_size
+
+        return [(start + offset + 1, user_id, -negative_xp, self.members[user_id][1])
+                for offset, (negative_xp, user_id) in enumerate(self.ranking[start:start + page_size])]
+
+    def page_count(self, page_size=10):
+        return max(1, -(-len(self.ranking) // page_size))
+
+
+class LeaderboardIndex:
+    """Leaderboards of every guild that was looked at, updated by the xp write paths.
+       Guilds are loaded on first use and reloaded after max_age seconds to correct drift"""
+
+    LOAD_ATTEMPTS = 3  # loads of a guild that keeps changing before it is kept as stale
+
+    def __init__(self, level_after, max_age=3600):
+        """
+        Args:
+            level_after (Callable[[int, int], int]): Gives the level a member ends up at
+                given their previous level and new xp, mirrors the server side level up
+            max_age (int, optional): Seconds before a leaderboard gets rebuilt. Defaults to 3600.
+        """
+        self.level_after = level_after
+        self.max_age = max_age
+        self.boards = {}  # guild id -> Leaderboard
+        self.changes = {}  # guild id -> number of updates so far, loaded or not
+        self.lock = threading.Lock()
+
+    def version(self, guild_id):
+        """Number of updates to a guild so far, taken before reading documents for get"""
+        with self.lock:
+            return self.changes.get(guild_id, 0)
+
+    def changed(self, guild_id):
+        """Counts an update, a load running meanwhile may have missed it. Called with the lock held"""
+        self.changes[guild_id] = self.changes.get(guild_id, 0) + 1
+
+    def get(self, guild_id, loader, since=None):
+        """Gets the leaderboard of a guild, building it with loader if needed. The database
+           is read outside the lock, if an update arrives meanwhile it is loaded again
+
+        Args:
+            guild_id (int): Id of the guild
+            loader (Callable): Returns the member documents to build the leaderboard from,
+                called again after an update and then has to read them again
+            since (int, optional): version from before the first call of loader read its
+                documents, if they were read before calling get. Defaults to None.
+
+        Returns:
+            Leaderboard: Leaderboard of the guild
+        """
+        with self.lock:
+            board = self.boards.get(guild_id)
+
+            if board is not None and not board.stale and time.monotonic() - board.loaded_at < self.max_age:
+                return board
+
+            version = self.changes.get(guild_id, 0) if since is None else since
+
+        for _ in range(self.LOAD_ATTEMPTS):
+            board = Leaderboard(loader())
+
+            with self.lock:
+                current = self.changes.get(guild_id, 0)
+
+                if current == version:
+                    self.boards[guild_id] = board
+                    return board
+
+            version = current
+
+        # still changing, good enough for now and rebuilt on the next use
+        board.stale = True
+
+        with self.lock:
+            self.boards[guild_id] = board
+
+        return board
+
+    def page(self, guild_id, loader, page, page_size=10):
+        """Gets one page of a guild's leaderboard, consistent even while xp is being written
+
+        Args:
+            guild_id (int): Id of the guild
+            loader (Callable): Returns the member documents to build the leaderboard from
+            page (int): Page number starting at 1
+            page_size (int, optional): Entries per page. Defaults to 10.
+
+        Returns:
+            Tuple[List[Tuple[int, int, int, int]], int]: Entries on the page and the number of pages
+        """
+        board = self.get(guild_id, loader)
+
+        with self.lock:
+            return board.page(page, page_size), board.page_count(page_size)
+
+    def add_xp(self, guild_id, user_id, xp):
+        """Applies an xp change that was just written to the database"""
+        with self.lock:
+            self.changed(guild_id)
+            board = self.boards.get(guild_id)
+
+            if board is None or xp == 0:
+                return
+
+            if user_id not in board.members:
+                # either a bot or someone whose total is unknown here
+                board.stale = board.stale or user_id not in board.excluded
+                return
+
+            total, level = board.members[user_id]
+            total += xp
+            board.set(user_id, total, self.level_after(level, total))
+
+    def reset(self, guild_id, user_id, is_bot=False):
+        """Puts a member back at the starting xp and level"""
+        with self.lock:
+            self.changed(guild_id)
+            board = self.boards.get(guild_id)
+
+            if board is None:
+                return
+
+            if is_bot:
+                board.excluded.add(user_id)
+            else:
+                board.set(user_id, 0, 1)
+
+    def remove(self, guild_id, user_id):
+        """Removes a member that left the guild"""
+        with self.lock:
+            self.changed(guild_id)
+            board = self.boards.get(guild_id)
+
+            if board is not None:
+                board.remove(user_id)
+                board.excluded.discard(user_id)
+
+    def invalidate(self, guild_id):
+        """Forces the leaderboard of a guild to be rebuilt on next use"""
+        with self.lock:
+            self.changed(guild_id)
+            self.boards.pop(guild_id, None)
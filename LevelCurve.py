@@ -0,0 +1,169 @@
+from bisect import bisect_right
+
+# rank of every level, starting at level 1
+RANKS = ['F5', 'F4', 'F3', 'F2', 'F1',
+         'E5', 'E4', 'E3', 'E2', 'E1',
+         'D5', 'D4', 'D3', 'D2', 'D1',
+         'C3', 'C2', 'C1',
+         'B3', 'B2', 'B1',
+         'A3', 'A2', 'A1',
+         'S2', 'S1',
+         'SS']
+
+
+def rank_for_level(level):
+    """Gets the rank shown for a level, None past the last rank"""
+    return RANKS[level - 1] if 1 <= level <= len(RANKS) else None
+
+
+class LevelCurve:
+    """Xp needed for every level and the points paid for reaching it. Leaving level L
+       takes a * L^2 + b * L xp in total. The thresholds and the running total of the
+       payouts are precomputed, so the level for any amount of xp is a bisect and the
+       points for jumping several levels at once a subtraction"""
+
+    def __init__(self, a, b, payouts, max_payout, table_levels=1000):
+        """
+        Args:
+            a (int): Quadratic coefficient of the curve
+            b (int): Linear coefficient of the curve
+            payouts (List[Tuple[int, int]]): (highest level, points) brackets of the level up payout
+            max_payout (int): Points for reaching a level past the last bracket
+            table_levels (int, optional): Levels precomputed, higher levels are solved for. Defaults to 1000.
+        """
+        self.a = a
+        self.b = b
+        self.payouts = payouts
+        self.max_payout = max_payout
+        # thresholds[i]: total xp needed to leave level i + 1
+        self.thresholds = [self.threshold(level) for level in range(1, table_levels + 1)]
+        # cumulative[L]: points paid for reaching every level from 2 up to L
+        self.cumulative = [0, 0]
+
+        for level in range(2, table_levels + 2):
+            self.cumulative.append(self.cumulative[-1] + self.payout(level))
+
+    def threshold(self, level):
+        """Total xp needed to leave the given level"""
+        return self.a * level * level + self.b * level
+
+    def payout(self, level):
+        """Points paid for reaching the given level"""
+        for max_level, points in self.payouts:
+            if level <= max_level:
+                return points
+
+        return self.max_payout
+
+    def level_for(self, xp):
+        """Level that a total amount of xp reaches"""
+        if xp < self.thresholds[-1]:
+            return bisect_right(self.thresholds, xp) + 1
+
+        # past the table, solve a * L^2 + b * L <= xp for the largest L
+        level = int((-self.b + (self.b * self.b + 4 * self.a * xp) ** 0.5) / (2 * self.a))
+
+        while self.threshold(level + 1) <= xp:
+            level += 1
+        while self.threshold(level) > xp:
+            level -= 1
+
+        return level + 1
+
+    def level_after(self, level, xp):
+        """Level a member ends up at after their xp changed. Levels are never lost"""
+        return max(level, self.level_for(xp))
+
+    def payout_between(self, old_level, new_level):
+        """Points paid for going from old_level to new_level, every level in between counts"""
+        return max(0, self.total_payout(new_level) - self.total_payout(old_level))
+
+    def total_payout(self, level):
+        last = len(self.cumulative) - 1
+
+        if level <= last:
+            return self.cumulative[max(level, 0)]
+
+        return self.cumulative[last] + self.max_payout * (level - last)
+
+    def threshold_expr(self, level):
+        """Aggregation expression for threshold"""
+        return {'$add': [{'$multiply': [self.a, level, level]}, {'$multiply': [self.b, level]}]}
+
+    def level_expr(self, xp):
+        """Aggregation expression for level_for, solving the curve for the xp and
+           correcting the rounding of the square root
+
+        Args:
+            xp: Aggregation expression evaluating to the total xp
+
+        Returns:
+            dict: Aggregation expression evaluating to the level
+        """
+        xp = {'$max': [xp, 0]}
+        root = {'$divide': [{'$add': [-self.b, {'$sqrt': {'$add': [self.b * self.b, {'$multiply': [4 * self.a, xp]}]}}]},
+                            2 * self.a]}
+
+        return {'$let': {
+            'vars': {'level': {'$toInt': {'$floor': root}}},
+            'in': {'$add': [
+                '$$level', 1,
+                {'$cond': [{'$lte': [self.threshold_expr({'$add': ['$$level', 1]}), xp]}, 1, 0]},
+                {'$cond': [{'$gt': [self.threshold_expr('$$level'), xp]}, -1, 0]},
+            ]}
+        }}
+
+    def payout_expr(self, old_level, new_level):
+        """Aggregation expression for payout_between, one term per payout bracket
+
+        Args:
+            old_level: Aggregation expression evaluating to the level before
+            new_level: Aggregation expression evaluating to the level after
+
+        Returns:
+            dict: Aggregation expression evaluating to the points paid
+        """
+        terms = []
+        lowest = 1  # nothing is paid for level 1
+
+        for max_level, points in self.payouts:
+            levels = {'$subtract': [{'$min': ['$$to', max_level]}, {'$max': ['$$from', lowest]}]}
+            terms.append({'$multiply': [points, {'$max': [levels, 0]}]})
+            lowest = max_level
+
+        levels = {'$subtract': ['$$to', {'$max': ['$$from', lowest]}]}
+        terms.append({'$multiply': [self.max_payout, {'$max': [levels, 0]}]})
+
+        return {'$let': {'vars': {'from': old_level, 'to': new_level}, 'in': {'$add': terms}}}
+
+    def rebalance(self, levels, xp):
+        """Recomputes the levels of many members at once, after the curve changed. Levels
+           follow the xp on the new curve, members that go up are paid for the levels they
+           gain and members that go down keep their points. Needs NumPy
+
+        Args:
+            levels (numpy.ndarray): Current levels
+            xp (numpy.ndarray): Total xp of the same members
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray]: New levels and points to add
+        """
+        import numpy  # only needed by rebalance_levels.py, the bot runs without it
+
+        levels = numpy.asarray(levels, dtype=numpy.int64)
+        xp = numpy.maximum(numpy.asarray(xp, dtype=numpy.int64), 0)
+        new_levels = numpy.searchsorted(numpy.asarray(self.thresholds), xp, side='right') + 1
+
+        for index in numpy.flatnonzero(xp >= self.thresholds[-1]):
+            new_levels[index] = self.level_for(int(xp[index]))
+
+        cumulative = numpy.asarray(self.cumulative, dtype=numpy.int64)
+        last = len(cumulative) - 1
+
+        def total(level):
+            clipped = numpy.clip(level, 0, last)
+            return cumulative[clipped] + self.max_payout * numpy.maximum(level - last, 0)
+
+        points = numpy.maximum(total(new_levels) - total(levels), 0)
+
+        return new_levels, points
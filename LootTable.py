@@ -0,0 +1,110 @@
+import random
+
+
+class LootTable:
+    """Samples what is found while exploring in constant time per draw (alias method).
+
+       Exploring used to pick a random item up to `rolls` times and keep it with the
+       item's probability. The chance of ending up with each item (or nothing) after
+       those rolls is worked out once here, so a single draw gives the same result"""
+
+    def __init__(self, items, rolls=1):
+        """
+        Args:
+            items (List[Tuple[string, float]]): (item id, probability) of every item that can be found
+            rolls (int, optional): Attempts made per exploration. Defaults to 1.
+        """
+        count = len(items)
+        # chance a single roll finds nothing
+        miss = 1 - sum(probability for _, probability in items) / count if count else 1
+        # chance at least one of the rolls finds something, spread over the items
+        found = (1 - miss ** rolls) / (1 - miss) if miss < 1 else 0
+
+        self.outcomes = [item_id for item_id, _ in items] + [None]
+        weights = [probability / count * found for _, probability in items] + [miss ** rolls]
+        self.probabilities, self.aliases = self.build_alias(weights)
+
+    @staticmethod
+    def build_alias(weights):
+        """Builds the probability and alias tables of Vose's alias method
+
+        Args:
+            weights (List[float]): Weight of every outcome, does not need to add up to 1
+
+        Returns:
+            Tuple[List[float], List[int]]: Probability and alias of every column
+        """
+        count = len(weights)
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights]
+        probabilities = [1.0] * count
+        aliases = list(range(count))
+        small = [index for index, weight in enumerate(scaled) if weight < 1]
+        large = [index for index, weight in enumerate(scaled) if weight >= 1]
+
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            probabilities[less] = scaled[less]
+            aliases[less] = more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+
+        # whatever is left is 1 up to rounding errors
+        return probabilities, aliases
+
+    def draw(self, rng=random):
+        """Draws what a single exploration finds
+
+        Args:
+            rng (random.Random, optional): Source of randomness. Defaults to the random module.
+
+        Returns:
+            string: Id of the item found, None if nothing was found
+        """
+        column = rng.randrange(len(self.outcomes))
+        return self.outcomes[column if rng.random() < self.probabilities[column] else self.aliases[column]]
+
+    def draw_many(self, count, rng=random):
+        """Draws the results of several explorations at once
+
+        Args:
+            count (int): Number of explorations
+            rng (random.Random, optional): Source of randomness. Defaults to the random module.
+
+        Returns:
+            List[string]: Item id (or None) found by each exploration
+        """
+        return [self.draw(rng) for _ in range(count)]
+
+
+class Location:
+    """Place that can be explored, declared in locations.json"""
+
+    def __init__(self, name, energy_cost, loot, enter_image=None, exit_image=None):
+        self.name = name
+        self.energy_cost = energy_cost
+        self.loot = loot  # LootTable
+        self.enter_image = enter_image
+        self.exit_image = exit_image
+
+
+def load_locations(catalog, data):
+    """Compiles the loot tables of the locations
+
+    Args:
+        catalog (ItemCatalog): Catalog of every item, used for the probabilities
+        data (dict): Contents of locations.json, already validated
+
+    Returns:
+        dict: Location keyed by name
+    """
+    locations = {}
+
+    for name, location in data.items():
+        loot = LootTable([(item.id, item.probability) for item in catalog.by_location[name]],
+                         location.get('rolls', 1))
+        locations[name] = Location(name, location['energy_cost'], loot,
+                                   location.get('enter_image'), location.get('exit_image'))
+
+    return locations
@@ -0,0 +1,105 @@
+import asyncio
+import io
+import os
+import time
+
+import discord
+
+
+class MediaCache:
+    """Images the bot sends over and over, like the explore and cheers GIFs. Files are
+       read into memory once, uploaded the first time they are sent and from then on
+       shown by linking the uploaded copy on Discord's CDN in an embed. Missing files are
+       skipped instead of failing the command"""
+
+    def __init__(self, max_age=12 * 60 * 60):
+        """
+        Args:
+            max_age (int, optional): Seconds an uploaded copy is linked before the file is
+                uploaded again, Discord's CDN links expire. Defaults to 12 hours.
+        """
+        self.max_age = max_age
+        self.data = {}  # path -> file contents
+        self.missing = set()  # paths that could not be read
+        self.urls = {}  # path -> (uploaded at, CDN url)
+        self.locks = {}  # path -> asyncio.Lock, one upload per file at a time
+        self.uploads = 0
+        self.reuses = 0
+
+    def preload(self, paths):
+        """Reads files into memory. Meant to run at startup, not while handling commands
+
+        Args:
+            paths (Iterable[string]): Files to read, None entries are ignored
+        """
+        for path in paths:
+            if path is None or path in self.data:
+                continue
+
+            try:
+                with open(path, 'rb') as file:
+                    self.data[path] = file.read()
+            except OSError as error:
+                if path not in self.missing:
+                    print(f"Skipping media {path}: {error}")
+
+                self.missing.add(path)
+            else:
+                self.missing.discard(path)
+
+    def url(self, path):
+        """Gets the CDN url of an uploaded file, None if it was not uploaded or the link is too old"""
+        entry = self.urls.get(path)
+
+        if entry is None or time.monotonic() - entry[0] > self.max_age:
+            return None
+
+        return entry[1]
+
+    async def send(self, destination, path, color=None):
+        """Sends a file, uploading it only if there is no usable uploaded copy yet
+
+        Args:
+            destination (discord.abc.Messageable): Where to send the file
+            path (string): File to send
+            color (int, optional): Color of the embed linking the uploaded copy
+
+        Returns:
+            discord.Message: Message that was sent, None if the file is missing
+        """
+        url = self.url(path)
+
+        if url is None:
+            if path not in self.data:
+                # not preloaded, read it now once rather than failing the command
+                self.preload([path])
+
+            if path not in self.data:
+                return None
+
+            async with self.locks.setdefault(path, asyncio.Lock()):
+                url = self.url(path)
+
+                if url is None:
+                    return await self.upload(destination, path)
+
+        self.reuses += 1
+        embed = discord.Embed(color=color) if color is not None else discord.Embed()
+        embed.set_image(url=url)
+
+        return await destination.send(embed=embed)
+
+    async def upload(self, destination, path):
+        message = await destination.send(
+            file=discord.File(io.BytesIO(self.data[path]), filename=os.path.basename(path)))
+        self.uploads += 1
+        attachments = getattr(message, 'attachments', None)
+
+        if attachments:
+            self.urls[path] = (time.monotonic(), attachments[0].url)
+
+        return message
+
+    def stats(self):
+        return {'files': len(self.data), 'bytes': sum(len(data) for data in self.data.values()),
+                'missing': sorted(self.missing), 'uploads': self.uploads, 'reuses': self.reuses}
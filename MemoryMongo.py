@@ -0,0 +1,981 @@
+"""In-process stand-in for the parts of pymongo the bot uses, for benchmarks and replays
+that run without Atlas.
+
+Documents live in dicts guarded by one lock per collection, so every operation is
+atomic on its own like a single document write in MongoDB. Filters, update operators,
+update pipelines and unique indexes follow MongoDB's rules for the operators the bot
+uses. Anything else raises NotImplementedError instead of silently doing the wrong thing.
+"""
+import copy
+import threading
+import time
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from Metrics import encoded_size
+
+DUPLICATE_KEY_ERROR = 11000
+TYPE_MISMATCH = 14  # an update expression got a value of the wrong type
+REMOVE = object()  # value of $$REMOVE
+MISSING = object()  # value of a field path that does not exist
+
+
+def get_path(doc, path):
+    """Gets the value at a dotted path, MISSING if it does not exist"""
+    value = doc
+
+    for key in path.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return MISSING
+
+        value = value[key]
+
+    return value
+
+
+def set_path(doc, path, value):
+    keys = path.split('.')
+
+    for key in keys[:-1]:
+        if not isinstance(doc.get(key), dict):
+            doc[key] = {}
+
+        doc = doc[key]
+
+    doc[keys[-1]] = value
+
+
+def remove_path(doc, path):
+    keys = path.split('.')
+
+    for key in keys[:-1]:
+        doc = doc.get(key)
+
+        if not isinstance(doc, dict):
+            return
+
+    doc.pop(keys[-1], None)
+
+
+def type_order(value):
+    """Position of the value's type in MongoDB's comparison order"""
+    if value is None or value is MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, (list, tuple)):
+        return 5
+    if isinstance(value, ObjectId):
+        return 7
+    return 9
+
+
+def compare(a, b):
+    """Compares two values like MongoDB's aggregation comparisons, -1, 0 or 1"""
+    a_order, b_order = type_order(a), type_order(b)
+
+    if a_order != b_order:
+        return -1 if a_order < b_order else 1
+    if a_order == 1:
+        return 0
+
+    return (a > b) - (a < b)
+
+
+def equal(value, target):
+    if value is MISSING:
+        return target is None
+    if isinstance(value, list) and not isinstance(target, list):
+        return any(equal(item, target) for item in value)
+
+    return type_order(value) == type_order(target) and value == target
+
+
+def freeze(value):
+    """Hashable form of a value, used as an index key"""
+    if isinstance(value, dict):
+        return tuple((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    if value is MISSING:
+        return None
+
+    return value
+
+
+# query matching
+
+COMPARISONS = {
+    '$gt': lambda order: order > 0,
+    '$gte': lambda order: order >= 0,
+    '$lt': lambda order: order < 0,
+    '$lte': lambda order: order <= 0,
+}
+
+
+def matches(doc, query):
+    """Whether a document matches a query filter"""
+    for key, condition in query.items():
+        if key == '$expr':
+            if not truthy(evaluate(condition, doc)):
+                return False
+        elif key == '$and':
+            if not all(matches(doc, part) for part in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(doc, part) for part in condition):
+                return False
+        elif key == '$nor':
+            if any(matches(doc, part) for part in condition):
+                return False
+        elif key.startswith('$'):
+            raise NotImplementedError(f'{key} is not supported by the in-memory stand-in')
+        elif is_operator_document(condition):
+            if not matches_operators(get_path(doc, key), condition):
+                return False
+        elif not equal(get_path(doc, key), condition):
+            return False
+
+    return True
+
+
+def is_operator_document(condition):
+    return isinstance(condition, dict) and bool(condition) and all(key.startswith('$') for key in condition)
+
+
+def matches_operators(value, operators):
+    for operator, argument in operators.items():
+        if operator in COMPARISONS:
+            # query comparisons only match values of the same type
+            if value is MISSING or type_order(value) != type_order(argument):
+                return False
+            if not COMPARISONS[operator](compare(value, argument)):
+                return False
+        elif operator == '$eq':
+            if not equal(value, argument):
+                return False
+        elif operator == '$ne':
+            if equal(value, argument):
+                return False
+        elif operator == '$in':
+            if not any(equal(value, item) for item in argument):
+                return False
+        elif operator == '$nin':
+            if any(equal(value, item) for item in argument):
+                return False
+        elif operator == '$exists':
+            if (value is not MISSING) != bool(argument):
+                return False
+        elif operator == '$not':
+            if matches_operators(value, argument):
+                return False
+        else:
+            raise NotImplementedError(f'{operator} is not supported by the in-memory stand-in')
+
+    return True
+
+
+# aggregation expressions
+
+def truthy(value):
+    return value not in (None, False, 0) and value is not MISSING
+
+
+def nullish(value):
+    return value is None or value is MISSING
+
+
+def evaluate(expression, doc, variables=None):
+    """Evaluates an aggregation expression against a document"""
+    if isinstance(expression, str) and expression.startswith('$$'):
+        name, _, path = expression[2:].partition('.')
+
+        if name == 'REMOVE':
+            return REMOVE
+
+        value = doc if name in ('ROOT', 'CURRENT') else (variables or {})[name]
+
+        return get_path(value, path) if path else value
+
+    if isinstance(expression, str) and expression.startswith('$'):
+        return get_path(doc, expression[1:])
+
+    if isinstance(expression, list):
+        return [evaluate(item, doc, variables) for item in expression]
+
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            operator, argument = next(iter(expression.items()))
+
+            if operator.startswith('$'):
+                return evaluate_operator(operator, argument, doc, variables)
+
+        return {key: evaluate(value, doc, variables) for key, value in expression.items()}
+
+    return expression
+
+
+def evaluate_operator(operator, argument, doc, variables):
+    if operator == '$literal':
+        return argument
+
+    if operator == '$cond':
+        if isinstance(argument, dict):
+            argument = [argument['if'], argument['then'], argument['else']]
+
+        condition, then, otherwise = argument
+        return evaluate(then if truthy(evaluate(condition, doc, variables)) else otherwise, doc, variables)
+
+    if operator == '$switch':
+        for branch in argument['branches']:
+            if truthy(evaluate(branch['case'], doc, variables)):
+                return evaluate(branch['then'], doc, variables)
+
+        return evaluate(argument['default'], doc, variables)
+
+    if operator == '$ifNull':
+        for expression in argument[:-1]:
+            value = evaluate(expression, doc, variables)
+
+            if not nullish(value):
+                return value
+
+        return evaluate(argument[-1], doc, variables)
+
+    if operator == '$filter':
+        items = evaluate(argument['input'], doc, variables)
+        name = argument.get('as', 'this')
+
+        if nullish(items):
+            return None
+
+        return [item for item in items
+                if truthy(evaluate(argument['cond'], doc, dict(variables or {}, **{name: item})))]
+
+    if operator == '$let':
+        scope = dict(variables or {})
+        scope.update({name: evaluate(value, doc, variables) for name, value in argument['vars'].items()})
+        return evaluate(argument['in'], doc, scope)
+
+    args = evaluate(argument, doc, variables)
+
+    if not isinstance(argument, list):
+        args = [args]
+
+    return apply_operator(operator, args)
+
+
+def apply_operator(operator, args):
+    if operator in ('$max', '$min', '$sum'):
+        # accumulators take a single array or several arguments and skip nulls
+        if len(args) == 1 and isinstance(args[0], list):
+            args = args[0]
+
+        values = [arg for arg in args if not nullish(arg)]
+
+        if operator == '$sum':
+            return sum(value for value in values if type_order(value) == 2)
+        if not values:
+            return None
+
+        pick = max if operator == '$max' else min
+        return pick(values, key=lambda value: (type_order(value), value))
+
+    if operator in ('$eq', '$ne', '$gt', '$gte', '$lt', '$lte', '$cmp'):
+        order = compare(*(None if arg is MISSING else arg for arg in args))
+
+        if operator == '$cmp':
+            return order
+        if operator == '$eq':
+            return order == 0
+        if operator == '$ne':
+            return order != 0
+
+        return COMPARISONS[operator](order)
+
+    if operator == '$and':
+        return all(truthy(arg) for arg in args)
+    if operator == '$or':
+        return any(truthy(arg) for arg in args)
+    if operator == '$not':
+        return not truthy(args[0])
+
+    if operator in ('$add', '$subtract', '$multiply', '$divide', '$floor', '$ceil', '$sqrt', '$abs', '$toInt'):
+        if any(nullish(arg) for arg in args):
+            return None
+        if operator == '$add':
+            return sum(args)
+        if operator == '$subtract':
+            return args[0] - args[1]
+        if operator == '$multiply':
+            result = 1
+
+            for arg in args:
+                result *= arg
+
+            return result
+        if operator == '$divide':
+            return args[0] / args[1]
+        if operator == '$floor':
+            return int(args[0] // 1)
+        if operator == '$ceil':
+            return int(-(-args[0] // 1))
+        if operator == '$sqrt':
+            if args[0] < 0:
+                raise ValueError("$sqrt's argument must be greater than or equal to 0")
+
+            return args[0] ** 0.5
+        if operator == '$toInt':
+            return int(args[0])
+
+        return abs(args[0])
+
+    if operator == '$size':
+        if not isinstance(args[0], list):
+            raise TypeError('The argument to $size must be an array')
+
+        return len(args[0])
+
+    if operator == '$in':
+        return any(compare(args[0], item) == 0 for item in args[1])
+
+    if operator == '$arrayElemAt':
+        array, index = args
+
+        if nullish(array):
+            return None
+
+        return array[index] if -len(array) <= index < len(array) else MISSING
+
+    raise NotImplementedError(f'{operator} is not supported by the in-memory stand-in')
+
+
+# updates
+
+def apply_update(doc, update, inserting=False):
+    """Applies an update document or pipeline to a copy of the document
+
+    Args:
+        doc (dict): Document to update
+        update (dict or List[dict]): Update operators or update pipeline
+        inserting (bool, optional): Whether the update is creating the document (upsert)
+
+    Returns:
+        dict: Updated document
+    """
+    doc = copy.deepcopy(doc)
+
+    if isinstance(update, list):
+        for stage in update:
+            doc = apply_stage(doc, stage)
+
+        return doc
+
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            current = get_path(doc, path)
+
+            if operator == '$set' or (operator == '$setOnInsert' and inserting):
+                set_path(doc, path, copy.deepcopy(value))
+            elif operator == '$setOnInsert':
+                continue
+            elif operator == '$unset':
+                remove_path(doc, path)
+            elif operator == '$inc':
+                set_path(doc, path, value if current is MISSING else current + value)
+            elif operator in ('$max', '$min'):
+                if current is MISSING or (compare(value, current) > 0) == (operator == '$max'):
+                    set_path(doc, path, value)
+            else:
+                raise NotImplementedError(f'{operator} is not supported by the in-memory stand-in')
+
+    return doc
+
+
+def apply_stage(doc, stage):
+    (name, argument), = stage.items()
+
+    if name in ('$set', '$addFields'):
+        # every expression of a stage sees the document as it was before the stage
+        values = {path: evaluate(expression, doc) for path, expression in argument.items()}
+
+        for path, value in values.items():
+            if value is REMOVE or value is MISSING:
+                remove_path(doc, path)
+            else:
+                set_path(doc, path, copy.deepcopy(value))
+
+        return doc
+
+    if name == '$unset':
+        for path in [argument] if isinstance(argument, str) else argument:
+            remove_path(doc, path)
+
+        return doc
+
+    if name in ('$replaceWith', '$replaceRoot'):
+        expression = argument['newRoot'] if name == '$replaceRoot' else argument
+        return dict(evaluate(expression, doc), _id=doc['_id'])
+
+    raise NotImplementedError(f'{name} is not supported by the in-memory stand-in')
+
+
+def upsert_seed(query):
+    """Document an upsert starts from, built from the equality conditions of the filter"""
+    seed = {}
+
+    for key, condition in query.items():
+        if key == '$and':
+            for part in condition:
+                for path, value in upsert_seed(part).items():
+                    set_path(seed, path, value)
+        elif not key.startswith('$') and not is_operator_document(condition):
+            set_path(seed, key, copy.deepcopy(condition))
+        elif is_operator_document(condition) and '$eq' in condition:
+            set_path(seed, key, copy.deepcopy(condition['$eq']))
+
+    return seed
+
+
+def project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+
+    fields = {path: value for path, value in projection.items() if path != '_id'}
+    include_id = projection.get('_id', 1)
+
+    if fields and all(fields.values()):
+        result = {'_id': doc['_id']} if include_id and '_id' in doc else {}
+
+        for path in fields:
+            value = get_path(doc, path)
+
+            if value is not MISSING:
+                set_path(result, path, copy.deepcopy(value))
+
+        return result
+
+    result = copy.deepcopy(doc)
+
+    for path in fields:
+        remove_path(result, path)
+
+    if not include_id:
+        result.pop('_id', None)
+
+    return result
+
+
+class Result:
+    """Result of a write, with the attributes of the matching pymongo result"""
+
+    def __init__(self, **counts):
+        self.acknowledged = True
+        self.inserted_id = None
+        self.inserted_ids = []
+        self.matched_count = 0
+        self.modified_count = 0
+        self.deleted_count = 0
+        self.inserted_count = 0
+        self.upserted_count = 0
+        self.upserted_id = None
+        self.upserted_ids = {}
+        self.__dict__.update(counts)
+
+
+class MemoryIndex:
+    def __init__(self, fields, unique):
+        self.fields = fields
+        self.unique = unique
+        self.entries = {}  # key -> set of _id
+
+    def key(self, doc):
+        return tuple(freeze(get_path(doc, field)) for field in self.fields)
+
+    def add(self, doc):
+        self.entries.setdefault(self.key(doc), set()).add(doc['_id'])
+
+    def discard(self, doc):
+        ids = self.entries.get(self.key(doc))
+
+        if ids is not None:
+            ids.discard(doc['_id'])
+
+            if not ids:
+                del self.entries[self.key(doc)]
+
+    def conflict(self, doc):
+        """Whether another document already uses the document's key"""
+        return self.unique and bool(self.entries.get(self.key(doc), set()) - {doc.get('_id')})
+
+
+class MemoryCursor:
+    def __init__(self, docs):
+        self.docs = docs
+        self.position = 0
+
+    def sort(self, key, direction=1):
+        keys = [(key, direction)] if isinstance(key, str) else key
+
+        for field, field_direction in reversed(keys):
+            self.docs.sort(key=lambda doc: (type_order(get_path(doc, field)), freeze(get_path(doc, field))),
+                           reverse=field_direction < 0)
+
+        return self
+
+    def skip(self, count):
+        self.docs = self.docs[count:]
+        return self
+
+    def limit(self, count):
+        if count:
+            self.docs = self.docs[:count]
+
+        return self
+
+    def batch_size(self, _):
+        return self
+
+    def __iter__(self):
+        # like pymongo, the cursor is its own iterator and is used up once read
+        return self
+
+    def __next__(self):
+        if self.position >= len(self.docs):
+            raise StopIteration
+
+        self.position += 1
+
+        return self.docs[self.position - 1]
+
+
+class MemoryCollection:
+    """Collection with the pymongo methods the bot calls"""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.lock = threading.RLock()
+        self.docs = {}  # _id -> document, in insertion order
+        self.indexes = {'_id_': MemoryIndex(('_id',), True)}
+
+    # bookkeeping
+
+    def command(self, name, arguments, reply, started):
+        """Records a finished operation and simulates the round trip
+
+        Args:
+            name (string): Name of the database command
+            arguments: Documents sent with the command
+            reply: Documents sent back
+            started (float): time.perf_counter() when the operation started
+        """
+        client = self.database.client
+        client.round_trip()
+
+        with client.lock:
+            client.operations += 1
+
+        if client.metrics is not None:
+            client.metrics.record_command(f'db.{self.name}.{name}', time.perf_counter() - started,
+                                          encoded_size(reply), encoded_size(arguments))
+
+    def candidates(self, query):
+        """Documents that might match the query, narrowed down with an index when possible"""
+        if '_id' in query and not isinstance(query['_id'], (dict, list)):
+            doc = self.docs.get(query['_id'])
+            return [] if doc is None else [doc]
+
+        for index in self.indexes.values():
+            if all(not is_operator_document(query.get(field, {'$exists': True})) for field in index.fields):
+                key = tuple(freeze(query[field]) for field in index.fields)
+                return [self.docs[doc_id] for doc_id in index.entries.get(key, ())]
+
+        return list(self.docs.values())
+
+    def matching(self, query, limit=0):
+        found = []
+
+        for doc in self.candidates(query or {}):
+            if matches(doc, query or {}):
+                found.append(doc)
+
+                if len(found) == limit:
+                    break
+
+        return found
+
+    def store(self, doc, previous=None):
+        """Stores a new or changed document, enforcing the unique indexes"""
+        for name, index in self.indexes.items():
+            if index.conflict(doc):
+                raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.name} index: {name}',
+                                        DUPLICATE_KEY_ERROR)
+
+        if previous is not None:
+            for index in self.indexes.values():
+                index.discard(previous)
+
+        for index in self.indexes.values():
+            index.add(doc)
+
+        self.docs[doc['_id']] = doc
+
+    def delete(self, doc):
+        for index in self.indexes.values():
+            index.discard(doc)
+
+        del self.docs[doc['_id']]
+
+    def write_one(self, query, update, upsert=False, replace=False, many=False):
+        """Updates or replaces the matching documents, inserting one if none match and upsert is set
+
+        Returns:
+            Tuple[Result, dict, dict]: Result and the first document before and after the write
+        """
+        found = self.matching(query, 0 if many else 1)
+        before = after = None
+        modified = 0
+
+        for doc in found:
+            if replace:
+                changed = dict(copy.deepcopy(update), _id=doc['_id'])
+            else:
+                changed = apply_update(doc, update)
+
+            if changed.get('_id') != doc['_id']:
+                raise NotImplementedError('Changing _id is not supported')
+
+            if changed != doc:
+                self.store(changed, doc)
+                modified += 1
+
+            if before is None:
+                before, after = doc, changed
+
+        if found or not upsert:
+            return Result(matched_count=len(found), modified_count=modified), before, after
+
+        seed = upsert_seed(query)
+
+        if replace:
+            doc = dict(seed, **copy.deepcopy(update))
+        else:
+            doc = apply_update(seed, update, inserting=True)
+
+        doc.setdefault('_id', ObjectId())
+        self.store(doc)
+
+        return Result(upserted_id=doc['_id'], upserted_count=1), None, doc
+
+    # pymongo api
+
+    def create_index(self, keys, unique=False, name=None, **_):
+        fields = (keys,) if isinstance(keys, str) else tuple(field for field, _ in keys)
+        name = name or '_'.join(f'{field}_1' for field in fields)
+
+        started = time.perf_counter()
+
+        with self.lock:
+            if name not in self.indexes:
+                index = MemoryIndex(fields, unique)
+
+                for doc in self.docs.values():
+                    if index.conflict(doc):
+                        raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.name} index: {name}',
+                                                DUPLICATE_KEY_ERROR)
+
+                    index.add(doc)
+
+                self.indexes[name] = index
+
+        self.command('createIndexes', {'index': name}, {'ok': 1}, started)
+
+        return name
+
+    def find_one(self, filter=None, projection=None, **_):
+        started = time.perf_counter()
+
+        with self.lock:
+            found = self.matching(filter, 1)
+            doc = project(found[0], projection) if found else None
+
+        self.command('find', filter, doc, started)
+
+        return doc
+
+    def find(self, filter=None, projection=None, **_):
+        started = time.perf_counter()
+
+        with self.lock:
+            docs = [project(doc, projection) for doc in self.matching(filter)]
+
+        self.command('find', filter, docs, started)
+
+        return MemoryCursor(docs)
+
+    def count_documents(self, filter, limit=0, **_):
+        started = time.perf_counter()
+
+        with self.lock:
+            count = len(self.matching(filter, limit))
+
+        self.command('aggregate', filter, {'n': count}, started)
+
+        return count
+
+    def estimated_document_count(self):
+        return len(self.docs)
+
+    def insert_one(self, document, **_):
+        started = time.perf_counter()
+
+        with self.lock:
+            # pymongo adds the _id to the caller's document as well
+            document.setdefault('_id', ObjectId())
+            self.store(copy.deepcopy(document))
+
+        self.command('insert', document, {'n': 1}, started)
+
+        return Result(inserted_id=document['_id'])
+
+    def insert_many(self, documents, ordered=True, **_):
+        return self.bulk_write([InsertRequest(document) for document in documents], ordered)
+
+    def update_one(self, filter, update, upsert=False, **_):
+        started = time.perf_counter()
+
+        with self.lock:
+            result, _, _ = self.write_one(filter, update, upsert)
+
+        self.command('update', [filter, update], {'n': result.matched_count + result.upserted_count}, started)
+
+        return result
+
+    def update_many(self, filter, update, upsert=False, **_):
+        started = time.perf_counter()
+
+        with self.lock:
+            result, _, _ = self.write_one(filter, update, upsert, many=True)
+
+        self.command('update', [filter, update], {'n': result.matched_count + result.upserted_count}, started)
+
+        return result
+
+    def replace_one(self, filter, replacement, upsert=False, **_):
+        started = time.perf_counter()
+
+        with self.lock:
+            result, _, _ = self.write_one(filter, replacement, upsert, replace=True)
+
+        self.command('update', [filter, replacement], {'n': result.matched_count + result.upserted_count}, started)
+
+        return result
+
+    def find_one_and_update(self, filter, update, projection=None, upsert=False, return_document=False, **_):
+        started = time.perf_counter()
+
+        with self.lock:
+            _, before, after = self.write_one(filter, update, upsert)
+            doc = after if return_document else before
+            doc = project(doc, projection) if doc is not None else None
+
+        self.command('findAndModify', [filter, update], doc, started)
+
+        return doc
+
+    def delete_one(self, filter, **_):
+        started = time.perf_counter()
+
+        with self.lock:
+            found = self.matching(filter, 1)
+
+            for doc in found:
+                self.delete(doc)
+
+        self.command('delete', filter, {'n': len(found)}, started)
+
+        return Result(deleted_count=len(found))
+
+    def delete_many(self, filter, **_):
+        started = time.perf_counter()
+
+        with self.lock:
+            found = self.matching(filter)
+
+            for doc in found:
+                self.delete(doc)
+
+        self.command('delete', filter, {'n': len(found)}, started)
+
+        return Result(deleted_count=len(found))
+
+    def bulk_write(self, requests, ordered=True, **_):
+        """Runs InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne and DeleteMany
+           requests in one round trip, raising BulkWriteError like pymongo"""
+        started = time.perf_counter()
+        result = Result()
+        errors = []
+
+        with self.lock:
+            for position, request in enumerate(requests):
+                kind = type(request).__name__
+
+                try:
+                    if kind in ('InsertOne', 'InsertRequest'):
+                        document = copy.deepcopy(request._doc)
+                        document.setdefault('_id', ObjectId())
+                        self.store(document)
+                        result.inserted_count += 1
+                        result.inserted_ids.append(document['_id'])
+                    elif kind in ('UpdateOne', 'UpdateMany', 'ReplaceOne'):
+                        written, _, _ = self.write_one(request._filter, request._doc, request._upsert,
+                                                       replace=kind == 'ReplaceOne', many=kind == 'UpdateMany')
+                        result.matched_count += written.matched_count
+                        result.modified_count += written.modified_count
+
+                        if written.upserted_id is not None:
+                            result.upserted_count += 1
+                            result.upserted_ids[position] = written.upserted_id
+                    elif kind in ('DeleteOne', 'DeleteMany'):
+                        found = self.matching(request._filter, 1 if kind == 'DeleteOne' else 0)
+
+                        for doc in found:
+                            self.delete(doc)
+
+                        result.deleted_count += len(found)
+                    else:
+                        raise NotImplementedError(f'{kind} is not supported by the in-memory stand-in')
+                except DuplicateKeyError as error:
+                    errors.append({'index': position, 'code': DUPLICATE_KEY_ERROR, 'errmsg': str(error)})
+
+                    if ordered:
+                        break
+                except TypeError as error:
+                    # the server fails just this write, like a $add on a string
+                    errors.append({'index': position, 'code': TYPE_MISMATCH, 'errmsg': str(error)})
+
+                    if ordered:
+                        break
+
+        self.command('bulkWrite', list(requests), {'n': len(requests)}, started)
+
+        if errors:
+            raise BulkWriteError({
+                'writeErrors': errors, 'writeConcernErrors': [],
+                'nInserted': result.inserted_count, 'nUpserted': result.upserted_count,
+                'nMatched': result.matched_count, 'nModified': result.modified_count,
+                'nRemoved': result.deleted_count,
+                'upserted': [{'index': index, '_id': upserted_id} for index, upserted_id in result.upserted_ids.items()],
+            })
+
+        return result
+
+    def drop(self):
+        started = time.perf_counter()
+
+        with self.lock:
+            self.docs = {}
+
+            for index in self.indexes.values():
+                index.entries = {}
+
+        self.command('drop', {}, {'ok': 1}, started)
+
+
+class InsertRequest:
+    """insert_many documents, shaped like pymongo's InsertOne"""
+
+    def __init__(self, document):
+        document.setdefault('_id', ObjectId())
+        self._doc = document
+
+
+class MemoryDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.collections = {}
+
+    def __getitem__(self, name):
+        with self.client.lock:
+            if name not in self.collections:
+                self.collections[name] = MemoryCollection(self, name)
+
+            return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return self[name]
+
+    def list_collection_names(self):
+        return list(self.collections)
+
+    def command(self, name, *_, **__):
+        if name != 'ping':
+            raise NotImplementedError(f'{name} is not supported by the in-memory stand-in')
+
+        self.client.round_trip()
+
+        return {'ok': 1}
+
+
+class MemoryClient:
+    """Stand-in for MongoClient
+
+    Args:
+        latency (float, optional): Seconds every operation sleeps to simulate a round trip
+        metrics (Metrics, optional): Where to record every operation, like the CommandMetrics listener
+        connect_latency (float, optional): Seconds the first operation also sleeps, to simulate
+            the DNS lookup and handshake of connecting to Atlas
+    """
+
+    def __init__(self, latency=0, metrics=None, connect_latency=0):
+        self.latency = latency
+        self.metrics = metrics
+        self.connect_latency = connect_latency
+        self.lock = threading.RLock()
+        self.connecting = threading.Lock()
+        self.connected = False
+        self.databases = {}
+        self.operations = 0  # round trips so far
+
+    def round_trip(self):
+        """Simulates the network, operations wait for the connection like pymongo's do"""
+        if not self.connected:
+            with self.connecting:
+                if not self.connected:
+                    time.sleep(self.connect_latency)
+                    self.connected = True
+
+        if self.latency:
+            time.sleep(self.latency)
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self.databases:
+                self.databases[name] = MemoryDatabase(self, name)
+
+            return self.databases[name]
+
+    def get_database(self, name):
+        return self[name]
+
+    @property
+    def admin(self):
+        return self['admin']
+
+    def close(self):
+        pass
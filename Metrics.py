@@ -0,0 +1,283 @@
+import contextvars
+import functools
+import json
+import threading
+import time
+from bisect import bisect_left
+
+import bson
+from pymongo import monitoring
+
+# upper bounds of the histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+BYTES_BUCKETS = (0, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """Counts observations in fixed buckets, cheap enough to update on every call"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last bucket holds everything above the bounds
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile, the largest value seen
+           for the overflow bucket"""
+        rank = q * self.count
+        seen = 0
+
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+
+            if count and seen >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'max': self.max,
+                'bounds': list(self.bounds), 'counts': list(self.counts)}
+
+
+class Invocation:
+    """Database work done while one handler runs"""
+
+    __slots__ = ('round_trips', 'bytes_read', 'bytes_written')
+
+    def __init__(self):
+        self.round_trips = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+
+def encoded_size(value):
+    """Size of a document, a list of documents or a bulk write operation once encoded as BSON"""
+    if isinstance(value, dict):
+        return len(bson.encode(value))
+
+    if isinstance(value, (list, tuple)):
+        return sum(encoded_size(item) for item in value)
+
+    # pymongo bulk operations (UpdateOne, InsertOne, ...) keep their documents in attributes
+    return sum(encoded_size(item) for item in getattr(value, '__dict__', {}).values()
+               if isinstance(item, (dict, list)))
+
+
+# invocation of the handler currently running, copied into the database worker threads
+current_invocation = contextvars.ContextVar('current_invocation', default=None)
+
+
+class Metrics:
+    """Wall time, database round trips and bytes sent and received per command, event
+       handler and collection command, aggregated into histograms"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}  # name -> {measure -> Histogram}
+        self.started_at = time.time()
+        self.listener = CommandMetrics(self)
+
+    def record(self, name, seconds, round_trips, bytes_read, bytes_written):
+        """Adds one invocation to the histograms of the given name"""
+        with self.lock:
+            histograms = self.stats.get(name)
+
+            if histograms is None:
+                histograms = self.stats[name] = {
+                    'seconds': Histogram(LATENCY_BUCKETS),
+                    'round_trips': Histogram(COUNT_BUCKETS),
+                    'bytes_read': Histogram(BYTES_BUCKETS),
+                    'bytes_written': Histogram(BYTES_BUCKETS),
+                }
+
+            histograms['seconds'].observe(seconds)
+            histograms['round_trips'].observe(round_trips)
+            histograms['bytes_read'].observe(bytes_read)
+            histograms['bytes_written'].observe(bytes_written)
+
+    def record_command(self, name, seconds, bytes_read, bytes_written, invocation=None):
+        """Records one database command under its own name and for the handler that sent it
+
+        Args:
+            name (string): Name of the command, db.<collection>.<command>
+            seconds (float): Time the command took
+            bytes_read (int): Size of the reply
+            bytes_written (int): Size of the command
+            invocation (Invocation, optional): Handler invocation, the current one if None
+        """
+        invocation = invocation or current_invocation.get()
+
+        if invocation is not None:
+            with self.lock:
+                invocation.round_trips += 1
+                invocation.bytes_read += bytes_read
+                invocation.bytes_written += bytes_written
+
+        self.record(name, seconds, 1, bytes_read, bytes_written)
+
+    def timed(self, name, coroutine_function):
+        """Wraps a coroutine function so every call is recorded under the given name.
+           Database calls made by nested handlers count for the innermost one
+
+        Args:
+            name (string): Name to record the calls under
+            coroutine_function (Callable): Handler to wrap
+
+        Returns:
+            Callable: Coroutine function with the same signature
+        """
+        @functools.wraps(coroutine_function)
+        async def wrapper(*args, **kwargs):
+            invocation = Invocation()
+            token = current_invocation.set(invocation)
+            started = time.perf_counter()
+
+            try:
+                return await coroutine_function(*args, **kwargs)
+            finally:
+                current_invocation.reset(token)
+                self.record(name, time.perf_counter() - started, invocation.round_trips,
+                            invocation.bytes_read, invocation.bytes_written)
+
+        return wrapper
+
+    def instrument(self, bot):
+        """Records every command and every event handler registered on the bot
+
+        Args:
+            bot (discord.ext.commands.Bot): Bot with its handlers already registered
+        """
+        for command in bot.walk_commands():
+            command.callback = self.timed(f'command.{command.qualified_name}', command.callback)
+
+        # bot.event stores handlers as attributes of the bot
+        for name, handler in list(vars(bot).items()):
+            if name.startswith('on_') and callable(handler):
+                setattr(bot, name, self.timed(f'event.{name}', handler))
+
+    def summary(self, prefix=''):
+        """Summarizes the histograms of every name starting with prefix
+
+        Returns:
+            List[dict]: One entry per name, the most total time first
+        """
+        with self.lock:
+            rows = [{
+                'name': name,
+                'count': histograms['seconds'].count,
+                'total_seconds': histograms['seconds'].total,
+                'p50_seconds': histograms['seconds'].quantile(0.5),
+                'p99_seconds': histograms['seconds'].quantile(0.99),
+                'round_trips': histograms['round_trips'].mean(),
+                'bytes_read': histograms['bytes_read'].mean(),
+                'bytes_written': histograms['bytes_written'].mean(),
+            } for name, histograms in self.stats.items() if name.startswith(prefix)]
+
+        return sorted(rows, key=lambda row: row['total_seconds'], reverse=True)
+
+    def dump(self, path):
+        """Appends the current histograms to a JSON lines file, one line per name
+
+        Args:
+            path (string): File to append to
+
+        Returns:
+            int: Number of lines written
+        """
+        now = time.time()
+
+        with self.lock:
+            lines = [json.dumps({'time': now, 'since': self.started_at, 'name': name,
+                                 **{measure: histogram.to_dict() for measure, histogram in histograms.items()}})
+                     for name, histograms in self.stats.items()]
+
+        with open(path, 'a') as file:
+            file.writelines(line + '\n' for line in lines)
+
+        return len(lines)
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.started_at = time.time()
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Listener for MongoClient(event_listeners=...) that records every command sent to
+       the database, per collection and for the handler that sent it. pymongo calls it on
+       the thread running the command, so the handler's context is available.
+
+       pymongo does not report how big a command or its reply was on the wire and encoding
+       them again is as expensive as the command itself, so only the first command of every
+       name and then one in sample_every are measured. The others count with the sizes last
+       measured for their name"""
+
+    def __init__(self, metrics, sample_every=32):
+        """
+        Args:
+            metrics (Metrics): Where to record the commands
+            sample_every (int, optional): Commands of a name per measured size. Defaults to 32.
+        """
+        self.metrics = metrics
+        self.sample_every = sample_every
+        self.lock = threading.Lock()
+        self.pending = {}  # (connection, request id) -> (name, sampled, invocation)
+        self.counts = {}  # name -> commands seen
+        self.sizes = {}  # name -> (bytes written, bytes read) last measured
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        name = f'db.{collection}.{event.command_name}' if isinstance(collection, str) else f'db.{event.command_name}'
+        key = (event.connection_id, event.request_id)
+
+        with self.lock:
+            count = self.counts.get(name, 0)
+            self.counts[name] = count + 1
+
+        sampled = count % self.sample_every == 0
+        bytes_written = len(bson.encode(event.command)) if sampled else None
+
+        with self.lock:
+            self.pending[key] = (name, bytes_written, current_invocation.get())
+
+    def succeeded(self, event):
+        self.finish(event, True)
+
+    def failed(self, event):
+        self.finish(event, False)
+
+    def finish(self, event, succeeded):
+        with self.lock:
+            pending = self.pending.pop((event.connection_id, event.request_id), None)
+
+        if pending is None:
+            return
+
+        name, bytes_written, invocation = pending
+
+        if bytes_written is None:
+            with self.lock:
+                bytes_written, bytes_read = self.sizes.get(name, (0, 0))
+        elif succeeded:
+            bytes_read = len(bson.encode(event.reply))
+
+            with self.lock:
+                self.sizes[name] = (bytes_written, bytes_read)
+
+        if not succeeded:
+            bytes_read = 0
+
+        self.metrics.record_command(name, event.duration_micros / 1e6, bytes_read, bytes_written, invocation)
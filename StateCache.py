@@ -0,0 +1,124 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class StateCache:
+    """Process wide read-through cache for member and inventory documents.
+       Entries expire after ttl seconds and the least recently used entry is
+       evicted once max_size is reached. Safe to use from the database worker threads"""
+
+    def __init__(self, name, max_size=10000, ttl=300):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires at, value)
+        self.generations = {}  # key -> invalidation count when it was last invalidated, guards against stale loads
+        self.invalidations = 0
+        self.epoch = 0  # number of times the whole cache was cleared
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, loader):
+        """Gets the value for the key, loading and storing it on a miss
+
+        Args:
+            key (Hashable): Key of the entry
+            loader (Callable): Called without arguments to load the value on a miss
+
+        Returns:
+            Any: Copy of the cached value, callers are free to modify it
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+
+            self.misses += 1
+            generation = self.generation(key)
+
+        value = loader()
+
+        with self.lock:
+            # a write that happened while loading makes the loaded value stale
+            if value is not None and self.generation(key) == generation:
+                self.store(key, value)
+
+        return copy.deepcopy(value)
+
+    def generation(self, key):
+        """Identifies the state of the key, changes whenever it is invalidated. Expects the lock to be held"""
+        return self.epoch, self.generations.get(key, 0)
+
+    def store(self, key, value):
+        """Stores a value, evicting the least recently used entries if full. Expects the lock to be held"""
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        """Drops the entry for the key, called whenever the underlying document is written"""
+        with self.lock:
+            self.entries.pop(key, None)
+            self.invalidations += 1
+            self.generations[key] = self.invalidations
+
+    def fill(self, loader):
+        """Stores many values loaded at once, like warming up after a restart. Keys that
+           were invalidated while loading are left out, like in get
+
+        Args:
+            loader (Callable): Called without arguments, returns (key, value) pairs
+
+        Returns:
+            int: Number of entries stored
+        """
+        with self.lock:
+            epoch, invalidations = self.epoch, self.invalidations
+
+        pairs = loader()
+        stored = 0
+
+        with self.lock:
+            if self.epoch != epoch:
+                return 0
+
+            for key, value in pairs:
+                if self.generations.get(key, 0) <= invalidations:
+                    self.store(key, value)
+                    stored += 1
+
+        return stored
+
+    def clear(self):
+        """Drops every entry"""
+        with self.lock:
+            self.entries.clear()
+            self.epoch += 1
+
+    def stats(self):
+        """Hit/miss counters of the cache
+
+        Returns:
+            dict: Counters and current size
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+
+            return {
+                'name': self.name,
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0
+            }
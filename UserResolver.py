@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+
+class UserResolver:
+    """Resolves user ids to names and bot flags without spending the REST rate limit.
+       Looks in the gateway member cache first, then in a local cache with a TTL and
+       only then asks the gateway for the missing members, in batches"""
+
+    BATCH_SIZE = 100  # most user ids query_members accepts at once
+
+    def __init__(self, bot, ttl=3600, max_size=50000):
+        self.bot = bot
+        self.ttl = ttl
+        self.max_size = max_size
+        self.profiles = {}  # user id -> (expires at, name, is bot)
+        self.lookups = 0
+        self.fetched = 0
+
+    def update(self, user):
+        """Stores the current name of a user, called from member and user update events
+
+        Args:
+            user (discord.abc.User): User or member with up to date information
+        """
+        if len(self.profiles) >= self.max_size:
+            self.expire()
+
+        self.profiles[user.id] = (time.monotonic() + self.ttl, user.name, user.bot)
+
+    def expire(self):
+        """Drops expired profiles, and the oldest ones if still too many are cached"""
+        now = time.monotonic()
+        self.profiles = {user_id: profile for user_id, profile in self.profiles.items() if profile[0] > now}
+
+        if len(self.profiles) >= self.max_size:
+            oldest = sorted(self.profiles, key=lambda user_id: self.profiles[user_id][0])
+            for user_id in oldest[:len(oldest) // 2]:
+                del self.profiles[user_id]
+
+    def lookup(self, guild, user_id):
+        """Resolves a user from the caches only
+
+        Args:
+            guild (discord.Guild): Guild to look for the member in, may be None
+            user_id (int): Id of the user
+
+        Returns:
+            Tuple[str, bool]: Name and bot flag, None if the user is not cached
+        """
+        self.lookups += 1
+        user = (guild.get_member(user_id) if guild is not None else None) or self.bot.get_user(user_id)
+
+        if user is not None:
+            return user.name, user.bot
+
+        profile = self.profiles.get(user_id)
+
+        if profile is not None and profile[0] > time.monotonic():
+            return profile[1], profile[2]
+
+        return None
+
+    async def resolve_many(self, guild, user_ids):
+        """Resolves many users at once, asking the gateway for the ones that are not cached
+
+        Args:
+            guild (discord.Guild): Guild the users are members of
+            user_ids (Iterable[int]): Ids of the users
+
+        Returns:
+            dict: user id -> (name, is bot) for every user that could be found, users whose
+                batch timed out are left out
+        """
+        resolved = {}
+        missing = []
+
+        for user_id in user_ids:
+            profile = self.lookup(guild, user_id)
+
+            if profile is None:
+                missing.append(user_id)
+            else:
+                resolved[user_id] = profile
+
+        for start in range(0, len(missing), self.BATCH_SIZE):
+            batch = missing[start:start + self.BATCH_SIZE]
+            self.fetched += len(batch)
+
+            try:
+                members = await guild.query_members(user_ids=batch, limit=len(batch), cache=True)
+            except asyncio.TimeoutError:
+                # the gateway did not answer in time, callers show these users as mentions
+                continue
+
+            for member in members:
+                self.update(member)
+                resolved[member.id] = (member.name, member.bot)
+
+        return resolved
+
+    async def resolve(self, guild, user_id):
+        """Resolves a single user
+
+        Args:
+            guild (discord.Guild): Guild the user is a member of
+            user_id (int): Id of the user
+
+        Returns:
+            Tuple[str, bool]: Name and bot flag, None if the user can't be found
+        """
+        return (await self.resolve_many(guild, [user_id])).get(user_id)
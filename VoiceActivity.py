@@ -1,41 +1,100 @@
-class VoiceActivity:
-    """Class for representing someones voice activty i.e. being muted"""
-
-    def __init__(self, guild, user, muted=False, deafened=False, afk=False):
-        self.guild = guild
-        self.user = user
-        self.muted = muted
-        self.deafened = deafened
-        self.afk = afk
-        self.xp_accumulated = 0
-
-    def mute(self):
-        self.muted = True
-
-    def unmute(self):
-        self.muted = False
-
-    def deafen(self):
-        self.deafened = True
-        self.mute = True
-
-    def undeafen(self):
-        self.deafened = False
-        self.mute = False
-
-    def go_afk(self):
-        self.afk = True
-
-    def unafk(self):
-        self.afk = False
-
-    def is_afk(self):
-        return self.afk
-
-    def add_points(self):
-        """Adds points to the total if you are actively participating in a call"""
-        if not (self.muted or self.deafened or self.afk):
-            self.xp_accumulated += 20
-
-    def get_points(self):
-        return self.xp_accumulated
+import time
+
+XP_PER_INTERVAL = 20  # xp earned for 15 minutes of active participation
+INTERVAL_SECONDS = 15 * 60
+SECONDS_PER_XP = INTERVAL_SECONDS / XP_PER_INTERVAL
+
+
+class VoiceActivity:
+    """Class for representing someones voice activty i.e. being muted.
+       Instead of being polled, it records when the user starts and stops actively
+       participating (unmuted, undeafened and not afk) and turns that time into xp on demand"""
+
+    def __init__(self, guild, user, muted=False, deafened=False, afk=False, now=None):
+        self.guild = guild
+        self.user = user
+        self.muted = muted
+        self.deafened = deafened
+        self.afk = afk
+        self.active_since = None  # start of the current active interval, None while inactive
+        self.active_seconds = 0  # active time that was not turned into xp yet
+        self.xp_accumulated = 0  # xp collected so far in this call
+        self.checkpoint = None  # handle of the next scheduled checkpoint
+
+        if self.is_active():
+            self.active_since = time.monotonic() if now is None else now
+
+    def is_active(self):
+        return not (self.muted or self.deafened or self.afk)
+
+    def update(self, muted, deafened, afk, now=None):
+        """Records a voice state change, closing or opening an active interval if needed
+
+        Args:
+            muted (bool): If the user is muted now
+            deafened (bool): If the user is deafened now
+            afk (bool): If the user is in the afk channel now
+            now (float, optional): Time of the change. Defaults to time.monotonic().
+        """
+        now = time.monotonic() if now is None else now
+        self.close_interval(now)
+
+        self.muted = muted or deafened  # deafening someone also mutes them
+        self.deafened = deafened
+        self.afk = afk
+
+        if self.is_active():
+            self.active_since = now
+
+    def close_interval(self, now):
+        """Adds the time of the current active interval (if any) to the total"""
+        if self.active_since is not None:
+            self.active_seconds += now - self.active_since
+            self.active_since = None
+
+    def mute(self):
+        self.update(True, self.deafened, self.afk)
+
+    def unmute(self):
+        self.update(False, self.deafened, self.afk)
+
+    def deafen(self):
+        self.update(True, True, self.afk)
+
+    def undeafen(self):
+        self.update(False, False, self.afk)
+
+    def go_afk(self):
+        self.update(self.muted, self.deafened, True)
+
+    def unafk(self):
+        self.update(self.muted, self.deafened, False)
+
+    def is_afk(self):
+        return self.afk
+
+    def collect(self, now=None):
+        """Turns the active time so far into xp. Time that does not add up to a full
+           point of xp is kept for the next collection
+
+        Args:
+            now (float, optional): Time to collect up to. Defaults to time.monotonic().
+
+        Returns:
+            int: xp earned since the last collection
+        """
+        now = time.monotonic() if now is None else now
+        active = self.is_active()
+        self.close_interval(now)
+
+        if active:
+            self.active_since = now
+
+        xp = int(self.active_seconds // SECONDS_PER_XP)
+        self.active_seconds -= xp * SECONDS_PER_XP
+        self.xp_accumulated += xp
+
+        return xp
+
+    def get_points(self):
+        return self.xp_accumulated
@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+
+import async_bot_utils
+import bot_utils
+
+
+class XPBuffer:
+    """Collects xp changes in memory and writes them to the database in batches.
+       Changes for the same member are added together, so a reaction that gets
+       added and removed again between two flushes never reaches the database"""
+
+    def __init__(self, max_pending=1000, interval=10):
+        self.max_pending = max_pending  # members with pending xp that force a flush
+        self.interval = interval  # seconds between periodic flushes
+        self.pending = {}  # guild id -> {user id -> xp delta}
+        self.pending_count = 0
+        self.flush_task = None  # flush started because the buffer filled up
+        self.writes = set()  # writes of flush_async still running, joined by flush
+
+    def add(self, guild, user, xp):
+        """Adds an xp change for the given user to the buffer
+
+        Args:
+            guild (discord.Guild): Guild the xp was earned in
+            user (discord.User): User that earned the xp
+            xp (int): Amount of xp to add (negative to remove)
+        """
+        if guild is None or xp == 0:
+            return
+
+        deltas = self.pending.setdefault(guild.id, {})
+
+        if user.id not in deltas:
+            deltas[user.id] = 0
+            self.pending_count += 1
+
+        deltas[user.id] += xp
+
+        # one flush at a time, changes added meanwhile are picked up by the next one
+        if self.pending_count >= self.max_pending and (self.flush_task is None or self.flush_task.done()):
+            self.flush_task = asyncio.ensure_future(self.flush_async())
+
+    def get_pending(self, guild, user):
+        """Gets the xp that was earned but not written to the database yet"""
+        return self.pending.get(guild.id, {}).get(user.id, 0)
+
+    def take(self):
+        """Empties the buffer
+
+        Returns:
+            dict: Pending changes keyed by guild id
+        """
+        pending, self.pending = self.pending, {}
+        self.pending_count = 0
+
+        return pending
+
+    @staticmethod
+    def write(pending):
+        """Writes the changes to the database, one bulk write per guild.
+           Does not touch the buffer so it can run on a worker thread
+
+        Args:
+            pending (dict): Changes returned by take
+
+        Returns:
+            dict: Changes of the guilds that could not be written
+        """
+        failed = {}
+
+        for guild_id, deltas in pending.items():
+            try:
+                # only the changes that were not applied come back, retrying the others would count them twice
+                failed_deltas = bot_utils.apply_xp_deltas(guild_id, deltas)
+            except Exception as error:
+                # failed before anything was written
+                print(f"Failed to write xp for guild {guild_id}: {error}")
+                failed[guild_id] = deltas
+                continue
+
+            if failed_deltas:
+                print(f"Failed to write xp for {len(failed_deltas)} members of guild {guild_id}")
+                failed[guild_id] = failed_deltas
+
+        return failed
+
+    def flush(self):
+        """Writes every pending change to the database, blocking until done. Writes of
+           flush_async that are still running are waited for first, the task awaiting
+           them is gone if the event loop already closed"""
+        for write in list(self.writes):
+            self.restore(write.result())
+            self.writes.discard(write)
+
+        self.restore(self.write(self.take()))
+
+    async def flush_async(self):
+        """Writes every pending change to the database without blocking the event loop"""
+        await async_bot_utils.wait_until_ready()
+        pending = self.take()
+
+        if pending:
+            # a plain future on the database workers, so flush can still join it on shutdown
+            write = async_bot_utils.executor.submit(contextvars.copy_context().run, self.write, pending)
+            self.writes.add(write)
+            # shielded, cancelling this task must not cancel the write
+            failed = await asyncio.shield(asyncio.wrap_future(write))
+            self.writes.discard(write)
+            self.restore(failed)
+
+    def restore(self, failed):
+        """Puts changes that could not be written back into the buffer for the next flush"""
+        for guild_id, deltas in failed.items():
+            current = self.pending.setdefault(guild_id, {})
+
+            for user_id, xp in deltas.items():
+                if user_id not in current:
+                    current[user_id] = 0
+                    self.pending_count += 1
+
+                current[user_id] += xp
+
+    async def run(self):
+        """Flushes the buffer every interval seconds until cancelled"""
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush_async()
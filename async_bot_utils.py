@@ -0,0 +1,108 @@
+"""Awaitable versions of the database functions in bot_utils.
+
+pymongo blocks the calling thread on every round trip. Running those calls
+directly inside discord.py coroutines freezes the whole event loop (including
+the gateway heartbeat) while Atlas answers. The functions here run the blocking
+calls on a bounded pool of worker threads instead, so handlers can await them
+and keep running concurrently.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bot_utils
+
+# bounded so a burst of commands can not open more connections than the pool allows
+DB_WORKERS = int(os.getenv('DB_WORKERS', '8'))
+executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='db')
+# cleared by bot.run until the unique indexes exist, database calls wait for it so
+# nothing is written that the indexes would have rejected as a duplicate
+database_ready = threading.Event()
+database_ready.set()
+
+
+async def wait_until_ready():
+    """Waits until bot.run created the indexes, returns right away afterwards"""
+    while not database_ready.is_set():
+        # only during startup, polled so no thread is stuck if the bot shuts down instead
+        await asyncio.sleep(0.05)
+
+
+async def run_in_executor(function, *args, **kwargs):
+    """Runs a blocking function on the database worker pool, once the database is ready
+
+    Args:
+        function (Callable): Function to run
+        *args: Positional arguments for the function
+        **kwargs: Keyword arguments for the function
+
+    Returns:
+        Any: Whatever the function returns
+    """
+    loop = asyncio.get_event_loop()
+    await wait_until_ready()
+    # copy the context so context variables set by the caller are visible in the worker
+    context = contextvars.copy_context()
+
+    return await loop.run_in_executor(
+        executor, functools.partial(context.run, function, *args, **kwargs))
+
+
+def make_async(name):
+    """Creates an awaitable wrapper around the bot_utils function with the given name.
+       The function is looked up on every call so replacing it in bot_utils also
+       affects the wrapper
+
+    Args:
+        name (string): Name of the function in bot_utils
+
+    Returns:
+        Callable: Coroutine function with the same arguments
+    """
+    @functools.wraps(getattr(bot_utils, name))
+    async def wrapper(*args, **kwargs):
+        return await run_in_executor(getattr(bot_utils, name), *args, **kwargs)
+
+    return wrapper
+
+
+# guilds and members
+create_guild_entry = make_async('create_guild_entry')
+get_onboarding_cursor = make_async('get_onboarding_cursor')
+onboard_members = make_async('onboard_members')
+finish_onboarding = make_async('finish_onboarding')
+create_user_entry = make_async('create_user_entry')
+remove_user_entry = make_async('remove_user_entry')
+members_migrated = make_async('members_migrated')
+get_stored_member_ids = make_async('get_stored_member_ids')
+reconcile_members = make_async('reconcile_members')
+update_guild_info = make_async('update_guild_info')
+start_welcome_messages = make_async('start_welcome_messages')
+save_welcome_progress = make_async('save_welcome_progress')
+get_welcome_cursor = make_async('get_welcome_cursor')
+get_member_doc = make_async('get_member_doc')
+get_leaderboard_page = make_async('get_leaderboard_page')
+warm_guild = make_async('warm_guild')
+
+# points, xp and energy
+get_points = make_async('get_points')
+get_xp = make_async('get_xp')
+get_user_energy = make_async('get_user_energy')
+update_points = make_async('update_points')
+update_xp = make_async('update_xp')
+update_energy = make_async('update_energy')
+apply_xp_deltas = make_async('apply_xp_deltas')
+send_points = make_async('send_points')
+
+# inventories
+get_member_inventory = make_async('get_member_inventory')
+add_items = make_async('add_items')
+remove_items = make_async('remove_items')
+transfer_items = make_async('transfer_items')
+get_user_inventory_id = make_async('get_user_inventory_id')
+get_user_inventory = make_async('get_user_inventory')
+check_item_exists_inventory = make_async('check_item_exists_inventory')
+check_item_exists_stash = make_async('check_item_exists_stash')
@@ -0,0 +1,478 @@
+"""Offline throughput benchmark for the bot.
+
+Drives the real event handlers and commands in bot.py with the objects from
+fake_discord against the in-memory database from MemoryMongo, so it needs neither
+Discord nor Atlas. Scenarios:
+
+    gateway   N guilds x M members sending a mix of messages, typing, reactions,
+              voice state changes and commands
+    gifting   many concurrent gifts between a few members, checks that no points
+              are lost or created and that the daily limit holds
+    startup   time until the first command is answered, connecting to the database
+              before logging in to Discord (before) and while logging in (after)
+
+Usage:
+    python benchmark.py gateway --guilds 5 --members 200 --events 20000
+    python benchmark.py gifting --members 20 --gifts 5000 --concurrency 64
+    python benchmark.py gateway --latency 0.002 --json results.jsonl
+    python benchmark.py gateway --latency 0.002 --warm-up
+    python benchmark.py startup --connect-latency 1.5 --login 2
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import async_bot_utils
+import bot
+import bot_utils
+from DMDispatcher import RateLimiter
+from fake_discord import (FakeGuild, FakeMessage, FakeReaction, FakeVoiceState,
+                          command_processor)
+from MemoryMongo import MemoryClient
+
+# relative weights of the gateway events
+EVENT_MIX = {
+    'message': 50,
+    'typing': 15,
+    'reaction_add': 10,
+    'reaction_remove': 3,
+    'message_edit': 2,
+    'message_delete': 1,
+    'voice_state_update': 4,
+    'command': 15,
+}
+
+# relative weights of the commands, and the arguments they are called with
+COMMAND_MIX = {
+    'points': 4,
+    'rank': 3,
+    'inventory': 3,
+    'energy': 1,
+    'leaderboard': 2,
+    'gift': 2,
+    'gamble': 1,
+    'buy': 2,
+    'explore': 1,
+    'stash': 1,
+}
+
+STARTING_POINTS = 5000
+WORDS = ['hello', 'island', 'coconut', 'anyone', 'up', 'for', 'a', 'swim', 'lol', 'crab']
+
+
+def install_database(client):
+    """Points bot_utils and bot at the given client instead of Atlas and forgets
+       everything cached from the previous database
+
+    Args:
+        client (MemoryClient): Database client to use
+    """
+    bot_utils.database.use(client)
+    bot_utils.member_cache.clear()
+    bot_utils.inventory_cache.clear()
+
+    for guild_id in list(bot_utils.leaderboards.boards):
+        bot_utils.leaderboards.invalidate(guild_id)
+
+    bot_utils.ensure_indexes()
+
+
+def prepare_bot(client):
+    """Installs the database and replaces the parts of the bot that need a gateway
+
+    Returns:
+        discord.ext.commands.Bot: The bot with its handlers instrumented
+    """
+    install_database(client)
+    bot.bot.process_commands = command_processor(bot.bot)
+    bot.populate_shop()
+    bot.media.preload(bot.media_files())
+    bot.dm_dispatcher.limiter = RateLimiter(rate=None)  # fake members take any number of messages
+    bot_utils.metrics.reset()
+
+    if not getattr(bot.bot, 'instrumented', False):
+        bot_utils.metrics.instrument(bot.bot)
+        bot.bot.instrumented = True
+
+    return bot.bot
+
+
+async def create_guilds(client, guild_count, member_count, points=STARTING_POINTS):
+    """Creates the guilds through on_guild_join and gives every member some points to spend
+
+    Returns:
+        List[FakeGuild]: The guilds
+    """
+    guilds = []
+
+    for guild_number in range(1, guild_count + 1):
+        guild = FakeGuild(guild_number)
+        guild.add_member(bot.BOT_ID, 'DisruptPoints', bot=True)
+
+        for member_number in range(member_count):
+            guild.add_member(guild_number * 1_000_000 + member_number)
+
+        await bot.bot.on_guild_join(guild)
+        guilds.append(guild)
+
+    for guild in guilds:
+        await bot.onboarding_tasks[guild.id]
+        await bot.dm_dispatcher.wait(guild.id)
+
+    client['UserData']['Members'].update_many({'bot': False}, {'$set': {'points': points}})
+    bot_utils.member_cache.clear()
+
+    return guilds
+
+
+class Workload:
+    """Seeded stream of synthetic gateway events"""
+
+    def __init__(self, guilds, seed=0, event_mix=None, command_mix=None):
+        self.guilds = guilds
+        self.rng = random.Random(seed)
+        self.event_mix = event_mix or EVENT_MIX
+        self.command_mix = command_mix or COMMAND_MIX
+        self.message_count = 0
+        self.recent = {guild.id: [] for guild in guilds}  # messages that can be edited, deleted or reacted to
+        self.voice = {}  # member id -> current voice state
+        self.humans = {guild.id: [member for member in guild.members if not member.bot] for guild in guilds}
+
+    def pick(self, mix):
+        return self.rng.choices(list(mix), weights=list(mix.values()))[0]
+
+    def member(self, guild):
+        return self.rng.choice(self.humans[guild.id])
+
+    def message(self, guild, author, content=None):
+        self.message_count += 1
+
+        if content is None:
+            content = ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(1, 12)))
+
+        attachments = ['image.png'] if self.rng.random() < 0.05 else []
+        message = FakeMessage(self.message_count, author, guild.text_channel, content, attachments)
+        self.recent[guild.id] = (self.recent[guild.id] + [message])[-200:]
+
+        return message
+
+    def command(self, guild, author):
+        name = self.pick(self.command_mix)
+
+        if name == 'gift':
+            return f'$gift <@!{self.member(guild).id}> {self.rng.randint(1, 50)}'
+        if name == 'leaderboard':
+            return f'$leaderboard {self.rng.randint(1, 3)}'
+        if name == 'gamble':
+            return '$gamble 1000'
+        if name == 'buy':
+            return f'$buy {self.rng.choice(bot.SHOP_ITEMS)} 1'
+        if name == 'explore':
+            return f'$explore {self.rng.choice(list(bot_utils.game_data.locations))}'
+        if name == 'stash':
+            return '$stash coconut'
+
+        return f'${name}'
+
+    def next_event(self):
+        """Gets the next event
+
+        Returns:
+            Tuple[string, tuple]: Name of the event (on_<name> is the handler) and its arguments
+        """
+        kind = self.pick(self.event_mix)
+        guild = self.rng.choice(self.guilds)
+        author = self.member(guild)
+
+        recent = self.recent[guild.id]
+
+        if kind in ('reaction_add', 'reaction_remove', 'message_edit', 'message_delete') and not recent:
+            kind = 'message'
+
+        if kind == 'message':
+            return kind, (self.message(guild, author),)
+        if kind == 'command':
+            return 'message', (self.message(guild, author, self.command(guild, author)),)
+        if kind == 'typing':
+            return kind, (guild.text_channel, author, time.time())
+        if kind in ('reaction_add', 'reaction_remove'):
+            return kind, (FakeReaction(self.rng.choice(recent)), author)
+        if kind == 'message_delete':
+            message = recent.pop(self.rng.randrange(len(recent)))
+            return kind, (message,)
+        if kind == 'message_edit':
+            before = self.rng.choice(recent)
+            after = FakeMessage(before.id, before.author, before.channel, before.content + ' (edited)')
+            return kind, (before, after)
+
+        return kind, self.voice_change(guild, author)
+
+    def voice_change(self, guild, member):
+        before = self.voice.get(member.id, FakeVoiceState())
+
+        if before.channel is None:
+            after = FakeVoiceState(guild.voice_channel)
+        elif self.rng.random() < 0.4:
+            after = FakeVoiceState()
+        else:
+            after = FakeVoiceState(guild.voice_channel, self_mute=not before.self_mute, afk=self.rng.random() < 0.1)
+
+        self.voice[member.id] = after
+
+        return member, before, after
+
+
+def percentile(values, q):
+    if not values:
+        return 0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def drive(events, concurrency):
+    """Runs the events through their handlers with at most concurrency running at once,
+       the way discord.py runs every event in its own task
+
+    Args:
+        events (Iterable[Tuple[string, tuple]]): Events from Workload.next_event
+        concurrency (int): Handlers allowed to run at the same time
+
+    Returns:
+        dict: Latencies and errors keyed by event name
+    """
+    slots = asyncio.Semaphore(concurrency)
+    latencies = {}
+    errors = {}
+    tasks = set()
+
+    async def handle(name, args):
+        started = time.perf_counter()
+
+        try:
+            await getattr(bot.bot, f'on_{name}')(*args)
+        except Exception as error:
+            errors.setdefault(name, []).append(repr(error))
+        finally:
+            latencies.setdefault(name, []).append(time.perf_counter() - started)
+            slots.release()
+
+    for name, args in events:
+        await slots.acquire()
+        task = asyncio.ensure_future(handle(name, args))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks)
+
+    return {'latencies': latencies, 'errors': errors}
+
+
+async def run_gateway(guild_count, member_count, event_count, concurrency, latency, seed, warm_up=False):
+    """Runs the gateway scenario. The caches start out empty like after a restart,
+       unless warm_up preloads them first
+
+    Returns:
+        dict: Report with events/sec, latencies and database operations per event
+    """
+    client = MemoryClient(latency, bot_utils.metrics)
+    prepare_bot(client)
+
+    started = time.perf_counter()
+    guilds = await create_guilds(client, guild_count, member_count)
+    setup_seconds = time.perf_counter() - started
+    readiness = await bot.warm_up_guilds(guilds) if warm_up else None
+    setup_operations = client.operations
+    bot_utils.metrics.reset()
+
+    workload = Workload(guilds, seed)
+    flusher = asyncio.ensure_future(bot.xp_buffer.run())
+    started = time.perf_counter()
+
+    result = await drive((workload.next_event() for _ in range(event_count)), concurrency)
+
+    # end the remaining calls and write the buffered xp, that is part of the work too
+    for user_key in list(bot.ongoing_calls):
+        bot.end_call(user_key)
+
+    flusher.cancel()
+    await bot.xp_buffer.flush_async()
+    seconds = time.perf_counter() - started
+    operations = client.operations - setup_operations
+
+    return {
+        'scenario': 'gateway',
+        'guilds': guild_count,
+        'members': member_count,
+        'events': event_count,
+        'concurrency': concurrency,
+        'latency': latency,
+        'seed': seed,
+        'setup_seconds': setup_seconds,
+        'warm_up': readiness,
+        'seconds': seconds,
+        'events_per_second': event_count / seconds,
+        'db_ops': operations,
+        'db_ops_per_event': operations / event_count,
+        'handlers': {name: {'count': len(values),
+                            'p50_ms': percentile(values, 0.5) * 1000,
+                            'p99_ms': percentile(values, 0.99) * 1000,
+                            'errors': len(result['errors'].get(name, ()))}
+                     for name, values in sorted(result['latencies'].items())},
+        'commands': bot_utils.metrics.summary('command.'),
+        'slowest_db': bot_utils.metrics.summary('db.')[:10],
+        'first_errors': {name: errors[0] for name, errors in result['errors'].items()},
+    }
+
+
+async def run_gifting(member_count, gift_count, concurrency, latency, seed):
+    """Runs the gifting stress scenario: concurrent gifts between a handful of members.
+       Afterwards no points may have been created or lost, no balance may be negative
+       and nobody may have gifted more than the daily limit. One member joins without
+       documents, like a member onboarding has not reached, and has to receive gifts too
+
+    Returns:
+        dict: Report with the outcome of every gift and the invariant checks
+    """
+    client = MemoryClient(latency, bot_utils.metrics)
+    prepare_bot(client)
+    guild, = await create_guilds(client, 1, member_count, points=bot_utils.GIFT_LIMIT)
+    members = [member for member in guild.members if not member.bot]
+    expected_total = bot_utils.GIFT_LIMIT * len(members)
+    newcomer = guild.add_member(max(member.id for member in members) + 1)
+    rng = random.Random(seed)
+    outcomes = {}
+    sent = {member.id: 0 for member in members + [newcomer]}
+    slots = asyncio.Semaphore(concurrency)
+
+    async def gift(sender, recipient, amount):
+        async with slots:
+            result = await async_bot_utils.send_points(guild, sender.id, recipient.id, amount)
+
+        outcomes[result] = outcomes.get(result, 0) + 1
+
+        if result == bot_utils.GIFT_SENT:
+            sent[sender.id] += amount
+
+        return result
+
+    newcomer_gifted = await gift(members[0], newcomer, 1) == bot_utils.GIFT_SENT
+    members.append(newcomer)
+    gifts = []
+
+    for _ in range(gift_count):
+        sender, recipient = rng.sample(members, 2)
+        gifts.append(gift(sender, recipient, rng.randint(1, 100)))
+
+    started = time.perf_counter()
+    await asyncio.gather(*gifts)
+    seconds = time.perf_counter() - started
+
+    docs = list(client['UserData']['Members'].find({'guild_id': guild.id, 'bot': {'$ne': True}}))
+    total = sum(doc['points'] for doc in docs)
+
+    return {
+        'scenario': 'gifting',
+        'members': member_count,
+        'gifts': gift_count,
+        'concurrency': concurrency,
+        'latency': latency,
+        'seed': seed,
+        'seconds': seconds,
+        'gifts_per_second': gift_count / seconds,
+        'outcomes': outcomes,
+        'points_conserved': total == expected_total,
+        'no_negative_balance': all(doc['points'] >= 0 for doc in docs),
+        'limit_respected': all(amount <= bot_utils.GIFT_LIMIT for amount in sent.values()),
+        'gift_counters_match': all(doc.get('total_gift', 0) == sent[doc['user_id']] for doc in docs),
+        'member_without_documents_gifted': newcomer_gifted,
+    }
+
+
+async def run_startup(connect_latency, login_seconds, latency):
+    """Runs the startup scenario. Logging in to Discord is simulated with a sleep and
+       connecting to Atlas with MemoryClient's connect_latency. Before, the database was
+       connected and indexed first and the bot logged in afterwards. Now prepare_database
+       runs on a thread while the bot logs in and commands wait for the indexes
+
+    Returns:
+        dict: Report with the time until ready and until the first answered command
+    """
+    prepare_bot(MemoryClient())
+    report = {'scenario': 'startup', 'connect_latency': connect_latency, 'login_seconds': login_seconds}
+
+    for mode in ('before', 'after'):
+        bot_utils.database.use(MemoryClient(latency, bot_utils.metrics, connect_latency))
+        bot_utils.member_cache.clear()
+        bot_utils.inventory_cache.clear()
+        guild = FakeGuild(1)
+        member = guild.add_member(1_000_000)
+        preparing = None
+        started = time.perf_counter()
+
+        if mode == 'before':
+            bot_utils.database.warm_up()
+            bot_utils.ensure_indexes()
+        else:
+            async_bot_utils.database_ready.clear()
+            preparing = asyncio.get_event_loop().run_in_executor(None, bot.prepare_database)
+
+        await asyncio.sleep(login_seconds)
+        ready = time.perf_counter() - started
+        await bot.bot.on_message(FakeMessage(1, member, guild.text_channel, '$points'))
+        answered = time.perf_counter() - started
+
+        if preparing is not None:
+            await preparing
+
+        report[mode] = {'ready_seconds': ready, 'first_command_seconds': answered}
+
+    report['saved_seconds'] = report['before']['first_command_seconds'] - report['after']['first_command_seconds']
+
+    return report
+
+
+def print_report(report):
+    print(json.dumps(report, indent=2, default=str))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline throughput benchmark for the bot')
+    parser.add_argument('scenario', choices=['gateway', 'gifting', 'startup'], nargs='?', default='gateway')
+    parser.add_argument('--guilds', type=int, default=5)
+    parser.add_argument('--members', type=int, default=200)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--gifts', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=64, help='handlers running at the same time')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every database operation')
+    parser.add_argument('--connect-latency', type=float, default=1.5,
+                        help='seconds connecting to the database takes in the startup scenario')
+    parser.add_argument('--login', type=float, default=2,
+                        help='seconds logging in to Discord takes in the startup scenario')
+    parser.add_argument('--warm-up', action='store_true', help='preload the caches before the gateway scenario')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='append the report to this JSON lines file')
+    args = parser.parse_args()
+
+    if args.scenario == 'gateway':
+        scenario = run_gateway(args.guilds, args.members, args.events, args.concurrency, args.latency, args.seed,
+                               args.warm_up)
+    elif args.scenario == 'gifting':
+        scenario = run_gifting(args.members, args.gifts, args.concurrency, args.latency, args.seed)
+    else:
+        scenario = run_startup(args.connect_latency, args.login, args.latency)
+
+    # the voice handler schedules checkpoints on bot.loop, so the benchmark has to run on it
+    report = bot.bot.loop.run_until_complete(scenario)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'a') as file:
+            file.write(json.dumps(report, default=str) + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,45 @@
 # bot.py
 import asyncio
 import os
-import random
-from datetime import datetime, timedelta
-from operator import itemgetter
-from threading import Timer
+import time
+from threading import Thread
 
 import discord
 from discord.ext import commands
-from dotenv import load_dotenv
-from pymongo import MongoClient
 
+import async_bot_utils
 import bot_utils
 from BottleItem import BottleItem
-from DrinkItem import DrinkItem
-from EdibleItem import EdibleItem
-from FoodItem import FoodItem
-from Item import Item
-from ItemType import ItemType
+from DMDispatcher import DMDispatcher
+from EventRecorder import EventRecorder
+from MediaCache import MediaCache
 from Shop import Shop
+from UserResolver import UserResolver
 from VoiceActivity import VoiceActivity
+from XPBuffer import XPBuffer
 
 BOT_ID = 818905677010305096
 UPDATE_DOCS = False
+MIGRATE_MEMBER_DOCS = True
+VOICE_CHECKPOINT_SECONDS = 15 * 60  # how often xp of ongoing calls gets awarded
+ONBOARDING_BATCH_SIZE = 1000  # members added per round trip when the bot joins a server
+RECONCILE_SECONDS = 6 * 60 * 60  # how often stored members are compared with the server member lists
+SHOP_ITEMS = ['ale', 'coconut', 'fish']
+CHEERS_IMAGE = 'images/cheers.gif'
+OPENING_MESSAGE_IMAGE = 'images/opening_message.gif'
+METRICS_FILE = os.getenv('METRICS_FILE', 'metrics.jsonl')  # where $stats dump appends
+RECORD_EVENTS = os.getenv('RECORD_EVENTS')  # file to record gateway events to for replay.py, off if unset
+WARM_UP_GUILDS = os.getenv('WARM_UP_GUILDS')  # 'all' or how many of the biggest guilds to preload on startup, off if unset
+WARM_UP_CONCURRENCY = 4  # guilds preloaded at a time, leaves database workers for commands
 ERROR_COLOR = LOSE_COLOR = 0xFF0000
 WIN_COLOR = 0x00FF00
 ACCENT_COLOR = 0xFFD700
 
-load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
-CONNECTION_URL = os.getenv('MONGODB_CONNECTION_URL')
 
-# connecting to MongoDB Atlas
-cluster = MongoClient(CONNECTION_URL)
-db = cluster["UserData"]
-user_data_collection = db["UserData"]
-inventory_collection = db["Inventories"]
+# shared with bot_utils, MongoDB Atlas is only contacted once they are used
+user_data_collection = bot_utils.user_data_collection
+inventory_collection = bot_utils.inventory_collection
 
 intents = discord.Intents.all()
 bot = commands.Bot(command_prefix='$', intents=intents)
@@ -43,14 +47,14 @@ bot = commands.Bot(command_prefix='$', intents=intents)
 active_guilds = []
 ongoing_calls = {}  # holds information on people in ongoing calls
 main_shop = Shop("Main Shop")
-
-ALE = DrinkItem(0, 'ale', 15, ItemType.ALCOHOL,
-                "A classic alchoholic drink made from the best ingredients on the island", 5, 0, 0, True)
-COCONUT = FoodItem(1, 'coconut', 5,
-                   ItemType.CONSUMABLE, "A refreshing snack that can be found at the beach", 10, .6, 10)
-FISH = FoodItem(2, 'fish', 10, ItemType.CONSUMABLE,
-                "Smelly and slimey delicacy of the ocean", 5, .1, 30)
-
+xp_buffer = XPBuffer()  # message, typing and reaction xp waiting to be written
+xp_flush_task = None
+user_resolver = UserResolver(bot)  # names without calling bot.fetch_user
+media = MediaCache()  # GIFs are uploaded once and linked afterwards
+dm_dispatcher = DMDispatcher(async_bot_utils.save_welcome_progress)  # welcome messages
+onboarding = {}  # guild id -> progress of adding its members to the database
+onboarding_tasks = {}  # guild id -> task adding its members
+readiness = {'state': 'cold'}  # progress of warm_up_guilds
 
 # action to perform when bot is ready
 @bot.event
@@ -61,6 +65,202 @@ async def on_ready():
     global active_guilds
     active_guilds = [guild.id for guild in bot.guilds]
 
+    # on_ready can fire again after a reconnect, only start flushing once
+    global xp_flush_task
+    if xp_flush_task is None:
+        xp_flush_task = bot.loop.create_task(xp_buffer.run())
+        bot.loop.create_task(watch_game_data())
+        bot.loop.create_task(resume_onboarding())
+        bot.loop.create_task(reconcile_members_periodically())
+
+        if WARM_UP_GUILDS:
+            limit = None if WARM_UP_GUILDS == 'all' else int(WARM_UP_GUILDS)
+            bot.loop.create_task(warm_up_guilds(bot.guilds, limit))
+
+
+async def warm_up_guilds(guilds, limit=None, concurrency=WARM_UP_CONCURRENCY):
+    """Loads the members, inventories and leaderboards of the biggest guilds into memory,
+       so the first commands after a restart are as fast as later ones. Guilds are taken
+       biggest first as long as their members fit in the member cache
+
+    Args:
+        guilds (List[discord.Guild]): Guilds to choose from
+        limit (int, optional): Most guilds to warm up, None for as many as fit
+        concurrency (int, optional): Guilds loaded at a time. Defaults to WARM_UP_CONCURRENCY.
+
+    Returns:
+        dict: How the warm-up went, also kept in readiness
+    """
+    room = bot_utils.member_cache.max_size
+    chosen = []
+
+    for guild in sorted(guilds, key=lambda guild: guild.member_count, reverse=True)[:limit]:
+        if guild.member_count <= room:
+            room -= guild.member_count
+            chosen.append(guild)
+
+    readiness.clear()
+    readiness.update({'state': 'warming', 'guilds': len(chosen), 'warmed': 0, 'failed': 0,
+                      'members': 0, 'inventories': 0, 'seconds': 0})
+    slots = asyncio.Semaphore(concurrency)
+    warm_guild = bot_utils.metrics.timed('warmup.guild', async_bot_utils.warm_guild)
+    started = time.perf_counter()
+
+    async def warm(guild):
+        async with slots:
+            try:
+                members, inventories = await warm_guild(guild)
+            except Exception as error:  # that guild just starts cold
+                readiness['failed'] += 1
+                print(f"Failed to warm up {guild.name}: {error}")
+                return
+
+        readiness['warmed'] += 1
+        readiness['members'] += members
+        readiness['inventories'] += inventories
+
+    await asyncio.gather(*(warm(guild) for guild in chosen))
+    readiness['state'] = 'ready'
+    readiness['seconds'] = time.perf_counter() - started
+    print(f"Warmed up {readiness['warmed']} guilds with {readiness['members']} members in {readiness['seconds']:.1f} s")
+
+    return readiness
+
+
+async def resume_onboarding():
+    """Continues adding members and sending welcome messages where a restart interrupted them"""
+    for guild in bot.guilds:
+        start_onboarding(guild)
+        cursor = await async_bot_utils.get_welcome_cursor(guild.id)
+
+        if cursor is not None:
+            dm_dispatcher.start(guild, cursor, embed=welcome_embed())
+
+
+def start_onboarding(guild):
+    """Starts adding the members of a guild in the background, unless that is already happening
+
+    Returns:
+        asyncio.Task: Task adding the members
+    """
+    task = onboarding_tasks.get(guild.id)
+
+    if task is None or task.done():
+        task = onboarding_tasks[guild.id] = bot.loop.create_task(onboard_guild(guild))
+
+    return task
+
+
+async def onboard_guild(guild, batch_size=ONBOARDING_BATCH_SIZE):
+    """Adds a document for every member of a guild, batch_size members per round trip.
+       Members are added in id order and progress is saved after every batch, so after a
+       restart only the members that were not reached yet are added. Members that use a
+       command before they are reached get their documents on the spot
+
+    Args:
+        guild (discord.Guild): Guild to add the members of
+        batch_size (int, optional): Members per batch. Defaults to ONBOARDING_BATCH_SIZE.
+
+    Returns:
+        int: Number of members added
+    """
+    cursor = await async_bot_utils.get_onboarding_cursor(guild.id)
+
+    if cursor is None:
+        return 0
+
+    # only ids are kept for the whole guild, documents are built one batch at a time
+    user_ids = sorted(member.id for member in guild.members if member.id > cursor)
+    progress = onboarding[guild.id] = {'total': len(user_ids), 'added': 0, 'finished': False}
+
+    for start in range(0, len(user_ids), batch_size):
+        # members that left in the meantime are not added back
+        members = [guild.get_member(user_id) for user_id in user_ids[start:start + batch_size]]
+        batch = [(member.id, member.bot) for member in members if member is not None]
+
+        try:
+            await async_bot_utils.onboard_members(guild.id, batch)
+        except Exception as error:  # picked up again on the next start
+            print(f"Adding members of {guild.name} stopped after {progress['added']}: {error}")
+            raise
+
+        progress['added'] += len(batch)
+
+    await async_bot_utils.finish_onboarding(guild.id)
+    progress['finished'] = True
+    print(f"Added {progress['added']} members of {guild.name}")
+
+    return progress['added']
+
+
+async def reconcile_members_periodically(interval=RECONCILE_SECONDS):
+    """Catches up on members that joined or left while the bot was offline or disconnected,
+       right away and then every interval seconds
+
+    Args:
+        interval (int, optional): Seconds between runs. Defaults to RECONCILE_SECONDS.
+    """
+    while True:
+        started = time.perf_counter()
+        added = removed = 0
+
+        for guild in list(bot.guilds):
+            try:
+                joined, left = await reconcile_guild(guild)
+            except Exception as error:  # tried again next time
+                print(f"Failed to reconcile the members of {guild.name}: {error}")
+                continue
+
+            added += joined
+            removed += left
+
+        if added or removed:
+            print(f"Reconciled members in {time.perf_counter() - started:.1f} s: {added} added, {removed} removed")
+
+        await asyncio.sleep(interval)
+
+
+async def reconcile_guild(guild):
+    """Gives documents to the members of a guild that have none and removes the documents
+       of members that are gone, one bulk write for the whole guild
+
+    Args:
+        guild (discord.Guild): Guild to reconcile
+
+    Returns:
+        Tuple[int, int]: Number of members added and removed
+    """
+    task = onboarding_tasks.get(guild.id)
+
+    # a partial member list would make present members look gone, onboarding adds everyone anyway
+    if not guild.chunked or (task is not None and not task.done()):
+        return 0, 0
+
+    # members still in the legacy documents would look new and get their data replaced by defaults
+    if not await async_bot_utils.members_migrated(guild.id):
+        return 0, 0
+
+    stored = await async_bot_utils.get_stored_member_ids(guild.id)
+    # listed after reading the stored ids, so someone joining in between is never removed
+    present = {member.id: member.bot for member in guild.members}
+    joined = [(user_id, is_bot) for user_id, is_bot in present.items() if user_id not in stored]
+    left = [user_id for user_id in stored if user_id not in present]
+
+    if len(left) > 10 and len(left) > len(stored) // 2:
+        print(f"Not removing {len(left)} of {len(stored)} members of {guild.name}, the member list looks incomplete")
+        left = []
+
+    if joined or left:
+        await async_bot_utils.reconcile_members(guild.id, joined, left)
+
+    return len(joined), len(left)
+
+
+def welcome_embed():
+    """Direct message sent to members when they or their server join"""
+    return discord.Embed(title="Welcome to DisruptPoints (the name is WIP)!",
+                         description="This bot encourages community engagement with a story that the player follows to uncover the truth of a mysterious world they find themselves in.\nType '$help' to get a list of all commands you can use. Only '$help' and '$shop' will work in this DM since the game store information per server you're on.\nTo use the other commands we recommend creating a channel for this bot and enter them there.", color=ACCENT_COLOR)
+
 
 @bot.event
 async def on_guild_join(guild):
@@ -69,15 +269,13 @@ async def on_guild_join(guild):
     Args:
         guild (discord.Guild): Server bot was added to
     """
-    bot_utils.create_guild_entry(guild)
+    await async_bot_utils.create_guild_entry(guild)
     active_guilds.append(guild.id)
 
-    # send direct message to each user in the server
-    for member in guild.members:
-        await member.create_dm()
-        embed = discord.Embed(title="Welcome to DisruptPoints (the name is WIP)!",
-                              description="This bot encourages community engagement with a story that the player follows to uncover the truth of a mysterious world they find themselves in.\nType '$help' to get a list of all commands you can use. Only '$help' and '$shop' will work in this DM since the game store information per server you're on.\nTo use the other commands we recommend creating a channel for this bot and enter them there.", color=ACCENT_COLOR)
-        await member.send(embed=embed)
+    # members are added and messaged in the background, a big server takes a while
+    start_onboarding(guild)
+    await async_bot_utils.start_welcome_messages(guild.id)
+    dm_dispatcher.start(guild, embed=welcome_embed())
 
 
 # when a server changed its name, afk timeout, etc...
@@ -91,12 +289,7 @@ async def on_guild_update(before, after):
     """
 
     # update guild information in the database
-    user_data_collection.update_one({'guild_id': before.id},
-                                    {"$set":
-                                     {
-                                         'guild_id': after.id,
-                                         'guild_name': after.name
-                                     }})
+    await async_bot_utils.update_guild_info(before, after)
 
 
 @bot.event
@@ -106,13 +299,11 @@ async def on_member_join(member):
     Args:
         member (discord.Member): New member the joined the server
     """
-    bot_utils.create_user_entry(member.guild, member)
+    await async_bot_utils.create_user_entry(member.guild, member)
 
-    # send new member a direct message
-    await member.create_dm()
-    embed = discord.Embed(title="Welcome to DisruptPoints (the name is WIP)!",
-                          description="This bot encourages community engagement with a story that the player follows to uncover the truth of a mysterious world they find themselves in.\nType '$help' to get a list of all commands you can use. Only '$help' and '$shop' will work in this DM since the game store information per server you're on.\nTo use the other commands we recommend creating a channel for this bot and enter them there.", color=ACCENT_COLOR)
-    await member.send(embed=embed)
+    # send new member a direct message, sharing the rate limit with guild welcomes
+    if not member.bot:
+        bot.loop.create_task(dm_dispatcher.deliver(member, {'embed': welcome_embed()}))
 
 
 @bot.event
@@ -122,12 +313,34 @@ async def on_member_remove(member):
     Args:
         member (discord.Member): Member that left/got removed
     """
-    bot_utils.remove_user_entry(member.guild, member)
+    await async_bot_utils.remove_user_entry(member.guild, member)
+
+
+@bot.event
+async def on_member_update(before, after):
+    """Action when a member changes their nickname, roles, etc...
+
+    Args:
+        before (discord.Member): Member information before the update
+        after (discord.Member): Member information after the update
+    """
+    user_resolver.update(after)
+
+
+@bot.event
+async def on_user_update(before, after):
+    """Action when a user changes their name, avatar, etc...
+
+    Args:
+        before (discord.User): User information before the update
+        after (discord.User): User information after the update
+    """
+    user_resolver.update(after)
 
 
 @bot.event
 async def on_typing(channel, user, when):
-    bot_utils.update_xp(channel.guild, user, 5)
+    xp_buffer.add(channel.guild, user, 5)
 
 
 @bot.event
@@ -137,14 +350,14 @@ async def on_message(message):
 
     # if the command is not a command and the message is not coming from the bot, update users xp
     if (not message.content.startswith('$')) and (message.author.id != BOT_ID):
-        bot_utils.update_xp(message.guild, message.author,
-                            bot_utils.calculate_message_xp(message))
+        xp_buffer.add(message.guild, message.author,
+                      bot_utils.calculate_message_xp(message))
 
 
 @bot.event
 async def on_message_delete(message):
-    bot_utils.update_xp(message.guild, message.author,
-                        (-1 * bot_utils.calculate_message_xp(message)))
+    xp_buffer.add(message.guild, message.author,
+                  (-1 * bot_utils.calculate_message_xp(message)))
 
 
 @bot.event
@@ -157,29 +370,29 @@ async def on_message_edit(before, after):
 
     # update with the difference
     difference = after_points - before_points
-    bot_utils.update_xp(after.guild, before.author, difference)
+    xp_buffer.add(after.guild, before.author, difference)
 
 
 @bot.event
 async def on_reaction_add(reaction, user):
-    bot_utils.update_xp(reaction.message.guild, user, 5)
+    xp_buffer.add(reaction.message.guild, user, 5)
 
 
 @bot.event
 async def on_reaction_remove(reaction, user):
-    bot_utils.update_xp(reaction.message.guild, user, -5)
+    xp_buffer.add(reaction.message.guild, user, -5)
 
 
 @bot.event
 async def on_member_ban(guild, user):
-    bot_utils.update_xp(guild, user, 0, reset=True)
-    bot_utils.update_points(guild, user, 0, reset=True)
+    await async_bot_utils.update_xp(guild, user, 0, reset=True)
+    await async_bot_utils.update_points(guild, user, 0, reset=True)
 
 
 @bot.event
 async def on_member_unban(guild, user):
-    bot_utils.update_xp(guild, user, 0, reset=True)
-    bot_utils.update_points(guild, user, 0, reset=True)
+    await async_bot_utils.update_xp(guild, user, 0, reset=True)
+    await async_bot_utils.update_points(guild, user, 0, reset=True)
 
 
 @bot.event
@@ -192,52 +405,59 @@ async def on_voice_state_update(member, before, after):
         before (discord.VoiceState): Previous voice state
         after (discord.VoiceState): Current voice state
     """
-    if str(member.id) in ongoing_calls.keys():  # if the call is ongoing
-        if after.channel is None:  # disconnecting from a call
-            points = ongoing_calls[str(member.id)].get_points()
-            bot_utils.update_xp(before.channel.guild, member, points)
-            del ongoing_calls[str(member.id)]
-        elif after.channel.guild.id not in active_guilds:  # another server
-            points = ongoing_calls[str(member.id)].get_points()
-            bot_utils.update_xp(before.channel.guild, member, points)
-            del ongoing_calls[str(member.id)]
-        elif after.afk:
-            ongoing_calls[str(member.id)].go_afk()
-        elif after.self_mute or after.mute:  # if muted
-            ongoing_calls[str(member.id)].mute()
-        elif after.self_deaf or after.deaf:  # if deafened
-            ongoing_calls[str(member.id)].deafen()
-        elif not after.self_mute or not after.mute:  # if unmuted
-            ongoing_calls[str(member.id)].unmute()
-        elif not after.self_deaf or not after.deaf:  # if undeafened
-            ongoing_calls[str(member.id)].undeafen()
-        elif not after.afk:
-            ongoing_calls[str(member.id)].unafk()
-        else:
-            print("something else happened")
-    else:
-        if after.channel is None:
-            return
-        if after.channel.guild is not None:  # if joining a call
-            muted = deafened = afk = False
-
-            if after.mute or before.self_mute:
-                muted = True
-            if after.deaf or before.self_deaf:
-                deafened = True
-            if after.afk:
-                deafened = True
-
-            activity = VoiceActivity(after.channel.guild, member, muted,
-                                     deafened, afk)
-            ongoing_calls[str(member.id)] = activity
-        else:
-            print("something else happened p2")
+    activity = ongoing_calls.get(str(member.id))
+
+    if activity is not None:  # if the call is ongoing
+        if after.channel is None or after.channel.guild.id not in active_guilds:  # disconnecting from a call
+            end_call(str(member.id))
+        else:  # muted, deafened, afk or any combination changed
+            activity.update(*voice_flags(after))
+    elif after.channel is not None:  # if joining a call
+        activity = VoiceActivity(after.channel.guild, member, *voice_flags(after))
+        ongoing_calls[str(member.id)] = activity
+        activity.checkpoint = bot.loop.call_later(VOICE_CHECKPOINT_SECONDS, voice_checkpoint, str(member.id))
+
+
+def voice_flags(state):
+    """Gets the muted, deafened and afk flags of a voice state
+
+    Args:
+        state (discord.VoiceState): Voice state to read
+
+    Returns:
+        Tuple[bool, bool, bool]: Whether the user is muted, deafened and afk
+    """
+    return state.self_mute or state.mute, state.self_deaf or state.deaf, state.afk
+
+
+def voice_checkpoint(user_key):
+    """Awards the xp earned so far in an ongoing call so long calls don't wait until
+       the user leaves. Runs on the event loop and reschedules itself
+
+    Args:
+        user_key (string): Key of the call in ongoing_calls
+    """
+    activity = ongoing_calls.get(user_key)
+
+    if activity is not None:
+        xp_buffer.add(activity.guild, activity.user, activity.collect())
+        activity.checkpoint = bot.loop.call_later(VOICE_CHECKPOINT_SECONDS, voice_checkpoint, user_key)
+
+
+def end_call(user_key):
+    """Awards the remaining xp of a call and stops tracking it
+
+    Args:
+        user_key (string): Key of the call in ongoing_calls
+    """
+    activity = ongoing_calls.pop(user_key)
+    activity.checkpoint.cancel()
+    xp_buffer.add(activity.guild, activity.user, activity.collect())
 
 
 @bot.command(name='points', help='Displays how many server points a user has')
 async def points(ctx):
-    points = bot_utils.get_points(ctx.guild, ctx.author)
+    points = await async_bot_utils.get_points(ctx.guild, ctx.author)
     embed = discord.Embed(title=f"{ctx.author.name}'s Point Total",
                           description=f'Points: {points}', color=ACCENT_COLOR)
     await ctx.send(embed=embed)
@@ -259,40 +479,51 @@ async def gift_points(ctx, recipient, amount):
         await ctx.send(embed=embed)
         return
 
-    # check senders balance
-    senders_balance = bot_utils.get_points(ctx.guild, ctx.author)
+    if ctx.author.id == recipient_user_id:
+        embed = discord.Embed(
+            title='Error', description="You can not gift yourself points", color=ERROR_COLOR)
+        await ctx.send(embed=embed)
+        return
 
-    if senders_balance >= amount:
-        # add amount to recipient and subtract from sender --> reupdate db
-        if ctx.author.id == recipient_user_id:
-            embed = discord.Embed(
-                title='Error', description="You can not gift yourself points", color=ERROR_COLOR)
-            await ctx.send(embed=embed)
-            return
-        else:
-            # check to see if money was successfully sent to the recipient
-            money_sent = bot_utils.send_points(
-                ctx.guild, ctx.author.id, recipient_user_id, amount)
-
-            if money_sent:
-                recipient_user = await bot.fetch_user(recipient_user_id)
-                embed = discord.Embed(
-                    title='Points Gifted', description=f"{ctx.author.name} gifted {recipient_user.name} {amount} points", color=WIN_COLOR)
-                await ctx.send(embed=embed)
-            else:
-                embed = discord.Embed(
-                    title="Error", description='You already hit the gifting limit for today or your request would push you over the limit', color=ERROR_COLOR)
-                await ctx.send(embed=embed)
-    else:
+    if amount <= 0:
         embed = discord.Embed(
-            title="Error", description='Insufficient Points', color=ERROR_COLOR)
+            title="Error", description='Invalid amount entered', color=ERROR_COLOR)
         await ctx.send(embed=embed)
+        return
+
+    recipient_member = ctx.guild.get_member(recipient_user_id)
+
+    if recipient_member is None or recipient_member.bot:
+        embed = discord.Embed(
+            title="Error", description='You can only gift points to members of this server', color=ERROR_COLOR)
+        await ctx.send(embed=embed)
+        return
+
+    # the balance and the daily limit are checked by the transfer itself
+    result = await async_bot_utils.send_points(
+        ctx.guild, ctx.author.id, recipient_user_id, amount)
+
+    if result == bot_utils.GIFT_SENT:
+        recipient = await user_resolver.resolve(ctx.guild, recipient_user_id)
+        recipient_name = recipient[0] if recipient is not None else f'<@{recipient_user_id}>'
+        embed = discord.Embed(
+            title='Points Gifted', description=f"{ctx.author.name} gifted {recipient_name} {amount} points", color=WIN_COLOR)
+    elif result == bot_utils.GIFT_INSUFFICIENT_POINTS:
+        embed = discord.Embed(
+            title="Error", description='Insufficient Points', color=ERROR_COLOR)
+    elif result == bot_utils.GIFT_LIMIT_REACHED:
+        embed = discord.Embed(
+            title="Error", description='You already hit the gifting limit for today or your request would push you over the limit', color=ERROR_COLOR)
+    else:
+        embed = discord.Embed(
+            title="Error", description="The points could not be gifted", color=ERROR_COLOR)
+
+    await ctx.send(embed=embed)
 
 
 @bot.command(name='gamble', help='Gamble a certain amount of server points')
 async def gamble(ctx, amount):
-    doc = bot_utils.get_userdata_doc(ctx.guild)
-    user_points = doc['members'][str(ctx.author.id)]['points']
+    user_points = await async_bot_utils.get_points(ctx.guild, ctx.author)
     min_amount = 1000
 
     if user_points < min_amount:
@@ -301,7 +532,7 @@ async def gamble(ctx, amount):
         await ctx.send(embed=embed)
     elif amount == 'all':
         winnings = bot_utils.gamble_points_basic(user_points)
-        bot_utils.update_points(ctx.guild, ctx.author, winnings)
+        await async_bot_utils.update_points(ctx.guild, ctx.author, winnings)
 
         if winnings > 0:
             embed = discord.Embed(title='Gamble Results',
@@ -317,7 +548,7 @@ async def gamble(ctx, amount):
 
             if min_amount <= amount <= user_points:
                 winnings = bot_utils.gamble_points_basic(amount)
-                bot_utils.update_points(ctx.guild, ctx.author, winnings)
+                await async_bot_utils.update_points(ctx.guild, ctx.author, winnings)
 
                 if winnings > 0:
                     embed = discord.Embed(title='Gamble Results',
@@ -341,12 +572,9 @@ async def gamble(ctx, amount):
 
 @bot.command(name='inventory', help='Displays the current inventory of the user')
 async def display_inventory(ctx):
-    doc = bot_utils.get_userdata_doc(ctx.guild)
-    inventory_id = doc['members'][str(ctx.author.id)]['inventory_id']
-    inventory_doc = bot_utils.get_inventory_doc(ctx.guild)
-    inventories = inventory_doc['inventories']
-    inventory_info = inventories[str(inventory_id)]
+    inventory_info = await async_bot_utils.get_member_inventory(ctx.guild, ctx.author)
     inventory = inventory_info['inventory']
+    catalog = bot_utils.game_data.catalog
 
     embed = discord.Embed(title=f"{ctx.author.name}'s Inventory",
                           description=f"Capacity: {inventory_info['size']}/{inventory_info['capacity']}\nYou have the following items:",
@@ -354,7 +582,7 @@ async def display_inventory(ctx):
 
     # for loop busted wtf
     for item_id, item_quantity in inventory.items():
-        item_name = bot_utils.item_lookup(item_id)['name']
+        item_name = catalog.get(item_id).name
         embed.add_field(name=item_name.title(),
                         value=item_quantity, inline=True)
 
@@ -363,9 +591,9 @@ async def display_inventory(ctx):
 
 @bot.command(name='rank', help='Displays user current rank and exp')
 async def rank(ctx):
-    doc = bot_utils.get_userdata_doc(ctx.guild)
-    xp = doc['members'][str(ctx.author.id)]['xp']
-    rank = bot_utils.get_rank(doc['members'][str(ctx.author.id)]['level'])
+    member = await async_bot_utils.get_member_doc(ctx.guild, ctx.author)
+    xp = member['xp'] + xp_buffer.get_pending(ctx.guild, ctx.author)
+    rank = bot_utils.get_rank(member['level'])
 
     embed = discord.Embed(title=f"{ctx.author.name}'s Rank",
                           description=f"Rank: {rank}\nXP: {xp}",
@@ -389,7 +617,7 @@ async def shop(ctx):
 async def buy(ctx, name, quantity=1):
     # see if name exists in the Shop
     name = name.lower()
-    item = bot_utils.check_item_exists(name)
+    item = bot_utils.game_data.catalog.find(name)
 
     if item is None:
         embed = discord.Embed(
@@ -406,128 +634,65 @@ async def buy(ctx, name, quantity=1):
         await ctx.send(embed=embed)
         return
 
-    success = await add_to_inventory(ctx, bot_utils.item_id_lookup(name), quantity, output=True)
+    success = await add_to_inventory(ctx, item.id, quantity, output=True)
 
     if success:
-        bot_utils.update_points(
-            ctx.guild, ctx.author, -1 * quantity * item['price'])
+        await async_bot_utils.update_points(
+            ctx.guild, ctx.author, -1 * quantity * item.price)
 
 
-@bot.command(name='explore', help='explore')
+@bot.command(name='explore', help='Explore a location to find items\n$explore <location>')
 async def explore(ctx, location):
-    doc = bot_utils.get_userdata_doc(ctx.guild)
-    currentUserEnergy = doc['members'][str(ctx.author.id)]['energy']
-    beachEnergyCost = 5
-    pondEnergyCost = 1
-    # location2EnergyCost = .15
-    # location3EnergyCost = .25
-    # location4EnergyCost = .50
-    if location.lower() == 'beach':
-        if currentUserEnergy >= beachEnergyCost:
-            # consume energy
-            doc['members'][str(ctx.author.id)]['energy'] -= beachEnergyCost
-
-            embed = discord.Embed(
-                title="Exploring", description='You have now entered the beach... It will take some time to find some items. Patience is key.', color=ACCENT_COLOR)
-            await ctx.send(embed=embed)
-            await ctx.send(file=discord.File('images/entering_beach.gif'))
+    data = bot_utils.game_data  # stays the same even if the items get reloaded meanwhile
+    place = data.locations.get(location.lower())
 
-            item_ids = ["1", "2", "3", "4", "5", "6",
-                        "7", "8", "9", "10", "11", "12", "13", ]
-            item_found = None
+    if place is None:
+        embed = discord.Embed(title="Error",
+                              description=f"You can explore: {', '.join(data.locations)}", color=ERROR_COLOR)
+        return await ctx.send(embed=embed)
 
-            for _ in range(7):
-                item_to_check = random.randint(0, 12)
-                success_condition = random.randint(0, 100)
-                item_found = bot_utils.item_lookup(item_ids[item_to_check])
+    currentUserEnergy = await async_bot_utils.get_user_energy(ctx.guild, ctx.author)
 
-                if 1 <= success_condition < (item_found['probability'] * 100):
-                    await add_to_inventory(ctx, item_ids[item_to_check], 1, output=False)
-                    break
-                else:
-                    item_found = None
+    if currentUserEnergy >= place.energy_cost:
+        # consume energy
+        await async_bot_utils.update_energy(ctx.guild, ctx.author, -place.energy_cost)
 
-            description = ""
+        embed = discord.Embed(
+            title="Exploring", description=f'You have now entered the {place.name}... It will take some time to find some items. Patience is key.', color=ACCENT_COLOR)
+        await ctx.send(embed=embed)
 
-            if item_found is not None:
-                description += f'You found a(n) {item_found["name"].title()}\n'
-            else:
-                description += 'You found nothing.\n'
+        if place.enter_image is not None:
+            await media.send(ctx, place.enter_image, ACCENT_COLOR)
 
-            description += 'You have now exited the beach'
+        item_id = place.loot.draw(bot_utils.get_rng())
+        description = ""
 
-            # await asyncio.sleep(5)
-            embed = discord.Embed(title="Returning to town",
-                                  description=description, color=ACCENT_COLOR)
-            await ctx.send(embed=embed)
-            await ctx.send(file=discord.File('images/returning_to_town.gif'))
-
-            user_data_collection.update_one(
-                {'guild_id': doc['guild_id']},
-                {"$set":
-                 {
-                     'members': doc['members']
-                 }})
+        if item_id is not None:
+            await add_to_inventory(ctx, item_id, 1, output=False)
+            description += f'You found a(n) {data.catalog.get(item_id).name.title()}\n'
         else:
-            embed = discord.Embed(title="Low on energy",
-                                  description=f"You don't have enough energy to explore right now. Go eat something.\nCurrent energy: {currentUserEnergy}", color=ERROR_COLOR)
-            await ctx.send(embed=embed)
-
-    elif location.lower() == 'pond':
-        if currentUserEnergy >= pondEnergyCost:
-            # consume energy
-            doc['members'][str(ctx.author.id)]['energy'] -= pondEnergyCost
-
-            embed = discord.Embed(
-                title="Exploring", description='You have now entered the pond... It will take some time to find some items. Patience is key.', color=ACCENT_COLOR)
-            await ctx.send(embed=embed)
-            await ctx.send(file=discord.File('images/entering_pond.gif'))
-
-            item_ids = ["13", "14", "15", "16", "17", "18", "19", "20", "21", "22", "23", "24"]  # Edit Item Numbers
-            item_found = None
+            description += 'You found nothing.\n'
 
-            for _ in range(7):
-                item_to_check = random.randint(0, 11)  # Edit Range
-                success_condition = random.randint(0, 100)
-                item_found = bot_utils.item_lookup(item_ids[item_to_check])
+        description += f'You have now exited the {place.name}'
 
-                if 1 <= success_condition < (item_found['probability'] * 100):
-                    await add_to_inventory(ctx, item_ids[item_to_check], 1, output=False)
-                    break
-                else:
-                    item_found = None
-
-            description = ""
-
-            if item_found is not None:
-                description += f'You found a(n) {item_found["name"].title()}\n'
-            else:
-                description += 'You found nothing.\n'
+        embed = discord.Embed(title="Returning to town",
+                              description=description, color=ACCENT_COLOR)
+        await ctx.send(embed=embed)
 
-            description += 'You have now exited the pond'
+        if place.exit_image is not None:
+            await media.send(ctx, place.exit_image, ACCENT_COLOR)
+    else:
+        embed = discord.Embed(title="Low on energy",
+                              description=f"You don't have enough energy to explore right now. Go eat something.\nCurrent energy: {currentUserEnergy}", color=ERROR_COLOR)
+        await ctx.send(embed=embed)
 
-            # await asyncio.sleep(5)
-            embed = discord.Embed(title="Returning to town",
-                                  description=description, color=ACCENT_COLOR)
-            await ctx.send(embed=embed)
-            await ctx.send(file=discord.File('images/returning_to_town.gif'))
-
-            user_data_collection.update_one(
-                {'guild_id': doc['guild_id']},
-                {"$set":
-                    {
-                        'members': doc['members']
-                    }})
-        else:
-            embed = discord.Embed(title="Low on energy",
-                                  description=f"You don't have enough energy to explore right now. Go eat something.\nCurrent energy: {currentUserEnergy}", color=ERROR_COLOR)
-            await ctx.send(embed=embed)
 
 @bot.command(name='consume', help='Consumes a food item to restore energy')
 async def consume(ctx, item_name):  # ex: $consume "coconut"
     # checking to see if the item exists in general
     item_name = item_name.lower()
-    item = bot_utils.check_item_exists(item_name)
+    catalog = bot_utils.game_data.catalog
+    item = catalog.find(item_name)
 
     if item is None:
         embed = discord.Embed(title="Error",
@@ -535,7 +700,7 @@ async def consume(ctx, item_name):  # ex: $consume "coconut"
         return await ctx.send(embed=embed)
 
     # check to see if item exists in inventory
-    item_id = bot_utils.check_item_exists_inventory(
+    item_id = await async_bot_utils.check_item_exists_inventory(
         ctx.guild, ctx.author, item_name)
 
     if item_id == -1:
@@ -544,16 +709,15 @@ async def consume(ctx, item_name):  # ex: $consume "coconut"
         return await ctx.send(embed=embed)
 
     # access to item name and id as well as the object
-    if item['type'] != "FoodItem" and item['type'] != "DrinkItem":
+    if item.id not in catalog.edible:
         embed = discord.Embed(title="Error",
                               description=f"You can't eat {item_name.title()}, {ctx.author.name}", color=ERROR_COLOR)
         return await ctx.send(embed=embed)
 
-    item_energy = item['energy']
+    item_energy = item.energy
 
     # add energy to user
-    doc = bot_utils.get_userdata_doc(ctx.guild)
-    current_energy = doc['members'][str(ctx.author.id)]['energy']
+    current_energy = await async_bot_utils.get_user_energy(ctx.guild, ctx.author)
 
     if current_energy < 100:
         if current_energy + item_energy > 100:
@@ -561,34 +725,27 @@ async def consume(ctx, item_name):  # ex: $consume "coconut"
                                   description=f"You gained {100 - current_energy} energy", color=ACCENT_COLOR)
             await ctx.send(embed=embed)
 
-            doc['members'][str(ctx.author.id)]['energy'] = 100
+            await async_bot_utils.update_energy(ctx.guild, ctx.author, 100 - current_energy)
         else:
             embed = discord.Embed(title="Delicious!",
                                   description=f"You gained {item_energy} energy", color=ACCENT_COLOR)
             await ctx.send(embed=embed)
 
-            doc['members'][str(ctx.author.id)]['energy'] += item_energy
+            await async_bot_utils.update_energy(ctx.guild, ctx.author, item_energy)
 
         # remove item from inventory
-        remove_from_inventory(ctx.guild, ctx.author, item_id)
+        await remove_from_inventory(ctx.guild, ctx.author, item_id)
     else:
         embed = discord.Embed(title="Error",
                               description="You're already have max energy", color=ERROR_COLOR)
         return await ctx.send(embed=embed)
 
-    # update db
-    user_data_collection.update_one(
-        {'guild_id': doc['guild_id']},
-        {"$set":
-         {
-             'members': doc['members']
-         }})
-
 
 @bot.command(name='energy', help='Shows your current energy level')
 async def display_energy(ctx):
+    energy = await async_bot_utils.get_user_energy(ctx.guild, ctx.author)
     embed = discord.Embed(title="Energy",
-                          description=f"You have {bot_utils.get_user_energy(ctx.guild, ctx.author)} energy remaining", color=ACCENT_COLOR)
+                          description=f"You have {energy} energy remaining", color=ACCENT_COLOR)
     await ctx.send(embed=embed)
 
 
@@ -605,7 +762,7 @@ async def remove_inventory(ctx, item_name):  # ex: $remove "coconut"
         return await ctx.send(embed=embed)
 
     # check to see if exists in the inventory
-    item_id = bot_utils.check_item_exists_inventory(
+    item_id = await async_bot_utils.check_item_exists_inventory(
         ctx.guild, ctx.author, item_name)
 
     if item_id == -1:
@@ -614,21 +771,21 @@ async def remove_inventory(ctx, item_name):  # ex: $remove "coconut"
         return await ctx.send(embed=embed)
 
     # remove item and decrease size
-    remove_from_inventory(ctx.guild, ctx.author, item_id)
+    await remove_from_inventory(ctx.guild, ctx.author, item_id)
     await display_inventory(ctx)
 
 
 @bot.command(name='cheers', help='Gives someone an alcoholic beverage if you one if your inventory')
 async def cheers(ctx, person):
     recipient_id = ctx.message.mentions[0].id
-    alcohol_id = check_alcohol(ctx.guild, ctx.author)
+    alcohol_id = await check_alcohol(ctx.guild, ctx.author)
 
     if alcohol_id:
-        remove_from_inventory(ctx.guild, ctx.author, alcohol_id, 1)
+        await remove_from_inventory(ctx.guild, ctx.author, alcohol_id, 1)
         recipient_id = f'<@{recipient_id}>'
 
         await ctx.send(f'Cheers {recipient_id}! {ctx.author.name} sent you some booze.')
-        await ctx.send(file=discord.File('images/cheers.gif'))
+        await media.send(ctx, CHEERS_IMAGE, ACCENT_COLOR)
     else:
         embed = discord.Embed(title="Low on booze",
                               description="You don't have any alcohol to use to cheers someone", color=ERROR_COLOR)
@@ -647,7 +804,7 @@ async def read_item(ctx, item_name):
         return await ctx.send(embed=embed)
 
     # check to see if item exists in inventory
-    item_id = bot_utils.check_item_exists_inventory(
+    item_id = await async_bot_utils.check_item_exists_inventory(
         ctx.guild, ctx.author, item_name)
 
     if item_id == -1:
@@ -655,112 +812,231 @@ async def read_item(ctx, item_name):
                               description="Item not in your inventory", color=ERROR_COLOR)
         return await ctx.send(embed=embed)
 
-    if item['type'] != 'BottleItem':
+    if not isinstance(item, BottleItem):
         # error: item is not something that can be read
         embed = discord.Embed(title="Error",
                               description="That's not something that you can read", color=ERROR_COLOR)
         return await ctx.send(embed=embed)
 
-    embed = discord.Embed(title=f"Message in a Bottle: {item['name'].title()}",
-                          description=item['message'], color=ACCENT_COLOR)
-    await ctx.send(file=discord.File('images/opening_message.gif'))
+    embed = discord.Embed(title=f"Message in a Bottle: {item.name.title()}",
+                          description=item.message, color=ACCENT_COLOR)
+    await media.send(ctx, OPENING_MESSAGE_IMAGE, ACCENT_COLOR)
     await ctx.send(embed=embed)
 
 
-@bot.command(name='leaderboard', help='Displays the top ten users with the most xp')
-async def leaderboard(ctx):
-    # get all user data
-    doc = bot_utils.get_userdata_doc(ctx.guild)
-    members = doc['members']
+@bot.command(name='leaderboard', help='Displays the users with the most xp, ten per page\n$leaderboard <page: defaults to 1>')
+async def leaderboard(ctx, page=1):
+    try:
+        page = int(page)
+    except ValueError:
+        page = 0
 
-    # get xp for all users
-    xp = [members[key] for key in members.keys()]
+    entries, page_count = await async_bot_utils.get_leaderboard_page(ctx.guild, page)
 
-    # Sort the XP from greatest to least
-    xp.sort(key=itemgetter('xp'), reverse=True)
+    if not 1 <= page <= page_count:
+        embed = discord.Embed(title="Error",
+                              description=f'Pick a page between 1 and {page_count}', color=ERROR_COLOR)
+        return await ctx.send(embed=embed)
 
-    # display top 10
     leaderboard_string = ""
-    counter = 1
+    names = await user_resolver.resolve_many(ctx.guild, [entry[1] for entry in entries])
 
-    for user_data in xp:
-        username = await bot.fetch_user(user_data['user_id'])
+    for position, user_id, xp, level in entries:
+        # mentions render as the user's name if they could not be resolved
+        name = names[user_id][0] if user_id in names else f'<@{user_id}>'
+        rank = bot_utils.get_rank(level)
 
-        if not username.bot:
-            name = username.name
-            rank = bot_utils.get_rank(user_data['level'])
-
-            leaderboard_string += f"{counter}. {name} --- {rank} --- {user_data['xp']}\n"
-            counter += 1
-
-            if counter == 11:
-                break
+        leaderboard_string += f"{position}. {name} --- {rank} --- {xp}\n"
 
     embed = discord.Embed(title='XP Leaderboard',
                           description=leaderboard_string, color=ACCENT_COLOR)
+    embed.set_footer(text=f'Page {page}/{page_count}')
     await ctx.send(embed=embed)
 
 
-def add_call_points():
-    for user_id in ongoing_calls.keys():
-        ongoing_calls[user_id].add_points()
+async def reload_game_data():
+    """Rebuilds the items and loot tables off the event loop and swaps them in
 
-    start_points_timer()
+    Raises:
+        ValueError: If the new data is invalid or misses a shop item, nothing changes in that case
 
+    Returns:
+        GameData: The new game data
+    """
+    data = await async_bot_utils.run_in_executor(bot_utils.reload_game_data, SHOP_ITEMS)
+    await async_bot_utils.run_in_executor(media.preload, media_files())
+    populate_shop()
+    print(f"Loaded game data version {data.version}")
 
-def start_points_timer():
-    x = datetime.now()
-    y = x + timedelta(minutes=15)
-    delta = y - x
-    secs = delta.total_seconds()
-    t = Timer(secs, add_call_points)
-    t.start()
+    return data
 
 
-def start_gift_reset_timer():
-    current_time = datetime.now()
-    tomorrow = current_time + timedelta(days=1)
-    reset_time = tomorrow.replace(hour=0, minute=0, second=0)
-    delta = reset_time - current_time
-    secs = delta.total_seconds()
-    t = Timer(secs, reset_total_gift)
-    t.start()
+async def watch_game_data(interval=30):
+    """Reloads the game data whenever items.json or locations.json change
 
+    Args:
+        interval (int, optional): Seconds between checks. Defaults to 30.
+    """
+    failed_sources = None  # files that failed to load, not retried until they change again
 
-def reset_total_gift():
-    docs = user_data_collection.find({})
+    while True:
+        await asyncio.sleep(interval)
+        data = bot_utils.game_data
+        sources = data.current_sources()
 
-    for doc in docs:
-        members = doc['members']
+        if sources is None or sources == data.sources or sources == failed_sources:
+            continue
 
-        for user_id in members.keys():
-            members[user_id]['total_gift'] = 0
+        try:
+            await reload_game_data()
+        except (ValueError, OSError) as error:
+            failed_sources = sources
+            print(f"Keeping game data version {data.version}: {error}")
 
-        user_data_collection.update_one(
-            {'guild_id': doc['guild_id']},
-            {"$set":
-                {
-                    'members': members
-                }})
 
-    start_gift_reset_timer()
+@bot.command(name='reload', help='Reloads items and locations without restarting (admins only)')
+@commands.has_permissions(administrator=True)
+async def reload_items(ctx):
+    try:
+        data = await reload_game_data()
+    except (ValueError, OSError) as error:
+        embed = discord.Embed(title="Error",
+                              description=f"Kept version {bot_utils.game_data.version}: {error}", color=ERROR_COLOR)
+        return await ctx.send(embed=embed)
+
+    embed = discord.Embed(title="Items Reloaded",
+                          description=f"Now using version {data.version} with {len(data.catalog.by_id)} items and {len(data.locations)} locations", color=ACCENT_COLOR)
+    await ctx.send(embed=embed)
+
+
+@bot.command(name='stats', help='Shows handler and database timings. $stats [command|event|db|dump|reset|welcome|ready] (admins only)')
+@commands.has_permissions(administrator=True)
+async def show_stats(ctx, option=None):
+    metrics = bot_utils.metrics
+
+    if option == 'dump':
+        lines = await async_bot_utils.run_in_executor(metrics.dump, METRICS_FILE)
+        embed = discord.Embed(title="Stats",
+                              description=f"Wrote {lines} histograms to {METRICS_FILE}", color=ACCENT_COLOR)
+        return await ctx.send(embed=embed)
+
+    if option == 'reset':
+        metrics.reset()
+        embed = discord.Embed(title="Stats", description="Cleared all histograms", color=ACCENT_COLOR)
+        return await ctx.send(embed=embed)
+
+    if option == 'ready':
+        embed = discord.Embed(title="Stats", description=f"Warm-up: {readiness['state']}", color=ACCENT_COLOR)
+
+        if 'guilds' in readiness:
+            embed.add_field(name="Warmed up",
+                            value=f"{readiness['warmed']} of {readiness['guilds']} guilds, {readiness['failed']} failed\n"
+                                  f"{readiness['members']} members, {readiness['inventories']} inventories in {readiness['seconds']:.1f} s",
+                            inline=False)
+
+        for cache in (bot_utils.member_cache, bot_utils.inventory_cache):
+            stats = cache.stats()
+            embed.add_field(name=f"Cached {stats['name']}",
+                            value=f"{stats['size']} entries, {stats['hit_rate']:.0%} hits", inline=True)
+
+        return await ctx.send(embed=embed)
+
+    if option == 'welcome':
+        jobs = dm_dispatcher.progress(ctx.guild.id)
+        added = onboarding.get(ctx.guild.id)
+        embed = discord.Embed(title="Stats",
+                              description="Welcome messages of this server" if jobs or added else "No welcome messages sent since the bot started",
+                              color=ACCENT_COLOR)
+
+        if added is not None:
+            embed.add_field(name="Members added" if added['finished'] else "Adding members",
+                            value=f"{added['added']} of {added['total']}", inline=False)
+
+        for job in jobs:
+            embed.add_field(name="Finished" if job['finished'] else "Sending",
+                            value=f"{job['sent']} sent, {job['skipped']} not accepting DMs, {job['failed']} failed of {job['total']}\n"
+                                  f"{job['per_second']} per second over {job['seconds']} s",
+                            inline=False)
+
+        return await ctx.send(embed=embed)
+
+    rows = metrics.summary(option or '')[:15]
+    embed = discord.Embed(title="Stats",
+                          description="Slowest handlers by total time (p50/p99 in ms, per call averages)" if rows else "Nothing recorded yet",
+                          color=ACCENT_COLOR)
+
+    for row in rows:
+        embed.add_field(name=row['name'],
+                        value=f"{row['count']} calls, {row['p50_seconds'] * 1000:.0f}/{row['p99_seconds'] * 1000:.0f} ms\n"
+                              f"{row['round_trips']:.1f} trips, {row['bytes_read'] / 1024:.1f}/{row['bytes_written'] / 1024:.1f} KiB in/out",
+                        inline=True)
+
+    await ctx.send(embed=embed)
+
+
+def media_files():
+    """Gets every image the commands send"""
+    images = [CHEERS_IMAGE, OPENING_MESSAGE_IMAGE]
+
+    for place in bot_utils.game_data.locations.values():
+        images += [place.enter_image, place.exit_image]
+
+    return [image for image in images if image is not None]
 
 
 def populate_shop():
-    main_shop.items.append(ALE)
-    main_shop.items.append(COCONUT)
-    main_shop.items.append(FISH)
+    catalog = bot_utils.game_data.catalog
+    main_shop.items = [catalog.find(name) for name in SHOP_ITEMS]
+
+
+def prepare_database():
+    """Connects to the database, creates the indexes and migrates old documents. Runs
+       while the bot logs in to Discord. Database calls made through async_bot_utils wait
+       until the indexes exist. If they can not be created the bot shuts down"""
+    try:
+        seconds = bot_utils.database.warm_up()
+        print(f"Connected to the database in {seconds:.2f} s")
+        bot_utils.ensure_indexes()
+    except Exception as error:
+        # without the unique indexes members could get duplicate documents, stop instead
+        print(f"Failed to prepare the database, shutting down: {error!r}")
+        asyncio.run_coroutine_threadsafe(bot.close(), bot.loop)
+        raise
+
+    async_bot_utils.database_ready.set()
+
+    if MIGRATE_MEMBER_DOCS:
+        # members that are needed before the migration reaches them get migrated on the fly
+        try:
+            migrate_member_documents()
+        except Exception as error:  # continues where it stopped on the next start
+            print(f"Failed to migrate member documents: {error!r}")
 
 
 def run():
     if UPDATE_DOCS:
         upgrade_database()
 
-    start_points_timer()
-    start_gift_reset_timer()
+    # connecting to Atlas takes about as long as logging in to Discord, do both at once
+    async_bot_utils.database_ready.clear()
+    Thread(target=prepare_database, daemon=True).start()
     populate_shop()
+    media.preload(media_files())
+    bot_utils.metrics.instrument(bot)
+    recorder = EventRecorder(RECORD_EVENTS) if RECORD_EVENTS else None
+
+    if recorder is not None:
+        recorder.install(bot)
+
     bot.run(TOKEN)
 
+    # write whatever xp is still buffered before the process exits, after the writes that were in flight
+    if async_bot_utils.database_ready.is_set():
+        xp_buffer.flush()
+
+    if recorder is not None:
+        recorder.close()
+
 
 def upgrade_database():
     docs = user_data_collection.find({})
@@ -804,6 +1080,19 @@ def upgrade_database():
         #         }})
 
 
+def migrate_member_documents(batch_size=500):
+    """Moves every guild still using the embedded members/inventories maps to one
+       document per member and per inventory. Runs while the bot is online and can be
+       stopped and restarted at any point
+
+    Args:
+        batch_size (int, optional): Members migrated per round trip. Defaults to 500.
+    """
+    for doc in user_data_collection.find({'members_migrated': {'$ne': True}}):
+        migrated = bot_utils.migrate_guild_members(doc, batch_size)
+        print(f"Migrated {migrated} members of {doc.get('guild_name', doc['guild_id'])}")
+
+
 def upgrade_inventory_database():
     docs = inventory_collection.find({})
 
@@ -827,123 +1116,72 @@ def upgrade_inventory_database():
 
 
 async def add_to_inventory(ctx, item_id, quantity, output=True):
-    if type(item_id) == int:
-        item_id = str(item_id)
+    return await add_to_section(ctx, item_id, quantity, 'inventory', output)
 
+
+async def add_to_section(ctx, item_id, quantity, section, output=True):
     item = bot_utils.item_lookup(item_id)
+    title = 'Inventory Update Error' if section == 'inventory' else 'Stash Update Error'
 
-    if quantity <= item['max_quantity']:
-        inventory_id = bot_utils.get_user_inventory_id(ctx.guild, ctx.author)
-        inventory_doc = bot_utils.get_inventory_doc(ctx.guild)
-        inventory_data = inventory_doc['inventories'][inventory_id]
+    if quantity <= item.max_quantity:
+        success, inventory_data = await async_bot_utils.add_items(
+            ctx.guild, ctx.author, item.id, quantity, section)
+        size, capacity = bot_utils.INVENTORY_SECTIONS[section]
 
-        if inventory_data['size'] + quantity <= inventory_data['capacity']:
-            try:
-                current_quantity = inventory_data['inventory'][item_id]
-            except KeyError:
-                current_quantity = 0
-
-            if current_quantity + quantity <= item['max_quantity']:
-                try:
-                    inventory_data['inventory'][item_id] += quantity
-                except KeyError:
-                    inventory_data['inventory'][item_id] = quantity
-
-                inventory_data['size'] += quantity
-
-                inventory_collection.update_one(
-                    {'guild_id': ctx.guild.id},
-                    {"$set":
-                     {
-                         'inventories': inventory_doc['inventories']
-                     }})
-
-                if output:
-                    embed = discord.Embed(title='Inventory Update',
-                                          description=f"Added {quantity} of {item['name'].title()} to your inventory", color=ACCENT_COLOR)
-                    await ctx.send(embed=embed)
-
-                return True
-            else:
-                # you can only have max in your inventory. you currently have x
-                if output:
-                    embed = discord.Embed(title='Inventory Update Error',
-                                          description=f"The most amount of {item['name'].title()} you can hold is {item['max_quantity']}. You currently have {inventory_data['inventory'][item_id]}", color=ERROR_COLOR)
-                    await ctx.send(embed=embed)
-
-                return False
-        else:
+        if success:
+            if output:
+                embed = discord.Embed(title='Inventory Update',
+                                      description=f"Added {quantity} of {item.name.title()} to your {section}", color=ACCENT_COLOR)
+                await ctx.send(embed=embed)
+
+            return True
+        elif inventory_data[size] + quantity > inventory_data[capacity]:
             # not enough space in inventory
             if output:
-                embed = discord.Embed(title='Inventory Update Error',
-                                      description="You don't have enough space in your inventory", color=ERROR_COLOR)
+                embed = discord.Embed(title=title,
+                                      description=f"You don't have enough space in your {section}", color=ERROR_COLOR)
+                await ctx.send(embed=embed)
+
+            return False
+        else:
+            # you can only have max in your inventory. you currently have x
+            if output:
+                embed = discord.Embed(title=title,
+                                      description=f"The most amount of {item.name.title()} you can hold is {item.max_quantity}. You currently have {inventory_data[section].get(item.id, 0)}", color=ERROR_COLOR)
                 await ctx.send(embed=embed)
 
             return False
     else:
         # you cant buy that many of this item
         if output:
-            embed = discord.Embed(title='Inventory Update Error',
-                                  description=f"The most amount of {item['name'].title()} you can buy is {item['max_quantity']}", color=ERROR_COLOR)
+            embed = discord.Embed(title=title,
+                                  description=f"The most amount of {item.name.title()} you can buy is {item.max_quantity}", color=ERROR_COLOR)
             await ctx.send(embed=embed)
 
         return False
 
 
-def remove_from_inventory(guild, user, item_id, quantity=1):
-    inventory_id = bot_utils.get_user_inventory_id(guild, user)
-    inventory_doc = bot_utils.get_inventory_doc(guild)
-    inventory_info = inventory_doc['inventories'][inventory_id]
+async def remove_from_inventory(guild, user, item_id, quantity=1):
+    success, _ = await async_bot_utils.remove_items(guild, user, item_id, quantity)
+    return success
 
-    if inventory_info['size'] == 0:
-        return False
-    else:
-        try:
-            if inventory_info['inventory'][item_id] - quantity >= 0:
-                inventory_info['size'] -= quantity
-                inventory_info['inventory'][item_id] -= quantity
-            else:
-                inventory_info['size'] -= inventory_info['inventory'][item_id]
-                inventory_info['inventory'][item_id] = 0
 
-            if inventory_info['inventory'][item_id] == 0:
-                del inventory_info['inventory'][item_id]
-
-        except KeyError:
-            return False
-
-        inventory_collection.update_one(
-            {'guild_id': guild.id},
-            {"$set":
-                {
-                    'inventories': inventory_doc['inventories']
-                }})
-
-        return True
-
-
-def check_alcohol(guild, user):
-    inventory_id = bot_utils.get_user_inventory_id(guild, user)
-    inventory_doc = bot_utils.get_inventory_doc(guild)
-    inventory_info = inventory_doc['inventories'][inventory_id]
+async def check_alcohol(guild, user):
+    inventory_info = await async_bot_utils.get_member_inventory(guild, user)
 
     if inventory_info['size'] == 0:
         # nothing in inventory to give
         return None
 
     for item_id in inventory_info['inventory'].keys():
-        item = bot_utils.item_lookup(item_id)
-
-        if item['type'] == 'DrinkItem' and item['is_alcohol']:
+        if item_id in bot_utils.game_data.catalog.alcohol:
             return item_id
 
     return None
 
 
-def check_inventory(ctx, item_type=None, item_id=None):
-    inventory_id = bot_utils.get_user_inventory_id(ctx.guild, ctx.author)
-    inventory_doc = bot_utils.get_inventory_doc(ctx.guild)
-    inventory_info = inventory_doc['inventories'][inventory_id]
+async def check_inventory(ctx, item_type=None, item_id=None):
+    inventory_info = await async_bot_utils.get_member_inventory(ctx.guild, ctx.author)
 
     if inventory_info['size'] == 0:
         # nothing in inventory to give
@@ -958,158 +1196,120 @@ def check_inventory(ctx, item_type=None, item_id=None):
 
             return count
         else:
-            for item_id, quantity in inventory_info['inventory'].items():
-                if bot_utils.item_lookup(item_id).id == int(item_id):
-                    return quantity
+            return inventory_info['inventory'].get(str(item_id), 0)
 
 
-def remove_from_stash(guild, user, item_id, quantity=1):
-    inventory_id = bot_utils.get_user_inventory_id(guild, user)
-    inventory_doc = bot_utils.get_inventory_doc(guild)
-    inventory_info = inventory_doc['inventories'][inventory_id]
+async def remove_from_stash(guild, user, item_id, quantity=1):
+    success, _ = await async_bot_utils.remove_items(guild, user, item_id, quantity, 'stash')
+    return success
 
-    if inventory_info['stash_size'] == 0:
-        return False
-    else:
-        try:
-            if inventory_info['stash'][item_id] - quantity >= 0:
-                inventory_info['stash_size'] -= quantity
-                inventory_info['stash'][item_id] -= quantity
-            else:
-                inventory_info['stash_size'] -= inventory_info['stash'][item_id]
-                inventory_info['stash'][item_id] = 0
 
-            if inventory_info['stash'][item_id] == 0:
-                del inventory_info['stash'][item_id]
+async def add_to_stash(ctx, item_id, quantity=1, output=True):
+    return await add_to_section(ctx, item_id, quantity, 'stash', output)
 
-        except KeyError:
-            return False
 
-        inventory_collection.update_one(
-            {'guild_id': guild.id},
-            {"$set":
-                {
-                    'inventories': inventory_doc['inventories']
-                }})
+@bot.command(name='stash', help='opens up the user stash. $stash <item> or $stash all [kind] moves items into it')
+async def display_stash(ctx, *args):
+    if args:
+        await stash_item(ctx, *args)
+
+    inventory_info = await async_bot_utils.get_member_inventory(ctx.guild, ctx.author)
+    inventory = inventory_info['stash']
+    catalog = bot_utils.game_data.catalog
+
+    embed = discord.Embed(title=f"{ctx.author.name}'s Stash",
+                          description=f"Capacity: {inventory_info['stash_size']}/{inventory_info['stash_capacity']}\nYou have the following items:",
+                          color=ACCENT_COLOR)
 
-        return True
+    for item_id, item_quantity in inventory.items():
+        item_name = catalog.get(item_id).name
+        embed.add_field(name=item_name.title(),
+                        value=item_quantity, inline=True)
 
+    await ctx.send(embed=embed)
 
-async def add_to_stash(guild, user, item_id, quantity=1):
-    if type(item_id) == int:
-        item_id = str(item_id)
 
-    item = bot_utils.item_lookup(item_id)
+async def stash_item(ctx, *args):  # ex: $stash coconut, $stash all food
+    return await move_items(ctx, args, 'inventory', 'stash')
 
-    if quantity <= item['max_quantity']:
-        inventory_id = bot_utils.get_user_inventory_id(guild, user)
-        inventory_doc = bot_utils.get_inventory_doc(guild)
-        inventory_data = inventory_doc['inventories'][inventory_id]
 
-        if inventory_data['stash_size'] + quantity <= inventory_data['stash_capacity']:
-            try:
-                current_quantity = inventory_data['stash'][item_id]
-            except KeyError:
-                current_quantity = 0
-
-            if current_quantity + quantity <= item['max_quantity']:
-                try:
-                    inventory_data['stash'][item_id] += quantity
-                except KeyError:
-                    inventory_data['stash'][item_id] = quantity
-
-                inventory_data['stash_size'] += quantity
-
-                inventory_collection.update_one(
-                    {'guild_id': guild.id},
-                    {"$set":
-                     {
-                         'inventories': inventory_doc['inventories']
-                     }})
-
-                return True
-            else:
-                # you can only have max in your inventory. you currently have x
-                if output:
-                    embed = discord.Embed(title='Stash Update Error',
-                                          description=f"The most amount of {item['name'].title()} you can hold is {item['max_quantity']}. You currently have {inventory_data['inventory'][item_id]}", color=ERROR_COLOR)
-                    await ctx.send(embed=embed)
-
-                return False
-        else:
-            # not enough space in inventory
-            if output:
-                embed = discord.Embed(title='Stash Update Error',
-                                      description="You don't have enough space in your stash", color=ERROR_COLOR)
-                await ctx.send(embed=embed)
+@bot.command(name='unstash', help='takes items from the stash. $unstash <item> or $unstash all [kind]')
+async def unstash_item(ctx, *args):
+    return await move_items(ctx, args, 'stash', 'inventory')
+
+
+async def move_items(ctx, args, source, target):
+    """Moves one item, or every item of a kind with "all [kind]", from source to target
+       with a single update
+
+    Args:
+        ctx (discord.ext.commands.Context): Context of the command
+        args (Tuple[str]): Words after the command
+        source (string): Section the items leave, 'inventory' or 'stash'
+        target (string): Section the items go to
 
+    Returns:
+        bool: Whether the items were moved
+    """
+    words = [word.lower() for word in args]
+    catalog = bot_utils.game_data.catalog
+
+    if words and words[0] == 'all':
+        kind = catalog.kind(' '.join(words[1:])) if len(words) > 1 else None
+
+        if len(words) > 1 and kind is None:
+            embed = discord.Embed(title="Error",
+                                  description="Item type can't be found", color=ERROR_COLOR)
+            await ctx.send(embed=embed)
             return False
+
+        inventory_data = await async_bot_utils.get_member_inventory(ctx.guild, ctx.author)
+        quantities = {item_id: quantity for item_id, quantity in inventory_data[source].items()
+                      if quantity > 0 and (kind is None or item_id in kind)}
     else:
-        # you cant buy that many of this item
-        if output:
-            embed = discord.Embed(title='Inventory Update Error',
-                                  description=f"The most amount of {item['name'].title()} you can buy is {item['max_quantity']}", color=ERROR_COLOR)
+        item = bot_utils.check_item_exists(' '.join(words))
+
+        if item is None:
+            embed = discord.Embed(title="Error",
+                                  description="Item can't be found", color=ERROR_COLOR)
             await ctx.send(embed=embed)
+            return False
 
-        return False
+        quantities = {item.id: 1}
 
+    if quantities:
+        success, inventory_data = await async_bot_utils.transfer_items(
+            ctx.guild, ctx.author, quantities, source, target)
+    else:
+        success = False
 
-@bot.command(name='stash', help='opens up the user stash')
-async def display_stash(ctx, item_name =None):
-    if item_name is not None:
-        await stash_item(ctx, item_name)
+    if success:
+        embed = discord.Embed(title='Inventory Update',
+                              description=f"Moved {sum(quantities.values())} items to your {target}", color=ACCENT_COLOR)
+    else:
+        embed = discord.Embed(title='Inventory Update Error' if target == 'inventory' else 'Stash Update Error',
+                              description=transfer_error(catalog, inventory_data, quantities, source, target),
+                              color=ERROR_COLOR)
 
-    doc = bot_utils.get_userdata_doc(ctx.guild)
-    inventory_id = doc['members'][str(ctx.author.id)]['inventory_id']
-    inventory_doc = bot_utils.get_inventory_doc(ctx.guild)
-    inventories = inventory_doc['inventories']
-    inventory_info = inventories[str(inventory_id)]
-    inventory = inventory_info['stash']
+    await ctx.send(embed=embed)
 
-    embed = discord.Embed(title=f"{ctx.author.name}'s Stash",
-                          description=f"Capacity: {inventory_info['stash_size']}/{inventory_info['stash_capacity']}\nYou have the following items:",
-                          color=ACCENT_COLOR)
+    return success
 
-    for item_id, item_quantity in inventory.items():
-        item_name = bot_utils.item_lookup(item_id)['name']
-        embed.add_field(name=item_name.title(),
-                        value=item_quantity, inline=True)
 
-    await ctx.send(embed=embed)
+def transfer_error(catalog, inventory_data, quantities, source, target):
+    """Explains why a transfer was rejected, using the inventory it was checked against"""
+    size, capacity = bot_utils.INVENTORY_SECTIONS[target]
 
-async def stash_item(ctx, item_name):  # ex: $consume "coconut"
-     # checking to see if the item exists in general
-    item_name = item_name.lower()
-    item = bot_utils.check_item_exists(item_name)
-    if item is None:
-        embed = discord.Embed(title="Error",
-                             description="Item can't be found", color=ERROR_COLOR)
-        return await ctx.send(embed=embed)
-     # check to see if item exists in inventory
-    item_id = bot_utils.check_item_exists_inventory(ctx.guild, ctx.author, item_name)
+    if not quantities or any(inventory_data[source].get(item_id, 0) < quantity for item_id, quantity in quantities.items()):
+        return f"You don't have that in your {source}"
 
-    if item_id == -1:
-        embed = discord.Embed(title="Error",
-                            description="Item can't be found", color=ERROR_COLOR)
-        return await ctx.send(embed=embed)
-    remove_from_inventory(ctx.guild, ctx.author, item_id, quantity=1)
-    await add_to_stash(ctx.guild, ctx.author, item_id, quantity=1)
-    #need to be able to put items from the inventory into the stash
-    #display stash in an imbed
-@bot.command(name='unstash', help='takes an item from the stash')
-async def unstash_item(ctx, item_name):
-    item_name = item_name.lower()
-    item = bot_utils.check_item_exists(item_name)
-    if item is None:
-        embed = discord.Embed(title="Error",
-                             description="Item can't be found", color=ERROR_COLOR)
-        return await ctx.send(embed=embed)
-     # check to see if item exists in inventory
-    item_id = bot_utils.check_item_exists_stash(ctx.guild, ctx.author, item_name)
-    print(item, item_id)
-    if item_id == -1:
-        embed = discord.Embed(title="Error",
-                            description="Item can't be found", color=ERROR_COLOR)
-        return await ctx.send(embed=embed)
-    remove_from_stash(ctx.guild, ctx.author, item_id, quantity=1)
-    await add_to_inventory(ctx, item_id, quantity=1)
\ No newline at end of file
+    if inventory_data[size] + sum(quantities.values()) > inventory_data[capacity]:
+        return f"You don't have enough space in your {target}"
+
+    for item_id, quantity in quantities.items():
+        item = catalog.get(item_id)
+
+        if inventory_data[target].get(item_id, 0) + quantity > item.max_quantity:
+            return f"The most amount of {item.name.title()} you can hold is {item.max_quantity}. You currently have {inventory_data[target].get(item_id, 0)}"
+
+    return f"Your {source} changed, try again"
@@ -1,26 +1,44 @@
-import json
+import contextvars
 import math
-import os
 import random
+from datetime import date
 from uuid import uuid1
 
-from dotenv import load_dotenv
-from pymongo import MongoClient
-
-from BottleItem import BottleItem
-from CosmeticItem import CosmeticItem
-from DrinkItem import DrinkItem
-from FoodItem import FoodItem
-from Item import Item
-from ItemType import ItemType
-
-load_dotenv()
-CONNECTION_URL = os.getenv('MONGODB_CONNECTION_URL')
-
-cluster = MongoClient(CONNECTION_URL)
-db = cluster["UserData"]
-user_data_collection = db["UserData"]
-inventory_collection = db["Inventories"]
+from pymongo import ASCENDING, DeleteMany, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from Database import Database
+from GameData import GameData
+from Leaderboard import LeaderboardIndex
+from LevelCurve import LevelCurve, rank_for_level
+from Metrics import Metrics
+from StateCache import StateCache
+
+# every command sent to the database is recorded, per collection and per handler
+metrics = Metrics()
+
+# configured by main.main(), nothing connects until the first operation
+database = Database("UserData", event_listeners=[metrics.listener])
+user_data_collection = database.collection("UserData")
+inventory_collection = database.collection("Inventories")
+member_collection = database.collection("Members")  # one document per (guild_id, user_id)
+member_inventory_collection = database.collection("MemberInventories")  # one document per (guild_id, user_id)
+
+DUPLICATE_KEY_ERROR = 11000
+DEFAULT_ENERGY = 100
+MEMBER_DEFAULTS = {'level': 1, 'energy': DEFAULT_ENERGY}
+INVENTORY_SECTIONS = {'inventory': ('size', 'capacity'), 'stash': ('stash_size', 'stash_capacity')}
+GIFT_LIMIT = 1000  # maximum points allowed to be gifted per day
+
+# outcomes of send_points
+GIFT_SENT = 'sent'
+GIFT_INSUFFICIENT_POINTS = 'insufficient points'
+GIFT_LIMIT_REACHED = 'limit reached'
+GIFT_FAILED = 'failed'
+
+# documents keyed by (guild id, user id), every write below invalidates the entries it touches
+member_cache = StateCache('members')
+inventory_cache = StateCache('inventories')
 
 # items = {
 #     "0": DrinkItem(0, 'ale', 15, ItemType.ALCOHOL,
@@ -47,29 +65,68 @@ inventory_collection = db["Inventories"]
 #     "13": Item(13, 'plastic shovel', -1, ItemType.JUNK, "Tool to help you dig...barely", 1, .1)
 # }
 
-# get all items keyed by id
-with open('items.json') as items_file:
-    items = json.load(items_file)
+# points awarded on level up: (highest level of the rank, points)
+LEVELUP_POINTS = [
+    (5, 500),       # F
+    (10, 900),      # E
+    (15, 1500),     # D
+    (18, 3000),     # C
+    (21, 4800),     # B
+    (24, 10000),    # A
+    (26, 25000),    # S
+]
+LEVELUP_POINTS_MAX = 50000  # SS
+
+# leaving level L takes 40L^2 + 25L xp, run rebalance_levels.py after changing the curve
+level_curve = LevelCurve(40, 25, LEVELUP_POINTS, LEVELUP_POINTS_MAX)
+
+# item catalog and loot tables currently in use, replaced as a whole by reload_game_data
+game_data = GameData.load()
+
+# source of randomness for gambling and exploring, swap for a seeded random.Random to reproduce results
+rng = random.Random()
+# set per event by the event recorder and replayer, so the rolls of an event do not depend on
+# how it interleaved with other events
+event_rng = contextvars.ContextVar('event_rng', default=None)
+
+
+def get_rng():
+    """Gets the source of randomness for the current event"""
+    current = event_rng.get()
+    return rng if current is None else current
+
+
+def reload_game_data(required_items=()):
+    """Rebuilds the item catalog and loot tables from the json files and swaps them in.
+       Commands that already grabbed game_data finish with the version they started with
+
+    Args:
+        required_items (Iterable[string], optional): Names of items the new data has to have.
+            Defaults to ().
+
+    Raises:
+        ValueError: If the files are invalid, miss a required item or remove an item, the data
+            in use is kept
 
-# hash table to get id from name
-name_to_id = {}
+    Returns:
+        GameData: The new game data
+    """
+    global game_data
+    # players may hold any item of the data in use, none of them can go away
+    new_data = GameData.load(game_data.version + 1, required_items=required_items,
+                             required_ids=game_data.catalog.by_id.keys())
+    game_data = new_data
 
-for item_id in items.keys():
-        name_to_id[items[item_id]['name']] = str(item_id)
+    return new_data
 
 
 def item_lookup(item_id):
-    try:
-        return items[item_id]
-    except KeyError:
-        return None
+    return game_data.catalog.get(item_id)
 
 
 def item_id_lookup(item_name):
-    try:
-        return name_to_id[item_name]
-    except KeyError:
-        return None
+    item = game_data.catalog.find(item_name)
+    return None if item is None else item.id
 
 
 def encode_userdata(user_id, points, level, xp, total_gift, energy, inventory_id):
@@ -99,7 +156,7 @@ def gamble_points_basic(bet_amount):
     Returns:
         integer: The amount won (negative if lost)
     """
-    winning_val = random.randint(0, 2)
+    winning_val = get_rng().randint(0, 2)
     return (bet_amount) if (winning_val == 1) else (bet_amount * -1)
 
 
@@ -137,22 +194,7 @@ def calculate_levelup_points(level):
     Returns:
         integer: Amount of points awarded to the user based on level
     """
-    if 1 <= level <= 5:                 # F
-        return 500
-    elif 6 <= level <= 10:              # E
-        return 900
-    elif 11 <= level <= 15:             # D
-        return 1500
-    elif 16 <= level <= 18:             # C
-        return 3000
-    elif 19 <= level <= 21:             # B
-        return 4800
-    elif 22 <= level <= 24:             # A
-        return 10000
-    elif 25 <= level <= 26:             # S
-        return 25000
-    else:                               # SS
-        return 50000
+    return level_curve.payout(level)
 
 
 def get_user_ids(guild):
@@ -167,8 +209,18 @@ def get_user_ids(guild):
     return [user.id for user in guild.members]
 
 
+def ensure_indexes():
+    """Creates the indexes the per member collections rely on. Safe to call repeatedly"""
+    member_collection.create_index(
+        [('guild_id', ASCENDING), ('user_id', ASCENDING)], unique=True)
+    member_inventory_collection.create_index(
+        [('guild_id', ASCENDING), ('user_id', ASCENDING)], unique=True)
+    member_inventory_collection.create_index('id', unique=True)
+
+
 def get_userdata_doc(guild):
-    """Gets the document (entry) related to the given guild from the database
+    """Gets the guild level document (entry) related to the given guild from the database.
+       Member data lives in its own collection, see get_member_doc
 
     Args:
         guild (discord.Guild): Server to get document for
@@ -180,7 +232,7 @@ def get_userdata_doc(guild):
 
 
 def get_inventory_doc(guild):
-    """Gets the inventory document related to the given guild
+    """Gets the legacy inventory document related to the given guild
 
     Args:
         guild (discord.Guild): Server to get document for
@@ -191,83 +243,180 @@ def get_inventory_doc(guild):
     return inventory_collection.find_one({'guild_id': guild.id})
 
 
+def new_member_doc(guild_id, user_id, inventory_id, bot=False):
+    """Default member document for someone that just joined"""
+    doc = encode_userdata(user_id, 0, 1, 0, 0, DEFAULT_ENERGY, inventory_id)
+    doc['guild_id'] = guild_id
+    doc['bot'] = bot
+    doc['migrated'] = True
+
+    return doc
+
+
+def new_inventory_doc(guild_id, user_id, inventory_id):
+    """Default inventory document for someone that just joined"""
+    return {
+        'guild_id': guild_id,
+        'user_id': user_id,
+        'id': inventory_id,
+        'capacity': 20,
+        'size': 0,
+        'inventory': {},
+        'stash_capacity': 10,
+        'stash_size': 0,
+        'stash': {},
+        'migrated': True
+    }
+
+
 def create_guild_entry(guild):
-    """Creates entries in two collections: UserData and Inventories for the given guild
+    """Creates the guild entry and marks that its members still have to be added, which
+       onboard_members does in batches
 
     Args:
         guild (discord.Guild): Guild to create an entry for
+    """
+    user_data_collection.update_one(
+        {'guild_id': guild.id},
+        {"$set": {'guild_name': guild.name, 'onboarding_cursor': -1, 'onboarded': False},
+         "$setOnInsert": {'members_migrated': True}},
+        upsert=True)
+
+
+def get_onboarding_cursor(guild_id):
+    """Gets where adding the members of a guild stopped
+
+    Args:
+        guild_id (int): Id of the guild
 
     Returns:
-        dict:  Most up to date member information
+        int: Every member with an id up to this one was added, None if every member was added
     """
-    members = {}
-    inventories = {}
+    doc = user_data_collection.find_one(
+        {'guild_id': guild_id}, {'onboarding_cursor': 1, 'onboarded': 1})
+
+    # guilds created before onboarding was tracked got all their members at once
+    if doc is None or doc.get('onboarded', True):
+        return None
 
-    for user_id in get_user_ids(guild):
+    return doc.get('onboarding_cursor', -1)
+
+
+def onboard_members(guild_id, members):
+    """Creates the member and inventory documents of a batch of members and saves the
+       progress. Members that already have documents are left alone, so a batch that got
+       interrupted can simply be run again
+
+    Args:
+        guild_id (int): Id of the guild
+        members (List[Tuple[int, bool]]): User ids and whether they are bots, sorted by id
+    """
+    if not members:
+        return
+
+    member_docs = []
+    inventory_docs = []
+
+    for user_id, is_bot in members:
         inventory_id = str(uuid1())
-        members[str(user_id)] = encode_userdata(
-            user_id, 0, 1, 0, 0, 100, inventory_id)
-        inventories[inventory_id] = {
-            'id': inventory_id,
-            'capacity': 20,
-            'size': 0,
-            'inventory': {}
-        }
-
-    user_data_collection.insert_one({
-        'guild_id': guild.id,
-        'guild_name': guild.name,
-        'members': members
-    })
-
-    inventory_collection.insert_one({
-        'guild_id': guild.id,
-        'guild_name': guild.name,
-        'inventories': inventories
-    })
+        member_docs.append(new_member_doc(guild_id, user_id, inventory_id, is_bot))
+        inventory_docs.append(new_inventory_doc(guild_id, user_id, inventory_id))
 
-    return members
+    insert_ignoring_duplicates(member_collection, member_docs)
+    insert_ignoring_duplicates(member_inventory_collection, inventory_docs)
+    user_data_collection.update_one({'guild_id': guild_id},
+                                    {"$max": {'onboarding_cursor': members[-1][0]}})
+    leaderboards.invalidate(guild_id)
+
+
+def finish_onboarding(guild_id):
+    """Marks that every member of a guild was added
+
+    Args:
+        guild_id (int): Id of the guild
+    """
+    user_data_collection.update_one({'guild_id': guild_id},
+                                    {"$set": {'onboarded': True}})
+
+
+def update_guild_info(before, after):
+    """Updates the stored guild information after a server changed its name, id, etc...
+
+    Args:
+        before (discord.Guild): Server information before the update
+        after (discord.Guild): Server information after the update
+    """
+    user_data_collection.update_one({'guild_id': before.id},
+                                    {"$set":
+                                     {
+                                         'guild_id': after.id,
+                                         'guild_name': after.name
+                                     }})
+
+
+def start_welcome_messages(guild_id):
+    """Marks that every member of a guild still has to get the welcome message
+
+    Args:
+        guild_id (int): Id of the guild
+    """
+    user_data_collection.update_one(
+        {'guild_id': guild_id},
+        {"$set": {'welcome_cursor': -1, 'welcome_done': False}})
+
+
+def save_welcome_progress(guild_id, cursor, done):
+    """Saves how far the welcome messages of a guild got. The cursor only moves forward
+
+    Args:
+        guild_id (int): Id of the guild
+        cursor (int): Every member with an id up to this one was messaged
+        done (bool): Whether every member was messaged
+    """
+    user_data_collection.update_one(
+        {'guild_id': guild_id},
+        {"$max": {'welcome_cursor': cursor},
+         "$set": {'welcome_done': done}})
+
+
+def get_welcome_cursor(guild_id):
+    """Gets where the welcome messages of a guild stopped
+
+    Args:
+        guild_id (int): Id of the guild
+
+    Returns:
+        int: Every member with an id up to this one was messaged, None if there is nothing left to send
+    """
+    doc = user_data_collection.find_one(
+        {'guild_id': guild_id}, {'welcome_cursor': 1, 'welcome_done': 1})
+
+    # guilds that joined before welcome messages were tracked count as done
+    if doc is None or doc.get('welcome_done', True):
+        return None
+
+    return doc.get('welcome_cursor', -1)
 
 
 def create_user_entry(guild, user):
-    """Creates two entries in different collections for the user's data and their inventory
+    """Creates (or resets) the user's data and their inventory
 
     Args:
         guild (discord.Guild): Guild to add user data
         user (discord.User): User to create data for
     """
-    doc = get_userdata_doc(guild)
+    inventory_id = str(uuid1())
 
-    if doc is None:
-        create_guild_entry(guild)
-    else:
-        inventory_id = str(uuid1())
-        members = doc['members']
-        members[str(user.id)] = encode_userdata(
-            user.id, 0, 1, 0, 0, 100, inventory_id)
+    member_collection.replace_one(
+        {'guild_id': guild.id, 'user_id': user.id},
+        new_member_doc(guild.id, user.id, inventory_id, user.bot), upsert=True)
+    member_inventory_collection.replace_one(
+        {'guild_id': guild.id, 'user_id': user.id},
+        new_inventory_doc(guild.id, user.id, inventory_id), upsert=True)
 
-        user_data_collection.update_one(
-            {'guild_id': guild.id},
-            {"$set":
-                {
-                    'members': members
-                }})
-
-        inventory_doc = get_inventory_doc(guild)
-        inventories = inventory_doc['inventories']
-        inventories[inventory_id] = {
-            'id': inventory_id,
-            'capacity': 20,
-            'size': 0,
-            'inventory': {}
-        }
-
-        inventory_collection.update_one(
-            {'guild_id': guild.id},
-            {"$set":
-                {
-                    'inventories': inventories
-                }})
+    member_cache.invalidate((guild.id, user.id))
+    inventory_cache.invalidate((guild.id, user.id))
+    leaderboards.reset(guild.id, user.id, user.bot)
 
 
 def remove_user_entry(guild, user):
@@ -277,110 +426,286 @@ def remove_user_entry(guild, user):
         guild (discord.Guild): Guild to remove user data from
         user (discord.User): User to remove data for
     """
-    doc = get_userdata_doc(guild)
+    member_collection.delete_one({'guild_id': guild.id, 'user_id': user.id})
+    member_inventory_collection.delete_one({'guild_id': guild.id, 'user_id': user.id})
+    member_cache.invalidate((guild.id, user.id))
+    inventory_cache.invalidate((guild.id, user.id))
+    leaderboards.remove(guild.id, user.id)
 
-    if doc is not None:
-        members = doc['members']
-        del members[str(user.id)]
+    # drop the legacy entry as well so a pending migration does not bring them back
+    user_data_collection.update_one(
+        {'guild_id': guild.id},
+        {"$unset":
+            {
+                member_path(user.id): ""
+            }})
 
-        user_data_collection.update_one(
-            {'guild_id': guild.id},
-            {"$set":
-                {
-                    'members': members
-                }})
 
+def members_migrated(guild_id):
+    """Checks whether every member of a guild has their own documents. Until the migration
+       finishes, members can still exist only in the legacy guild documents
 
-def update_points(guild, user, points, reset=False):
-    """Updates point value for the given user in the given guild
+    Args:
+        guild_id (int): Id of the guild
+
+    Returns:
+        bool: Whether the guild was migrated
+    """
+    doc = user_data_collection.find_one({'guild_id': guild_id}, {'members_migrated': 1})
+
+    return doc is not None and doc.get('members_migrated') is True
+
+
+def get_stored_member_ids(guild_id):
+    """Gets the ids of every member with a document in the given guild
 
     Args:
-        guild (discord.Guild): Guild to update
-        user (discord.User): User to update
-        points (int): Amount of points to add to current value
-        reset (bool, optional): Flag to determine if user data should be reset. Defaults to False.
+        guild_id (int): Id of the guild
 
     Returns:
-        dict: Most up to date member information
+        Set[int]: User ids
+    """
+    return {doc['user_id'] for doc in member_collection.find({'guild_id': guild_id}, {'user_id': 1, '_id': 0})}
+
+
+def reconcile_members(guild_id, joined, left):
+    """Adds the members that joined and removes the members that left while the bot was
+       not listening, with one bulk write per collection. Only for migrated guilds, see
+       members_migrated: joined members get fresh documents, which would replace legacy data
+
+    Args:
+        guild_id (int): Id of the guild
+        joined (List[Tuple[int, bool]]): User ids of members without documents and whether they are bots
+        left (List[int]): User ids of documents whose members are gone
     """
-    doc = get_userdata_doc(guild)
-    members = {}
+    member_ops = []
+    inventory_ops = []
+
+    for user_id, is_bot in joined:
+        inventory_id = str(uuid1())
+        member_ops.append(InsertOne(new_member_doc(guild_id, user_id, inventory_id, is_bot)))
+        inventory_ops.append(InsertOne(new_inventory_doc(guild_id, user_id, inventory_id)))
+
+    if left:
+        gone = {'guild_id': guild_id, 'user_id': {'$in': list(left)}}
+        member_ops.append(DeleteMany(gone))
+        inventory_ops.append(DeleteMany(gone))
 
-    if doc is not None:
-        members = doc['members']
+    for collection, ops in ((member_collection, member_ops), (member_inventory_collection, inventory_ops)):
+        if not ops:
+            continue
 
         try:
-            if reset:
-                create_user_entry(guild, user)
-            else:
-                members[str(user.id)]['points'] += points
-        except KeyError:
-            members[str(user.id)]['points'] = points
+            collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as error:
+            # joined in the meantime and already got their documents
+            raise_unless_duplicates(error)
 
+    if left:
+        # drop the legacy entries as well, like remove_user_entry
         user_data_collection.update_one(
-            {'guild_id': guild.id},
-            {"$set":
-                {
-                    'members': members
-                }})
-    else:
-        members = create_guild_entry(guild)
+            {'guild_id': guild_id},
+            {"$unset": {member_path(user_id): "" for user_id in left}})
 
-    return members
+    for user_id, is_bot in joined:
+        member_cache.invalidate((guild_id, user_id))
+        inventory_cache.invalidate((guild_id, user_id))
+        leaderboards.reset(guild_id, user_id, is_bot)
 
+    for user_id in left:
+        member_cache.invalidate((guild_id, user_id))
+        inventory_cache.invalidate((guild_id, user_id))
+        leaderboards.remove(guild_id, user_id)
 
-def update_xp(guild, user, xp, reset=False):
-    """Updates xp value for the given user in the given guild
+
+def insert_ignoring_duplicates(collection, docs):
+    """Inserts the documents, skipping the ones that already exist.
+       Makes repeated or interrupted inserts idempotent
+
+    Args:
+        collection (pymongo.collection.Collection): Collection to insert into
+        docs (List[dict]): Documents to insert
+    """
+    if not docs:
+        return
+
+    try:
+        collection.insert_many(docs, ordered=False)
+    except BulkWriteError as error:
+        raise_unless_duplicates(error)
+
+
+def raise_unless_duplicates(error):
+    """Re-raises a BulkWriteError unless every failure was a duplicate key"""
+    if any(write_error['code'] != DUPLICATE_KEY_ERROR for write_error in error.details['writeErrors']):
+        raise error
+
+
+def member_path(user_id, field=None):
+    """Builds the dotted path to a member (or one of their fields) in a legacy guild document
+
+    Args:
+        user_id (integer): Id of the member
+        field (string, optional): Field of the member's data. Defaults to the whole entry.
+
+    Returns:
+        string: Path usable in MongoDB filters and updates
+    """
+    path = f'members.{user_id}'
+    return path if field is None else f'{path}.{field}'
+
+
+def field_or_default(field):
+    """Aggregation expression for a member field that falls back to the default for new members"""
+    return {'$ifNull': [f'${field}', MEMBER_DEFAULTS.get(field, 0)]}
+
+
+def member_delta_pipeline(**deltas):
+    """Builds an update pipeline that adds the given deltas to a member's counters.
+       When xp changes the level up check and payout happen on the server as well,
+       so no prior read of the document is needed.
+
+    Args:
+        **deltas (integer): Amount to add to each field i.e. xp=5, points=-100
+
+    Returns:
+        List[dict]: Update pipeline for update_one
+    """
+    pipeline = [{'$set': {
+        field: {'$add': [field_or_default(field), amount]}
+        for field, amount in deltas.items()
+    }}]
+
+    if deltas.get('xp'):
+        level = field_or_default('level')
+        # a big xp grant can go up several levels at once, every one of them is paid
+        pipeline.append({'$set': {'next_level': {'$max': [level, level_curve.level_expr('$xp')]}}})
+        pipeline.append({'$set': {
+            'points': {'$add': [field_or_default('points'), level_curve.payout_expr(level, '$next_level')]},
+            'level': '$next_level'
+        }})
+        pipeline.append({'$unset': 'next_level'})
+
+    return pipeline
+
+
+def update_member(guild, user, **deltas):
+    """Atomically adds the given deltas to a member's counters in a single round trip.
+       Only the touched fields are sent to the database.
+
+    Args:
+        guild (discord.Guild): Guild the member belongs to
+        user (discord.User): Member to update
+        **deltas (integer): Amount to add to each field i.e. xp=5, points=-100
+    """
+    deltas = {field: amount for field, amount in deltas.items() if amount}
+
+    if deltas:
+        # members that are not migrated yet are migrated first, so level ups start from their real level
+        run_member_update(guild.id, user.id, {}, member_delta_pipeline(**deltas))
+        leaderboards.add_xp(guild.id, user.id, deltas.get('xp', 0))
+
+
+def apply_xp_deltas(guild_id, deltas):
+    """Applies the xp changes of many members of one guild in a single bulk write.
+       Level ups are handled the same way as in update_xp
+
+    Args:
+        guild_id (integer): Id of the guild
+        deltas (dict): Amount of xp to add keyed by user id
+
+    Raises:
+        Exception: If writing failed before any change could be applied
+
+    Returns:
+        dict: Amount of xp of the members whose write failed, keyed by user id
+    """
+    user_ids = [user_id for user_id, xp in deltas.items() if xp]
+
+    if not user_ids:
+        return {}
+
+    migrated = {doc['user_id'] for doc in member_collection.find(
+        {'guild_id': guild_id, 'user_id': {'$in': user_ids}, 'migrated': True}, {'user_id': 1, '_id': 0})}
+
+    # members that are not migrated yet are migrated first, so level ups start from their real level
+    for user_id in user_ids:
+        if user_id not in migrated:
+            migrate_member(guild_id, user_id)
+
+    ops = [UpdateOne({'guild_id': guild_id, 'user_id': user_id, 'migrated': True},
+                     member_delta_pipeline(xp=deltas[user_id]))
+           for user_id in user_ids]
+    failed = {}
+
+    try:
+        member_collection.bulk_write(ops, ordered=False)
+    except BulkWriteError as error:
+        # unordered, every write that is not listed as failed was applied
+        failed = {user_ids[write_error['index']]: deltas[user_ids[write_error['index']]]
+                  for write_error in error.details['writeErrors']}
+
+    for user_id in user_ids:
+        if user_id not in failed:
+            member_cache.invalidate((guild_id, user_id))
+            leaderboards.add_xp(guild_id, user_id, deltas[user_id])
+
+    return failed
+
+
+def update_points(guild, user, points, reset=False):
+    """Updates point value for the given user in the given guild
 
     Args:
         guild (discord.Guild): Guild to update
         user (discord.User): User to update
-        points (int): Amount of xp to add to current value
+        points (int): Amount of points to add to current value
         reset (bool, optional): Flag to determine if user data should be reset. Defaults to False.
-
-    Returns:
-        dict: Most up to date member information
     """
-    doc = get_userdata_doc(guild)
-    members = {}
+    if reset:
+        create_user_entry(guild, user)
+    else:
+        update_member(guild, user, points=points)
 
-    if doc is not None:
-        members = doc['members']
 
-        try:
-            if reset:
-                create_user_entry(guild, user)
-            else:
-                members[str(user.id)]['xp'] += xp
-
-                # check to see if they crossed the threshold
-                if needs_level_up(members[str(user.id)]['level'], members[str(user.id)]['xp']):
-                    # level up
-                    members[str(user.id)]['level'] += 1
-
-                    # add points
-                    members[str(
-                        user.id)]['points'] += calculate_levelup_points(members[str(user.id)]['level'])
-        except KeyError:
-            members[str(user.id)]['xp'] = xp
+def update_xp(guild, user, xp, reset=False):
+    """Updates xp value for the given user in the given guild.
+       Levels up the user and awards points if they cross the next threshold
 
-        user_data_collection.update_one(
-            {'guild_id': guild.id},
-            {"$set":
-                {
-                    'members': members
-                }})
+    Args:
+        guild (discord.Guild): Guild to update
+        user (discord.User): User to update
+        xp (int): Amount of xp to add to current value
+        reset (bool, optional): Flag to determine if user data should be reset. Defaults to False.
+    """
+    if reset:
+        create_user_entry(guild, user)
     else:
-        members = create_guild_entry(guild)
+        update_member(guild, user, xp=xp)
 
-    return members
+
+def update_energy(guild, user, energy):
+    """Updates energy value for the given user in the given guild
+
+    Args:
+        guild (discord.Guild): Guild to update
+        user (discord.User): User to update
+        energy (int): Amount of energy to add to current value
+    """
+    update_member(guild, user, energy=energy)
 
 
 def needs_level_up(level, xp):
-    if xp >= quadratic_level_fx(level):
-        return True
-    else:
-        return False
+    return xp >= level_curve.threshold(level)
+
+
+def level_after(level, xp):
+    """Level a member ends up at after their xp changed, same rule as the update pipeline"""
+    return level_curve.level_after(level, xp)
+
+
+# xp rankings of the guilds someone looked at, kept in sync by the xp write paths above
+leaderboards = LeaderboardIndex(level_after)
 
 
 def quadratic_level_fx(x):
@@ -398,87 +723,317 @@ def log_level_fx(x):
 
 
 def get_rank(level):
-    if level == 1:
-        return "F5"
-    if level == 2:
-        return "F4"
-    if level == 3:
-        return "F3"
-    if level == 4:
-        return "F2"
-    if level == 5:
-        return "F1"
-    if level == 6:
-        return "E5"
-    if level == 7:
-        return "E4"
-    if level == 8:
-        return "E3"
-    if level == 9:
-        return "E2"
-    if level == 10:
-        return "E1"
-    if level == 11:
-        return "D5"
-    if level == 12:
-        return "D4"
-    if level == 13:
-        return "D3"
-    if level == 14:
-        return "D2"
-    if level == 15:
-        return "D1"
-    if level == 16:
-        return "C3"
-    if level == 17:
-        return "C2"
-    if level == 18:
-        return "C1"
-    if level == 19:
-        return "B3"
-    if level == 20:
-        return "B2"
-    if level == 21:
-        return "B1"
-    if level == 22:
-        return "A3"
-    if level == 23:
-        return "A2"
-    if level == 24:
-        return "A1"
-    if level == 25:
-        return "S2"
-    if level == 26:
-        return "S1"
-    if level == 27:
-        return "SS"
+    return rank_for_level(level)
 
 
-def get_points(guild, user):
-    """Gets the points total for the given user in the given guild
+def find_member(guild_id, user_id):
+    """Gets the member document for the given ids, served from member_cache when possible
+
+    Args:
+        guild_id (integer): Id of the guild
+        user_id (integer): Id of the user
+
+    Returns:
+        dict: Member document
+    """
+    return member_cache.get((guild_id, user_id), lambda: load_member(guild_id, user_id))
+
+
+def load_member(guild_id, user_id):
+    """Loads the member document for the given ids, migrating the member on the fly if needed
+
+    Args:
+        guild_id (integer): Id of the guild
+        user_id (integer): Id of the user
+
+    Returns:
+        dict: Member document
+    """
+    doc = member_collection.find_one({'guild_id': guild_id, 'user_id': user_id})
+
+    if doc is None or not doc.get('migrated'):
+        doc, _ = migrate_member(guild_id, user_id)
+
+    return doc
+
+
+def get_member_doc(guild, user):
+    """Gets the document holding the given user's data in the given guild
 
     Args:
         guild (discord.Guild): Guild to get user data for
-        user (discord.User): User to get points total for
+        user (discord.User): User to get data for
 
     Returns:
-        integer: Users point total
+        dict: Member document
+    """
+    return find_member(guild.id, user.id)
+
+
+def get_member_inventory(guild, user):
+    """Gets the document holding the given user's inventory and stash
+
+    Args:
+        guild (discord.Guild): Guild to get the inventory for
+        user (discord.User): Owner of the inventory
+
+    Returns:
+        dict: Inventory document
     """
-    doc = get_userdata_doc(guild)
+    return inventory_cache.get((guild.id, user.id), lambda: load_member_inventory(guild.id, user.id))
+
+
+def load_member_inventory(guild_id, user_id):
+    """Loads the inventory document for the given ids, migrating the member on the fly if needed
+
+    Args:
+        guild_id (integer): Id of the guild
+        user_id (integer): Id of the owner
+
+    Returns:
+        dict: Inventory document
+    """
+    doc = member_inventory_collection.find_one({'guild_id': guild_id, 'user_id': user_id})
+
+    if doc is None or not doc.get('migrated'):
+        _, doc = migrate_member(guild_id, user_id)
+
+    return doc
+
+
+def inventory_filter(guild, user, **conditions):
+    """Filter matching a migrated inventory document plus the given conditions"""
+    return dict({'guild_id': guild.id, 'user_id': user.id, 'migrated': True}, **conditions)
+
+
+def run_inventory_update(guild, user, conditions, update):
+    """Applies an update to an inventory only if the conditions hold, in one round trip.
+       An inventory that is not migrated yet is migrated and the update tried again
+
+    Args:
+        guild (discord.Guild): Guild the inventory belongs to
+        user (discord.User): Owner of the inventory
+        conditions (dict): Extra filter conditions enforcing the inventory rules
+        update (dict or List[dict]): Update document or pipeline
+
+    Returns:
+        Tuple[bool, dict]: Whether the update was applied and the resulting inventory
+    """
+    doc = member_inventory_collection.find_one_and_update(
+        inventory_filter(guild, user, **conditions), update, return_document=ReturnDocument.AFTER)
 
     if doc is None:
-        create_guild_entry(guild)
+        current = member_inventory_collection.find_one({'guild_id': guild.id, 'user_id': user.id})
 
-        return 0
-    else:
-        members = doc['members']
+        if current is not None and current.get('migrated'):
+            return False, current
 
-        try:
-            return members[str(user.id)]['points']
-        except KeyError:
-            create_user_entry(guild, user)
+        migrate_member(guild.id, user.id)
+        doc = member_inventory_collection.find_one_and_update(
+            inventory_filter(guild, user, **conditions), update, return_document=ReturnDocument.AFTER)
+
+        if doc is None:
+            return False, member_inventory_collection.find_one({'guild_id': guild.id, 'user_id': user.id})
+
+    inventory_cache.invalidate((guild.id, user.id))
+
+    return True, doc
+
+
+def add_items(guild, user, item_id, quantity, section='inventory'):
+    """Adds items to an inventory or stash. The filter enforces the capacity and the
+       item's max_quantity, so the checks and the write happen in one atomic operation
+
+    Args:
+        guild (discord.Guild): Guild the inventory belongs to
+        user (discord.User): Owner of the inventory
+        item_id (string): Id of the item to add
+        quantity (int): Amount to add
+        section (string, optional): 'inventory' or 'stash'. Defaults to 'inventory'.
+
+    Returns:
+        Tuple[bool, dict]: Whether the items were added and the resulting inventory
+    """
+    size, capacity = INVENTORY_SECTIONS[section]
+    item = item_lookup(item_id)
+    path = f'{section}.{item.id}'
+
+    if not 0 < quantity <= item.max_quantity:
+        return False, get_member_inventory(guild, user)
+
+    return run_inventory_update(
+        guild, user,
+        {'$expr': {'$lte': [{'$add': [f'${size}', quantity]}, f'${capacity}']},
+         path: {'$not': {'$gt': item.max_quantity - quantity}}},
+        {"$inc": {path: quantity, size: quantity}})
+
+
+def remove_items(guild, user, item_id, quantity=1, section='inventory'):
+    """Removes up to quantity items from an inventory or stash in one atomic operation.
+       Items that reach 0 are dropped from the inventory
+
+    Args:
+        guild (discord.Guild): Guild the inventory belongs to
+        user (discord.User): Owner of the inventory
+        item_id (string): Id of the item to remove
+        quantity (int, optional): Amount to remove. Defaults to 1.
+        section (string, optional): 'inventory' or 'stash'. Defaults to 'inventory'.
+
+    Returns:
+        Tuple[bool, dict]: False if there was none of the item, and the resulting inventory
+    """
+    size, _ = INVENTORY_SECTIONS[section]
+    path = f'{section}.{item_id}'
+    count = f'${path}'
+
+    return run_inventory_update(
+        guild, user,
+        {path: {'$gt': 0}},
+        [{'$set': {
+            size: {'$subtract': [f'${size}', {'$min': [quantity, count]}]},
+            path: {'$cond': [{'$gt': [count, quantity]}, {'$subtract': [count, quantity]}, '$$REMOVE']}
+        }}])
+
+
+def transfer_items(guild, user, quantities, source='inventory', target='stash'):
+    """Moves items between the inventory and the stash in one atomic operation. Either
+       every item moves or nothing does: the filter checks that the source holds enough
+       of each item, the target has room for all of them and no item goes over its
+       max_quantity
+
+    Args:
+        guild (discord.Guild): Guild the inventory belongs to
+        user (discord.User): Owner of the inventory
+        quantities (dict): Amount to move keyed by item id
+        source (string, optional): Section the items leave. Defaults to 'inventory'.
+        target (string, optional): Section the items go to. Defaults to 'stash'.
+
+    Returns:
+        Tuple[bool, dict]: Whether the items were moved and the resulting inventory
+    """
+    source_size, _ = INVENTORY_SECTIONS[source]
+    target_size, target_capacity = INVENTORY_SECTIONS[target]
+    items = {item_lookup(item_id): quantity for item_id, quantity in quantities.items()}
+    total = sum(items.values())
+
+    if not items or source == target or any(not 0 < quantity <= item.max_quantity for item, quantity in items.items()):
+        return False, get_member_inventory(guild, user)
+
+    conditions = {'$expr': {'$lte': [{'$add': [f'${target_size}', total]}, f'${target_capacity}']}}
+    changes = {
+        source_size: {'$subtract': [f'${source_size}', total]},
+        target_size: {'$add': [f'${target_size}', total]},
+    }
+
+    for item, quantity in items.items():
+        source_path = f'{source}.{item.id}'
+        target_path = f'{target}.{item.id}'
+        count = f'${source_path}'
+
+        conditions[source_path] = {'$gte': quantity}
+        conditions[target_path] = {'$not': {'$gt': item.max_quantity - quantity}}
+        changes[source_path] = {'$cond': [{'$gt': [count, quantity]}, {'$subtract': [count, quantity]}, '$$REMOVE']}
+        changes[target_path] = {'$add': [{'$ifNull': [f'${target_path}', 0]}, quantity]}
+
+    return run_inventory_update(guild, user, conditions, [{'$set': changes}])
+
+
+def load_leaderboard_members(guild):
+    """Loads what the leaderboard needs to know about every member of the guild
+
+    Args:
+        guild (discord.Guild): Guild to load the members of
+
+    Returns:
+        List[dict]: user_id, xp, level and bot flag of every member
+    """
+    docs = member_collection.find({'guild_id': guild.id}, {'user_id': 1, 'xp': 1, 'level': 1, 'bot': 1})
+
+    return leaderboard_members(guild, docs)
+
+
+def leaderboard_members(guild, docs):
+    """Keeps what the leaderboard needs from member documents
+
+    Args:
+        guild (discord.Guild): Guild of the members
+        docs (Iterable[dict]): Member documents
+
+    Returns:
+        List[dict]: user_id, xp, level and bot flag of every member
+    """
+    members = []
+
+    for doc in docs:
+        member = guild.get_member(doc['user_id'])
+        members.append({
+            'user_id': doc['user_id'],
+            'xp': doc.get('xp', 0),
+            'level': doc.get('level', 1),
+            'bot': doc.get('bot') or (member is not None and member.bot)
+        })
+
+    return members
+
+
+def warm_guild(guild):
+    """Loads every member and inventory document of a guild into member_cache and
+       inventory_cache and builds its leaderboard, in two round trips for the whole guild.
+       Documents that are not migrated yet are left to be migrated when first used
+
+    Args:
+        guild (discord.Guild): Guild to warm up
+
+    Returns:
+        Tuple[int, int]: Number of member documents and inventory documents cached
+    """
+    docs = []
+    # the leaderboard is built from documents read before it is asked for
+    leaderboard_version = leaderboards.version(guild.id)
 
-            return 0
+    def load_members():
+        docs.extend(member_collection.find({'guild_id': guild.id}))
+        return [((guild.id, doc['user_id']), doc) for doc in docs if doc.get('migrated')]
+
+    def load_inventories():
+        return [((guild.id, doc['user_id']), doc)
+                for doc in member_inventory_collection.find({'guild_id': guild.id, 'migrated': True})]
+
+    members = member_cache.fill(load_members)
+    inventories = inventory_cache.fill(load_inventories)
+    unused = [docs]
+    # the documents read above the first time, fresh ones if xp changed while they were read
+    leaderboards.get(guild.id, lambda: leaderboard_members(guild, unused.pop()) if unused else
+                     load_leaderboard_members(guild), leaderboard_version)
+
+    return members, inventories
+
+
+def get_leaderboard_page(guild, page):
+    """Gets a page of the xp leaderboard of a guild, only the first call per guild reads the database
+
+    Args:
+        guild (discord.Guild): Guild to get the leaderboard of
+        page (int): Page number starting at 1
+
+    Returns:
+        Tuple[List[Tuple[int, int, int, int]], int]: (position, user id, xp, level) of every
+            entry on the page and the number of pages
+    """
+    return leaderboards.page(guild.id, lambda: load_leaderboard_members(guild), page)
+
+
+def get_points(guild, user):
+    """Gets the points total for the given user in the given guild
+
+    Args:
+        guild (discord.Guild): Guild to get user data for
+        user (discord.User): User to get points total for
+
+    Returns:
+        integer: Users point total
+    """
+    return get_member_doc(guild, user)['points']
 
 
 def get_xp(guild, user):
@@ -491,96 +1046,295 @@ def get_xp(guild, user):
     Returns:
         integer: Users xp total
     """
-    doc = get_userdata_doc(guild)
+    return get_member_doc(guild, user)['xp']
 
-    if doc is None:
-        create_guild_entry(guild)
 
-        return 0
-    else:
-        members = doc['members']
+def current_gift_day():
+    """Day stamp used to reset the daily gift limit, changes at local midnight"""
+    return date.today().toordinal()
 
-        try:
-            return members[str(user.id)]['xp']
-        except KeyError:
-            create_user_entry(guild, user)
 
-            return 0
+def gifted_today_expr(day):
+    """Aggregation expression for how many points a member gifted on the given day. The
+       counter only counts for the day stamped next to it, so it resets on its own once
+       the day is over"""
+    return {'$cond': [{'$eq': ['$gift_day', day]}, field_or_default('total_gift'), 0]}
+
+
+def run_member_update(guild_id, user_id, conditions, update, create=True):
+    """Applies an update to a member document only if the conditions hold. A member that
+       is not migrated yet is migrated and the update tried again
+
+    Args:
+        guild_id (integer): Id of the guild
+        user_id (integer): Id of the user
+        conditions (dict): Extra filter conditions
+        update (dict or List[dict]): Update document or pipeline
+        create (bool, optional): Whether a member without any data gets default documents
+            first. Defaults to True.
+
+    Returns:
+        bool: Whether the update was applied
+    """
+    member_filter = {'guild_id': guild_id, 'user_id': user_id, 'migrated': True}
+    result = member_collection.update_one(dict(member_filter, **conditions), update)
+
+    if result.matched_count == 0 and member_collection.count_documents(member_filter, limit=1) == 0:
+        migrate_member(guild_id, user_id, create)
+        result = member_collection.update_one(dict(member_filter, **conditions), update)
+
+    if result.matched_count:
+        member_cache.invalidate((guild_id, user_id))
+
+    return result.matched_count == 1
 
 
 def send_points(guild, sender_id, recipient_id, amount):
-    doc = get_userdata_doc(guild)
-    members = doc['members']
-    sender_data = members[str(sender_id)]
-    recipient_data = members[str(recipient_id)]
-    limit = 1000  # maximum points allowed to be gifted per day
-    total_gift = sender_data['total_gift']
-
-    if total_gift > limit or amount + total_gift > limit:
-        return False
-    else:
-        # updates sender total points and increases total gift
-        sender_data['total_gift'] += amount
-        sender_data['points'] -= amount
+    """Moves points from one member to another. The balance and daily limit checks and
+       the debit are one guarded update on the sender's document, then the recipient is
+       credited. Both touch a single member document, so the cost does not grow with the
+       guild and concurrent gifts can not overwrite each other. The caller makes sure the
+       recipient is a member, one without documents yet gets them. If the credit fails the
+       debit is undone
 
-        recipient_data['points'] += amount
+    Args:
+        guild (discord.Guild): Guild the members belong to
+        sender_id (integer): Id of the member sending the points
+        recipient_id (integer): Id of the member receiving the points
+        amount (int): Points to send
+
+    Returns:
+        string: GIFT_SENT, GIFT_INSUFFICIENT_POINTS, GIFT_LIMIT_REACHED or GIFT_FAILED
+    """
+    if amount <= 0 or sender_id == recipient_id:
+        return GIFT_FAILED
 
-        members[str(sender_id)] = sender_data
-        members[str(recipient_id)] = recipient_data
+    day = current_gift_day()
+    gifted = gifted_today_expr(day)
 
-        user_data_collection.update_one(
-            {'guild_id': guild.id},
-            {"$set":
-             {
-                 'members': members
-             }})
+    debited = run_member_update(
+        guild.id, sender_id,
+        {'points': {'$gte': amount}, '$expr': {'$lte': [{'$add': [gifted, amount]}, GIFT_LIMIT]}},
+        [{'$set': {'points': {'$subtract': ['$points', amount]},
+                   'total_gift': {'$add': [gifted, amount]},
+                   'gift_day': day}}])
+
+    if not debited:
+        sender_data = member_collection.find_one({'guild_id': guild.id, 'user_id': sender_id}) or {}
 
-        return True
+        if sender_data.get('points', 0) < amount:
+            return GIFT_INSUFFICIENT_POINTS
+
+        return GIFT_LIMIT_REACHED
+
+    # members that are still being onboarded or reconciled have no documents yet
+    if run_member_update(guild.id, recipient_id, {}, {"$inc": {'points': amount}}):
+        return GIFT_SENT
+
+    # the recipient could not be credited, give the sender their points back
+    member_collection.update_one(
+        {'guild_id': guild.id, 'user_id': sender_id},
+        [{'$set': {'points': {'$add': ['$points', amount]},
+                   'total_gift': {'$cond': [{'$eq': ['$gift_day', day]},
+                                            {'$max': [{'$subtract': [field_or_default('total_gift'), amount]}, 0]},
+                                            field_or_default('total_gift')]}}}])
+    member_cache.invalidate((guild.id, sender_id))
+
+    return GIFT_FAILED
 
 
 def get_user_inventory_id(guild, user):
-    doc = get_userdata_doc(guild)
-    return doc['members'][str(user.id)]['inventory_id']
+    return get_member_doc(guild, user)['inventory_id']
 
 
 def get_user_inventory(guild, user):
-    inventory_doc = inventory_collection.find_one({'guild_id': guild.id})
-    inventory_id = get_user_inventory_id(guild, user)
-
-    return inventory_doc['inventories'][inventory_id]['inventory']
+    return get_member_inventory(guild, user)['inventory']
 
 
 def get_user_energy(guild, user):
-    doc = get_userdata_doc(guild)
-    return doc['members'][str(user.id)]['energy']
+    return get_member_doc(guild, user)['energy']
 
 
 def check_item_exists(item_name):
-    try:
-        return items[name_to_id[item_name]]
-    except KeyError:
-        return None
+    return game_data.catalog.find(item_name)
 
 
 def check_item_exists_inventory(guild, user, item_name):
-    inventory_id = get_user_inventory_id(guild, user)
-    inventory_doc = get_inventory_doc(guild)
-    inventory_data = inventory_doc['inventories'][inventory_id]
+    inventory_data = get_member_inventory(guild, user)
+    item_id = item_id_lookup(item_name)
 
-    try:
-        item_id = name_to_id[item_name]
-        return item_id if inventory_data['inventory'][item_id] else -1
-    except KeyError:
-        return -1
+    return item_id if inventory_data['inventory'].get(item_id) else -1
 
 
 def check_item_exists_stash(guild, user, item_name):
-    inventory_id = get_user_inventory_id(guild, user)
-    inventory_doc = get_inventory_doc(guild)
-    inventory_data = inventory_doc['inventories'][inventory_id]
+    inventory_data = get_member_inventory(guild, user)
+    item_id = item_id_lookup(item_name)
 
-    try:
-        item_id = name_to_id[item_name]
-        return item_id if inventory_data['stash'][item_id] else -1
-    except KeyError:
-        return -1
+    return item_id if inventory_data['stash'].get(item_id) else -1
+
+
+def legacy_member_merge(legacy):
+    """Update pipeline that folds a member's legacy entry into their member document.
+       Counters are added so changes made before the merge are kept.
+
+    Args:
+        legacy (dict): Member entry from the legacy guild document
+
+    Returns:
+        List[dict]: Update pipeline
+    """
+    return [{'$set': {
+        'points': {'$add': [field_or_default('points'), legacy.get('points', 0)]},
+        'xp': {'$add': [field_or_default('xp'), legacy.get('xp', 0)]},
+        'total_gift': field_or_default('total_gift'),  # daily counter, not worth carrying over
+        'energy': {'$add': [field_or_default('energy'), legacy.get('energy', DEFAULT_ENERGY) - DEFAULT_ENERGY]},
+        'level': {'$max': [field_or_default('level'), legacy.get('level', 1)]},
+        'inventory_id': {'$ifNull': ['$inventory_id', legacy['inventory_id']]},
+        'migrated': True
+    }}]
+
+
+def legacy_inventory_merge(inventory_id, legacy):
+    """Update pipeline that folds a legacy inventory into an inventory document
+
+    Args:
+        inventory_id (string): Id of the inventory
+        legacy (dict): Inventory from the legacy guild document (may be empty)
+
+    Returns:
+        List[dict]: Update pipeline
+    """
+    pipeline = [{'$set': {
+        'id': {'$ifNull': ['$id', inventory_id]},
+        'capacity': {'$ifNull': ['$capacity', legacy.get('capacity', 20)]},
+        'size': {'$add': [{'$ifNull': ['$size', 0]}, legacy.get('size', 0)]},
+        'inventory': {'$ifNull': ['$inventory', {'$literal': {}}]},
+        'stash_capacity': {'$ifNull': ['$stash_capacity', legacy.get('stash_capacity', 10)]},
+        'stash_size': {'$add': [{'$ifNull': ['$stash_size', 0]}, legacy.get('stash_size', 0)]},
+        'stash': {'$ifNull': ['$stash', {'$literal': {}}]},
+        'migrated': True
+    }}]
+
+    counts = {}
+
+    for section in ('inventory', 'stash'):
+        for item_id, quantity in legacy.get(section, {}).items():
+            path = f'{section}.{item_id}'
+            counts[path] = {'$add': [{'$ifNull': [f'${path}', 0]}, quantity]}
+
+    if counts:
+        pipeline.append({'$set': counts})
+
+    return pipeline
+
+
+def member_migration_ops(guild_id, user_id, legacy_member, legacy_inventory):
+    """Builds the writes that migrate a single member and their inventory.
+       The filters only match documents that have not been migrated yet, so replaying
+       them is harmless: the upsert then fails with a duplicate key which is ignored.
+
+    Args:
+        guild_id (integer): Id of the guild
+        user_id (integer): Id of the member
+        legacy_member (dict): Legacy member entry, None if there is none
+        legacy_inventory (dict): Legacy inventory, None if there is none
+
+    Returns:
+        Tuple[UpdateOne, UpdateOne]: Member write and inventory write
+    """
+    if legacy_member is None:
+        legacy_member = {'inventory_id': str(uuid1())}
+
+    pending = {'guild_id': guild_id, 'user_id': user_id, 'migrated': {'$ne': True}}
+
+    return (UpdateOne(pending, legacy_member_merge(legacy_member), upsert=True),
+            UpdateOne(pending, legacy_inventory_merge(legacy_member['inventory_id'], legacy_inventory or {}),
+                      upsert=True))
+
+
+def migrate_member(guild_id, user_id, create=True):
+    """Migrates a single member from the legacy guild documents right when they are needed.
+       Used for members the background migration did not reach yet
+
+    Args:
+        guild_id (integer): Id of the guild
+        user_id (integer): Id of the member
+        create (bool, optional): Whether to create default documents for someone without
+            legacy data. Defaults to True.
+
+    Returns:
+        Tuple[dict, dict]: Migrated member document and inventory document, None for both
+            if there was nothing to migrate and create is False
+    """
+    legacy_doc = user_data_collection.find_one(
+        {'guild_id': guild_id}, {member_path(user_id): 1}) or {}
+    legacy_member = legacy_doc.get('members', {}).get(str(user_id))
+    legacy_inventory = None
+
+    if legacy_member is not None:
+        inventory_path = f"inventories.{legacy_member['inventory_id']}"
+        legacy_inventory_doc = inventory_collection.find_one(
+            {'guild_id': guild_id}, {inventory_path: 1}) or {}
+        legacy_inventory = legacy_inventory_doc.get(
+            'inventories', {}).get(legacy_member['inventory_id'])
+    elif not create:
+        return None, None
+
+    member_op, inventory_op = member_migration_ops(guild_id, user_id, legacy_member, legacy_inventory)
+    member_filter = {'guild_id': guild_id, 'user_id': user_id}
+
+    for collection, op in ((member_collection, member_op), (member_inventory_collection, inventory_op)):
+        try:
+            collection.bulk_write([op])
+        except BulkWriteError as error:
+            # someone else migrated the member in the meantime
+            raise_unless_duplicates(error)
+
+    return (member_collection.find_one(member_filter),
+            member_inventory_collection.find_one(member_filter))
+
+
+def migrate_guild_members(guild_doc, batch_size=500):
+    """Copies the members and inventories embedded in a legacy guild document into
+       their own documents, batch_size members per round trip. Progress is saved after
+       every batch so an interrupted migration continues where it stopped
+
+    Args:
+        guild_doc (dict): Legacy UserData document of the guild
+        batch_size (int, optional): Members migrated per batch. Defaults to 500.
+
+    Returns:
+        int: Number of members migrated
+    """
+    guild_id = guild_doc['guild_id']
+    legacy_inventories = (inventory_collection.find_one({'guild_id': guild_id}) or {}).get('inventories', {})
+    cursor = guild_doc.get('migration_cursor', -1)
+    user_ids = sorted(int(user_id) for user_id in guild_doc.get('members', {}) if int(user_id) > cursor)
+    migrated = 0
+
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        member_ops = []
+        inventory_ops = []
+
+        for user_id in batch:
+            legacy_member = guild_doc['members'][str(user_id)]
+            member_op, inventory_op = member_migration_ops(
+                guild_id, user_id, legacy_member, legacy_inventories.get(legacy_member['inventory_id']))
+            member_ops.append(member_op)
+            inventory_ops.append(inventory_op)
+
+        for collection, ops in ((member_collection, member_ops), (member_inventory_collection, inventory_ops)):
+            try:
+                collection.bulk_write(ops, ordered=False)
+            except BulkWriteError as error:
+                raise_unless_duplicates(error)
+
+        user_data_collection.update_one({'guild_id': guild_id},
+                                        {"$set": {'migration_cursor': batch[-1]}})
+        migrated += len(batch)
+
+    user_data_collection.update_one({'guild_id': guild_id},
+                                    {"$set": {'members_migrated': True}})
+
+    return migrated
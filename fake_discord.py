@@ -0,0 +1,169 @@
+"""Stand-ins for the discord.py objects the handlers in bot.py use, so the handlers can
+be driven without a gateway connection. Only the attributes and methods the bot touches
+are implemented. Everything sent to a channel or member is counted instead of delivered.
+"""
+import shlex
+
+
+class FakeUser:
+    def __init__(self, user_id, name=None, bot=False):
+        self.id = user_id
+        self.name = name or f'user{user_id}'
+        self.display_name = self.name
+        self.discriminator = '0000'
+        self.bot = bot
+        self.sent = 0  # direct messages received
+
+    @property
+    def mention(self):
+        return f'<@!{self.id}>'
+
+    async def create_dm(self):
+        return self
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+        close_file(kwargs)
+
+
+class FakeMember(FakeUser):
+    def __init__(self, user_id, guild, name=None, bot=False):
+        super().__init__(user_id, name, bot)
+        self.guild = guild
+
+
+class FakeGuild:
+    def __init__(self, guild_id, name=None):
+        self.id = guild_id
+        self.name = name or f'guild{guild_id}'
+        self.members_by_id = {}
+        self.chunked = True  # every member is known
+        self.text_channel = FakeTextChannel(guild_id * 10 + 1, self)
+        self.voice_channel = FakeVoiceChannel(guild_id * 10 + 2, self)
+
+    @property
+    def members(self):
+        return list(self.members_by_id.values())
+
+    @property
+    def member_count(self):
+        return len(self.members_by_id)
+
+    def add_member(self, user_id, name=None, bot=False):
+        member = FakeMember(user_id, self, name, bot)
+        self.members_by_id[user_id] = member
+        return member
+
+    def get_member(self, user_id):
+        return self.members_by_id.get(user_id)
+
+    async def query_members(self, user_ids=None, limit=5, cache=True, **_):
+        return [self.members_by_id[user_id] for user_id in user_ids or () if user_id in self.members_by_id][:limit]
+
+
+class FakeTextChannel:
+    def __init__(self, channel_id, guild, name='general'):
+        self.id = channel_id
+        self.guild = guild
+        self.name = name
+        self.sent = 0  # messages the bot sent to the channel
+
+    async def send(self, content=None, **kwargs):
+        """Counts the message. Uploaded files get a fake CDN url like real attachments"""
+        self.sent += 1
+        file = kwargs.get('file')
+        attachments = [FakeAttachment(self.id, self.sent, file.filename)] if file is not None else []
+        close_file(kwargs)
+
+        return FakeMessage(self.sent, None, self, content or '', attachments)
+
+
+class FakeAttachment:
+    def __init__(self, channel_id, message_id, filename):
+        self.filename = filename
+        self.url = f'https://cdn.discordapp.com/attachments/{channel_id}/{message_id}/{filename}'
+
+
+class FakeVoiceChannel:
+    def __init__(self, channel_id, guild, name='voice'):
+        self.id = channel_id
+        self.guild = guild
+        self.name = name
+
+
+class FakeMessage:
+    def __init__(self, message_id, author, channel, content, attachments=(), role_mentions=(),
+                 mentions=(), mention_everyone=False):
+        self.id = message_id
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.attachments = list(attachments)
+        self.role_mentions = list(role_mentions)
+        self.mentions = list(mentions)
+        self.mention_everyone = mention_everyone
+
+
+class FakeReaction:
+    def __init__(self, message, emoji='\N{THUMBS UP SIGN}'):
+        self.message = message
+        self.emoji = emoji
+
+
+class FakeVoiceState:
+    def __init__(self, channel=None, self_mute=False, self_deaf=False, mute=False, deaf=False, afk=False):
+        self.channel = channel
+        self.self_mute = self_mute
+        self.self_deaf = self_deaf
+        self.mute = mute
+        self.deaf = deaf
+        self.afk = afk
+
+
+class FakeContext:
+    """What commands.Context offers the commands in bot.py"""
+
+    def __init__(self, message, command=None, prefix='$'):
+        self.message = message
+        self.command = command
+        self.prefix = prefix
+        self.author = message.author
+        self.guild = message.guild
+        self.channel = message.channel
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+def close_file(kwargs):
+    """discord.File opens the file right away, close it like discord.py does after sending"""
+    file = kwargs.get('file')
+
+    if file is not None:
+        file.close()
+
+
+def command_processor(bot, prefix='$'):
+    """Builds a replacement for bot.process_commands that parses the message like
+       discord.py and calls the command's callback with a FakeContext. Checks such as
+       has_permissions are skipped
+
+    Args:
+        bot (discord.ext.commands.Bot): Bot holding the commands
+        prefix (string, optional): Command prefix. Defaults to '$'.
+
+    Returns:
+        Callable: Coroutine function taking a message
+    """
+    async def process_commands(message):
+        if message.author.bot or not message.content.startswith(prefix):
+            return
+
+        words = shlex.split(message.content[len(prefix):])
+        command = bot.all_commands.get(words[0]) if words else None
+
+        if command is not None:
+            await command.callback(FakeContext(message, command, prefix), *words[1:])
+
+    return process_commands
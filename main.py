@@ -1,12 +1,48 @@
-from dotenv import load_dotenv  # used for getting environment vars
-
-import bot
-
-
-def main():
-    load_dotenv()
-    bot.run()
-
-
-if __name__ == "__main__":
-    main()
+import os
+
+from dotenv import load_dotenv  # used for getting environment vars
+
+# before importing the bot, some of its settings are read when its modules are imported
+load_dotenv()
+
+import async_bot_utils  # noqa: E402
+import bot  # noqa: E402
+import bot_utils  # noqa: E402
+
+
+def setting(name, default, kind=int):
+    value = os.getenv(name)
+    return default if value is None else kind(value)
+
+
+def configure_database():
+    """Configures the shared database client from the environment
+
+    Returns:
+        Database: The configured database, not connected yet
+    """
+    database = bot_utils.database
+    database.configure(
+        os.getenv('MONGODB_CONNECTION_URL'),
+        # a connection for every database worker, the startup thread and one spare
+        max_pool_size=setting('MONGODB_MAX_POOL_SIZE', async_bot_utils.DB_WORKERS + 2),
+        min_pool_size=setting('MONGODB_MIN_POOL_SIZE', async_bot_utils.DB_WORKERS),
+        connect_timeout=setting('MONGODB_CONNECT_TIMEOUT', 10, float),
+        server_selection_timeout=setting('MONGODB_SERVER_SELECTION_TIMEOUT', 15, float),
+        socket_timeout=setting('MONGODB_SOCKET_TIMEOUT', 30, float),
+        max_idle_time=setting('MONGODB_MAX_IDLE_TIME', 10 * 60, float))
+
+    return database
+
+
+def main():
+    database = configure_database()
+
+    try:
+        bot.run()
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Recomputes the level of every member after the level curve in bot_utils changed.
+
+Members are read a batch at a time and their new levels computed with NumPy. Members
+who go up are paid the level up points of every level they gain. Members who end up
+lower keep their points. Every write only applies if the member's level and xp did not
+change since they were read, so stray xp gains are skipped instead of double paid.
+
+Stop the bot while this runs: it caches member documents and leaderboards.
+Needs NumPy, which the bot itself does not: pip install numpy
+
+Usage:
+    python rebalance_levels.py --dry-run                     what would change
+    python rebalance_levels.py --dry-run --a 50 --b 20       try another curve
+    python rebalance_levels.py                               apply bot_utils.level_curve
+    python rebalance_levels.py --guild 1234 --batch-size 5000
+"""
+import argparse
+import itertools
+import json
+import time
+
+from pymongo import UpdateOne
+
+import bot_utils
+from LevelCurve import LevelCurve
+
+
+def rebalance(collection, curve, query=None, batch_size=10000, dry_run=False):
+    """Moves every matching member to the level their xp reaches on the curve
+
+    Args:
+        collection (pymongo.collection.Collection): Member documents
+        curve (LevelCurve): Curve to level by
+        query (dict, optional): Which members to rebalance. Defaults to every migrated member.
+        batch_size (int, optional): Members read and written per round trip. Defaults to 10000.
+        dry_run (bool, optional): Whether to only count what would change. Defaults to False.
+
+    Returns:
+        dict: Report of the changes
+    """
+    import numpy  # only needed here, the bot runs without it
+
+    query = dict(query or {}, migrated=True)
+    docs = collection.find(query, {'_id': 1, 'level': 1, 'xp': 1}, batch_size=batch_size)
+    # points counts every member that changed, skipped members were not paid
+    report = {'members': 0, 'promoted': 0, 'demoted': 0, 'points': 0, 'written': 0, 'skipped': 0,
+              'dry_run': dry_run}
+    started = time.perf_counter()
+
+    while True:
+        batch = list(itertools.islice(docs, batch_size))
+
+        if not batch:
+            break
+
+        levels = numpy.fromiter((doc.get('level', 1) for doc in batch), dtype=numpy.int64, count=len(batch))
+        xp = numpy.fromiter((doc.get('xp', 0) for doc in batch), dtype=numpy.int64, count=len(batch))
+        new_levels, points = curve.rebalance(levels, xp)
+        changed = numpy.flatnonzero(new_levels != levels)
+
+        report['members'] += len(batch)
+        report['promoted'] += int(numpy.count_nonzero(new_levels > levels))
+        report['demoted'] += int(numpy.count_nonzero(new_levels < levels))
+
+        ops = [UpdateOne({'_id': batch[index]['_id'], 'level': int(levels[index]), 'xp': int(xp[index])},
+                         {'$set': {'level': int(new_levels[index])}, '$inc': {'points': int(points[index])}})
+               for index in changed]
+
+        report['points'] += int(points[changed].sum())
+
+        if dry_run or not ops:
+            continue
+
+        result = collection.bulk_write(ops, ordered=False)
+        report['written'] += result.matched_count
+        report['skipped'] += len(ops) - result.matched_count
+
+    report['seconds'] = time.perf_counter() - started
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recomputes member levels after the level curve changed')
+    parser.add_argument('--guild', type=int, help='only rebalance this guild')
+    parser.add_argument('--a', type=int, help='quadratic coefficient, defaults to the curve in bot_utils')
+    parser.add_argument('--b', type=int, help='linear coefficient, defaults to the curve in bot_utils')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--dry-run', action='store_true', help='only report what would change')
+    args = parser.parse_args()
+
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        raise SystemExit('rebalance_levels.py needs NumPy: pip install numpy')
+
+    import main as bot_main  # loads .env, only needed when connecting for real
+    database = bot_main.configure_database()
+    curve = bot_utils.level_curve
+
+    if args.a is not None or args.b is not None:
+        curve = LevelCurve(curve.a if args.a is None else args.a, curve.b if args.b is None else args.b,
+                           bot_utils.LEVELUP_POINTS, bot_utils.LEVELUP_POINTS_MAX)
+
+    query = {'guild_id': args.guild} if args.guild is not None else None
+
+    try:
+        report = rebalance(bot_utils.member_collection, curve, query, args.batch_size, args.dry_run)
+    finally:
+        database.close()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""Replays an event log written by EventRecorder (RECORD_EVENTS in bot.py) through the
+real handlers in bot.py, against the in-memory database from MemoryMongo.
+
+Every event runs with the same seeded randomness it was recorded with, so gambling and
+exploring roll the same. With --sequential every event finishes before the next one
+starts, which makes the whole replay deterministic.
+
+Usage:
+    python replay.py events.jsonl.gz                 as fast as possible
+    python replay.py events.jsonl.gz --speed 60      one recorded hour per minute
+    python replay.py events.jsonl --sequential --json replays.jsonl
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import bot
+import bot_utils
+from benchmark import percentile, prepare_bot, print_report
+from EventRecorder import EVENT_CODES, open_log, event_seed
+from fake_discord import (FakeGuild, FakeMessage, FakeReaction, FakeTextChannel, FakeUser,
+                          FakeVoiceChannel, FakeVoiceState)
+from MemoryMongo import MemoryClient
+
+HANDLERS = {code: name for name, code in EVENT_CODES.items()}
+
+
+class Replayer:
+    """Turns logged events back into handler calls, building the guilds, members and
+       channels they refer to the first time they show up"""
+
+    def __init__(self, prefix='$'):
+        self.prefix = prefix
+        self.guilds = {}  # guild id -> FakeGuild
+        self.users = {}  # user id -> FakeUser, for direct messages
+        self.channels = {}  # channel id -> FakeTextChannel or FakeVoiceChannel
+
+    def guild(self, guild_id):
+        if guild_id is None:
+            return None
+
+        if guild_id not in self.guilds:
+            self.guilds[guild_id] = FakeGuild(guild_id)
+
+        return self.guilds[guild_id]
+
+    def user(self, guild_id, user):
+        user_id, is_bot = user
+        guild = self.guild(guild_id)
+
+        if guild is None:
+            return self.users.setdefault(user_id, FakeUser(user_id, bot=bool(is_bot)))
+
+        return guild.get_member(user_id) or guild.add_member(user_id, bot=bool(is_bot))
+
+    def channel(self, guild_id, channel_id, voice=False):
+        if channel_id is None:
+            return None
+
+        if channel_id not in self.channels:
+            channel_class = FakeVoiceChannel if voice else FakeTextChannel
+            self.channels[channel_id] = channel_class(channel_id, self.guild(guild_id))
+
+        return self.channels[channel_id]
+
+    def message(self, data):
+        guild_id, channel_id, message_id, author, content, attachments, role_mentions, everyone, mentions = data
+
+        if isinstance(content, int):
+            content = 'x' * content  # only the length of plain messages is recorded
+
+        return FakeMessage(message_id, self.user(guild_id, author), self.channel(guild_id, channel_id), content,
+                           attachments=[None] * attachments, role_mentions=[None] * role_mentions,
+                           mentions=[self.user(guild_id, [user_id, 0]) for user_id in mentions],
+                           mention_everyone=bool(everyone))
+
+    def voice_state(self, guild_id, state):
+        channel_id, self_mute, self_deaf, mute, deaf, afk = state
+        return FakeVoiceState(self.channel(guild_id, channel_id, voice=True), bool(self_mute), bool(self_deaf),
+                              bool(mute), bool(deaf), bool(afk))
+
+    def decode(self, code, args):
+        """Gets the handler and its arguments for a logged event
+
+        Returns:
+            Tuple[string, tuple]: Handler name and arguments
+        """
+        name = HANDLERS[code]
+
+        if name in ('on_message', 'on_message_delete'):
+            return name, (self.message(args[0]),)
+        if name == 'on_message_edit':
+            return name, (self.message(args[0]), self.message(args[1]))
+        if name == 'on_typing':
+            guild_id, channel_id, user = args
+            return name, (self.channel(guild_id, channel_id), self.user(guild_id, user), time.time())
+        if name in ('on_reaction_add', 'on_reaction_remove'):
+            guild_id, message_id, user = args
+            guild = self.guild(guild_id)
+            channel = guild.text_channel if guild is not None else FakeTextChannel(0, None)
+            message = FakeMessage(message_id, None, channel, '')
+            return name, (FakeReaction(message), self.user(guild_id, user))
+        if name == 'on_voice_state_update':
+            guild_id, user, before, after = args
+            return name, (self.user(guild_id, user), self.voice_state(guild_id, before),
+                          self.voice_state(guild_id, after))
+
+        guild_id, user = args  # on_member_join and on_member_remove
+        member = self.user(guild_id, user)
+
+        if name == 'on_member_remove':
+            self.guild(guild_id).members_by_id.pop(member.id, None)
+
+        return name, (member,)
+
+
+def read_log(path):
+    """Reads an event log
+
+    Yields:
+        Tuple[float, string, list, int, int]: Recorded time in seconds since the first session
+            started, event code, arguments, sequence number and seed of the session
+    """
+    offset = 0  # sessions appended to the same file follow each other
+    last = 0
+    seed = 0
+    sequence = 0
+
+    with open_log(path, 'r') as file:
+        for line in file:
+            entry = json.loads(line)
+
+            if isinstance(entry, dict):  # header of a new recording session
+                offset = last
+                seed = entry['seed']
+                sequence = 0
+                continue
+
+            milliseconds, code, *args = entry
+            sequence += 1
+            last = offset + milliseconds / 1000
+
+            yield last, code, args, sequence, seed
+
+
+async def replay(path, speed=0, sequential=False, concurrency=256, latency=0):
+    """Replays a log
+
+    Args:
+        path (string): Log written by EventRecorder
+        speed (float, optional): How many times faster than recorded, 0 for as fast as possible
+        sequential (bool, optional): Whether to wait for every event before starting the next
+        concurrency (int, optional): Handlers allowed to run at the same time
+        latency (float, optional): Seconds added to every database operation
+
+    Returns:
+        dict: Report of the replay
+    """
+    client = MemoryClient(latency, bot_utils.metrics)
+    prepare_bot(client)
+    replayer = Replayer()
+    slots = asyncio.Semaphore(1 if sequential else concurrency)
+    latencies = {}
+    errors = {}
+    tasks = set()
+    count = 0
+    recorded_seconds = 0
+    flusher = asyncio.ensure_future(bot.xp_buffer.run())
+    started = time.perf_counter()
+
+    async def handle(name, args, rng):
+        bot_utils.event_rng.set(rng)  # only affects this task
+        handler_started = time.perf_counter()
+
+        try:
+            await getattr(bot.bot, name)(*args)
+        except Exception as error:
+            errors.setdefault(name, []).append(repr(error))
+        finally:
+            latencies.setdefault(name, []).append(time.perf_counter() - handler_started)
+            slots.release()
+
+    for recorded_seconds, code, args, sequence, seed in read_log(path):
+        if speed:
+            delay = recorded_seconds / speed - (time.perf_counter() - started)
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        await slots.acquire()
+        name, handler_args = replayer.decode(code, args)
+        task = asyncio.ensure_future(handle(name, handler_args, random.Random(event_seed(seed, sequence))))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        count += 1
+
+    if tasks:
+        await asyncio.gather(*tasks)
+
+    for user_key in list(bot.ongoing_calls):
+        bot.end_call(user_key)
+
+    flusher.cancel()
+    await bot.xp_buffer.flush_async()
+    seconds = time.perf_counter() - started
+
+    return {
+        'scenario': 'replay',
+        'log': path,
+        'events': count,
+        'speed': speed,
+        'sequential': sequential,
+        'recorded_seconds': recorded_seconds,
+        'seconds': seconds,
+        'speedup': recorded_seconds / seconds if seconds else 0,
+        'events_per_second': count / seconds if seconds else 0,
+        'db_ops': client.operations,
+        'guilds': len(replayer.guilds),
+        'handlers': {name: {'count': len(values),
+                            'p50_ms': percentile(values, 0.5) * 1000,
+                            'p99_ms': percentile(values, 0.99) * 1000,
+                            'errors': len(errors.get(name, ()))}
+                     for name, values in sorted(latencies.items())},
+        'first_errors': {name: messages[0] for name, messages in errors.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replays a recorded event log through the bot')
+    parser.add_argument('log')
+    parser.add_argument('--speed', type=float, default=0, help='times faster than recorded, 0 for no waiting')
+    parser.add_argument('--sequential', action='store_true', help='run one event at a time')
+    parser.add_argument('--concurrency', type=int, default=256)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every database operation')
+    parser.add_argument('--json', help='append the report to this JSON lines file')
+    args = parser.parse_args()
+
+    report = bot.bot.loop.run_until_complete(
+        replay(args.log, args.speed, args.sequential, args.concurrency, args.latency))
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'a') as file:
+            file.write(json.dumps(report, default=str) + '\n')
+
+
+if __name__ == "__main__":
+    main()